@@ -0,0 +1,222 @@
+"""Stub local da API Servimed (peapi) em HTTPS, com HTTP/2 via ALPN.
+
+Serve login, timestamp, clientes e um catálogo sintético paginado, com latência
+e limite de page size configuráveis. Comprime as respostas com brotli (se o
+pacote estiver instalado) ou gzip conforme o Accept-Encoding. Conta conexões
+TLS e requisições por protocolo em ``GET /__stats`` (``POST /__reset`` zera).
+
+    python benchmarks/api_stub.py --port 8443 --products 20000 --max-page-size 20
+    python benchmarks/api_stub.py --no-h2     # só HTTP/1.1 (testa o fallback)
+
+Requer Twisted, pyOpenSSL e cryptography; HTTP/2 requer o extra ``http2``.
+"""
+
+import argparse
+import base64
+import datetime
+import gzip
+import json
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+from twisted.internet import reactor, ssl
+from twisted.web import resource, server
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def _b64url(data: dict) -> str:
+    raw = json.dumps(data).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def fake_jwt(payload: dict) -> str:
+    return ".".join([_b64url({"alg": "none", "typ": "JWT"}), _b64url(payload), "stub"])
+
+
+def self_signed_pem(host: str = "localhost") -> bytes:
+    """Chave + certificado autoassinado em PEM (o Scrapy não valida certificados)."""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, host)])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=30))
+        .sign(key, hashes.SHA256())
+    )
+    return key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.TraditionalOpenSSL,
+        serialization.NoEncryption(),
+    ) + cert.public_bytes(serialization.Encoding.PEM)
+
+
+def make_product(i: int) -> dict:
+    return {
+        "codigoBarras": f"{7890000000000 + i}",
+        "codigoExterno": 100000 + i,
+        "descricao": f"PRODUTO TESTE {i} 500MG CX 30 COMPRIMIDOS",
+        "valorBase": round(10 + (i % 997) * 0.37, 2),
+        "quantidadeEstoque": i % 500,
+    }
+
+
+class StubAPI(resource.Resource):
+    isLeaf = True
+
+    def __init__(self, products: int, max_page_size: int, latency: float, stats: Counter):
+        super().__init__()
+        self.products = products
+        self.max_page_size = max_page_size
+        self.latency = latency
+        self.stats = stats
+
+    # --- roteamento --------------------------------------------------------
+
+    def render(self, request):
+        path = request.path.decode("utf-8")
+        proto = "h2" if request.clientproto == b"HTTP/2" else "http/1.1"
+        if path == "/__stats":
+            return self._json(request, dict(self.stats), compress=False)
+        if path == "/__reset":
+            self.stats.clear()
+            return self._json(request, {"ok": True}, compress=False)
+
+        self.stats[f"requests/{proto}"] += 1
+        body = request.content.read() if request.content else b""
+        try:
+            data = json.loads(body) if body else {}
+        except ValueError:
+            data = {}
+
+        if path == "/api/usuario/login":
+            token = fake_jwt({"codigoUsuario": 4242, "token": "stub-access-token"})
+            request.addCookie("accesstoken", token, path="/")
+            payload = {"usuario": {"codigoExterno": 777, "users": [4242]}}
+        elif path == "/api/Produto/get-timestamp":
+            payload = {"timestamp": int(time.time() * 1000)}
+        elif path == "/api/cliente/findByFilter":
+            payload = {"lista": [{"codigo": 1, "situacao": "ATIVO"}]}
+        elif path == "/api/carrinho/oculto":
+            payload = {"lista": self._page(data)}
+        else:
+            request.setResponseCode(404)
+            return self._json(request, {"erro": "not found"}, compress=False)
+
+        if not self.latency:
+            return self._json(request, payload)
+        reactor.callLater(self.latency, self._finish_later, request, payload)
+        return server.NOT_DONE_YET
+
+    def _page(self, data: dict) -> list:
+        page = max(1, int(data.get("pagina") or 1))
+        size = max(1, int(data.get("registrosPorPagina") or 20))
+        size = min(size, self.max_page_size)
+        start = (page - 1) * size
+        end = min(start + size, self.products)
+        return [make_product(i) for i in range(start, end)]
+
+    # --- resposta ----------------------------------------------------------
+
+    def _finish_later(self, request, payload):
+        if request._disconnected:
+            return
+        request.write(self._json(request, payload))
+        request.finish()
+
+    def _json(self, request, payload, compress: bool = True) -> bytes:
+        raw = json.dumps(payload).encode("utf-8")
+        request.setHeader(b"content-type", b"application/json; charset=utf-8")
+        accept = (request.getHeader(b"accept-encoding") or b"").decode("latin-1")
+        encodings = {e.split(";")[0].strip() for e in accept.split(",")}
+        if compress and brotli is not None and "br" in encodings:
+            raw = brotli.compress(raw, quality=4)
+            request.setHeader(b"content-encoding", b"br")
+            self.stats["encoding/br"] += 1
+        elif compress and "gzip" in encodings:
+            raw = gzip.compress(raw, compresslevel=5)
+            request.setHeader(b"content-encoding", b"gzip")
+            self.stats["encoding/gzip"] += 1
+        self.stats["bytes_out"] += len(raw)
+        return raw
+
+
+class CountingSite(server.Site):
+    def __init__(self, *args, stats: Counter, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = stats
+
+    def buildProtocol(self, addr):
+        self.stats["connections"] += 1
+        return super().buildProtocol(addr)
+
+
+def listen(
+    port: int = 0,
+    products: int = 20000,
+    max_page_size: int = 20,
+    latency: float = 0.0,
+    h2: bool = True,
+    interface: str = "127.0.0.1",
+):
+    """Sobe o stub no reactor global; retorna (porta escutando, Counter de stats)."""
+    stats: Counter = Counter()
+    site = CountingSite(
+        StubAPI(products, max_page_size, latency, stats), stats=stats
+    )
+    site.noisy = False
+    pem = self_signed_pem()
+    with tempfile.NamedTemporaryFile(suffix=".pem", delete=False) as fh:
+        fh.write(pem)
+    cert = ssl.PrivateCertificate.loadPEM(Path(fh.name).read_text())
+    Path(fh.name).unlink()
+    protocols = [b"h2", b"http/1.1"] if h2 else [b"http/1.1"]
+    options = ssl.CertificateOptions(
+        privateKey=cert.privateKey.original,
+        certificate=cert.original,
+        acceptableProtocols=protocols,
+    )
+    listening = reactor.listenSSL(port, site, options, interface=interface)
+    return listening, stats
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--port", type=int, default=8443)
+    p.add_argument("--products", type=int, default=20000)
+    p.add_argument("--max-page-size", type=int, default=20)
+    p.add_argument("--latency-ms", type=float, default=20.0)
+    p.add_argument("--no-h2", action="store_true", help="Oferece só http/1.1 no ALPN.")
+    args = p.parse_args(argv)
+
+    listening, _ = listen(
+        args.port,
+        args.products,
+        args.max_page_size,
+        args.latency_ms / 1000.0,
+        h2=not args.no_h2,
+    )
+    port = listening.getHost().port
+    print(f"stub ouvindo em https://127.0.0.1:{port}", flush=True)
+    reactor.run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,211 @@
+"""HTTP/1.1 vs HTTP/2 contra o stub local da API (``api_stub.py``).
+
+Sobe o stub num subprocesso e roda um crawl por modo, cada um num processo
+novo (o reactor do Twisted não reinicia). O padrão ``fanout`` faz login pelo
+fluxo real do ProductsSpider e então pede as N páginas em paralelo, que é onde
+a multiplexação importa; ``serial`` roda a paginação normal do spider.
+
+    python benchmarks/bench_http2.py --pages 1000 --concurrency 32 --latency-ms 20
+    python benchmarks/bench_http2.py --stub-no-h2   # mede o fallback para HTTP/1.1
+"""
+
+import argparse
+import json
+import os
+import ssl
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+SCRAPER_DIR = ROOT / "servimedScraper"
+HERE = Path(__file__).resolve().parent
+PY = sys.executable
+
+
+# --------------------------------------------------------------------------
+# Processo do crawl
+# --------------------------------------------------------------------------
+
+
+def _worker(args) -> int:
+    sys.path.insert(0, str(SCRAPER_DIR))
+    os.chdir(SCRAPER_DIR)
+    os.environ["SERVIMED_PAGE_SIZE_CACHE"] = ""
+
+    from scrapy.crawler import CrawlerProcess
+    from scrapy.utils.project import get_project_settings
+
+    from servimedScraper.spiders.products import ProductsSpider
+
+    class FanOutSpider(ProductsSpider):
+        name = "products_fanout"
+
+        def find_valid_clientId(self, response, page):
+            item = response.json()["lista"][0]
+            for p in range(args.pages):
+                yield self._products_request(item, p * self.page_size)
+
+        def parse_products(self, response, page, clientID, item):
+            for product in response.json().get("lista", []):
+                yield {"codigo": str(product.get("codigoExterno", ""))}
+
+    spidercls = FanOutSpider if args.pattern == "fanout" else ProductsSpider
+
+    settings = get_project_settings()
+    for key, value in {
+        "LOG_LEVEL": "WARNING",
+        "ROBOTSTXT_OBEY": False,
+        "AUTOTHROTTLE_ENABLED": False,
+        "DOWNLOAD_DELAY": 0,
+        "CONCURRENT_REQUESTS": args.concurrency,
+        "CONCURRENT_REQUESTS_PER_DOMAIN": args.concurrency,
+        "SERVIMED_API_BASE": args.base,
+        "SERVIMED_HTTP2_ENABLED": args.worker == "h2",
+        "SERVIMED_HTTP2_DOMAINS": ["127.0.0.1"],
+        "SERVIMED_HTTP2_MAX_STREAMS": args.concurrency,
+        "SERVIMED_PAGE_SIZE": args.page_size,
+        "SERVIMED_PAGE_SIZE_MIN": args.page_size,
+        "FEEDS": {},
+    }.items():
+        settings.set(key, value, priority="cmdline")
+
+    process = CrawlerProcess(settings, install_root_handler=False)
+    crawler = process.create_crawler(spidercls)
+    process.crawl(crawler, usuario="bench", senha="bench", sale_type=1)
+    t0, cpu0 = time.perf_counter(), time.process_time()
+    process.start()
+    elapsed, cpu = time.perf_counter() - t0, time.process_time() - cpu0
+
+    from twisted.internet import reactor
+
+    loop = getattr(reactor, "_asyncioEventloop", None)
+
+    stats = crawler.stats.get_stats()
+    print(
+        json.dumps(
+            {
+                "secs": elapsed,
+                "cpu": cpu,
+                "reactor": type(reactor).__name__,
+                "loop": type(loop).__name__ if loop is not None else None,
+                "items": stats.get("item_scraped_count", 0),
+                "responses": stats.get("downloader/response_count", 0),
+                "http2": stats.get("servimed/http2/requests", 0),
+                "http11": stats.get("servimed/http11/requests", 0),
+                "fallback": stats.get("servimed/http2/fallback", 0),
+                "bytes": stats.get("downloader/response_bytes", 0),
+            }
+        )
+    )
+    return 0
+
+
+# --------------------------------------------------------------------------
+# Orquestração
+# --------------------------------------------------------------------------
+
+
+def _stub_call(base: str, path: str) -> dict:
+    ctx = ssl.create_default_context()
+    ctx.check_hostname = False
+    ctx.verify_mode = ssl.CERT_NONE
+    with urllib.request.urlopen(f"{base}{path}", context=ctx, timeout=10) as resp:
+        return json.loads(resp.read())
+
+
+def _start_stub(args) -> tuple[subprocess.Popen, str]:
+    cmd = [
+        PY,
+        str(HERE / "api_stub.py"),
+        "--port",
+        "0",
+        "--products",
+        str(args.pages * args.page_size),
+        "--max-page-size",
+        str(args.page_size),
+        "--latency-ms",
+        str(args.latency_ms),
+    ]
+    if args.stub_no_h2:
+        cmd.append("--no-h2")
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+    line = proc.stdout.readline().strip()
+    if not line.startswith("stub ouvindo em "):
+        proc.kill()
+        raise RuntimeError(f"stub não subiu: {line!r}")
+    return proc, line.rsplit(" ", 1)[-1]
+
+
+def run_mode(mode: str, base: str, args) -> dict:
+    _stub_call(base, "/__reset")
+    cmd = [
+        PY,
+        __file__,
+        "--worker",
+        mode,
+        "--base",
+        base,
+        "--pages",
+        str(args.pages),
+        "--page-size",
+        str(args.page_size),
+        "--concurrency",
+        str(args.concurrency),
+        "--pattern",
+        args.pattern,
+    ]
+    out = subprocess.run(cmd, capture_output=True, text=True)
+    if out.returncode != 0:
+        raise RuntimeError(f"crawl {mode} falhou:\n{out.stderr[-2000:]}")
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    stub = _stub_call(base, "/__stats")
+    # a própria chamada de /__stats abre uma conexão
+    result["connections"] = stub.get("connections", 1) - 1
+    result["stub"] = stub
+    result["mode"] = mode
+    return result
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--pages", type=int, default=1000)
+    p.add_argument("--page-size", type=int, default=20)
+    p.add_argument("--concurrency", type=int, default=32)
+    p.add_argument("--latency-ms", type=float, default=20.0)
+    p.add_argument("--pattern", choices=["fanout", "serial"], default="fanout")
+    p.add_argument("--modes", nargs="+", choices=["h1", "h2"], default=["h1", "h2"])
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--stub-no-h2", action="store_true")
+    p.add_argument("--worker", choices=["h1", "h2"], help=argparse.SUPPRESS)
+    p.add_argument("--base", help=argparse.SUPPRESS)
+    args = p.parse_args(argv)
+
+    if args.worker:
+        return _worker(args)
+
+    stub, base = _start_stub(args)
+    try:
+        print(
+            f"{args.pages} páginas x {args.page_size} itens, concorrência {args.concurrency}, "
+            f"latência {args.latency_ms:.0f}ms, padrão {args.pattern}"
+        )
+        for mode in args.modes:
+            runs = [run_mode(mode, base, args) for _ in range(args.repeat)]
+            best = min(runs, key=lambda r: r["secs"])
+            print(
+                f"{mode:<4} {best['secs']:>7.2f}s  {best['responses'] / best['secs']:>8.0f} req/s  "
+                f"conexões={best['connections']:<4} itens={best['items']:<7} "
+                f"h2={best['http2']} h1={best['http11']} fallback={best['fallback']} "
+                f"bytes={best['bytes']}"
+            )
+    finally:
+        stub.terminate()
+        stub.wait()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""Throughput do ProductPublisher (mensagens/s e itens/s).
+
+Por padrão usa o broker em processo de ``standins.py`` (confirm com latência
+simulada), o que isola o custo do publisher; ``--amqp`` publica num RabbitMQ
+real (RABBIT_HOST/RABBIT_PORT).
+
+    python benchmarks/bench_publisher.py --items 200000 --batch 100 500 --window 1 32 256
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from servimedQueue.utils.post_products import ProductPublisher  # noqa: E402
+from standins import LoopbackBroker  # noqa: E402
+
+
+def make_products(n: int) -> list[dict]:
+    return [
+        {
+            "gtin": f"{7890000000000 + i}",
+            "codigo": str(100000 + i),
+            "descricao": f"PRODUTO TESTE {i} 500MG CX 30 COMPRIMIDOS",
+            "preco_fabrica": round(10 + (i % 997) * 0.37, 2),
+            "estoque": i % 500,
+        }
+        for i in range(n)
+    ]
+
+
+def run_once(products, batch: int, window: int, args) -> dict:
+    factory = None
+    broker = None
+    if not args.amqp:
+        broker = LoopbackBroker(
+            confirm_latency=args.confirm_latency_ms / 1000.0,
+            confirm_every=args.confirm_every,
+            nack_rate=args.nack_rate,
+        )
+        factory = broker.connection_factory
+    pub = ProductPublisher(
+        queue=args.queue,
+        batch_size=batch,
+        window=window,
+        connection_factory=factory,
+    ).start()
+    t0 = time.perf_counter()
+    pub.publish(products)
+    pub.flush()
+    dt = time.perf_counter() - t0
+    pub.close()
+    return {
+        "batch": batch,
+        "window": window,
+        "secs": dt,
+        "msgs_s": pub.stats["messages"] / dt,
+        "items_s": len(products) / dt,
+        "retried": pub.stats["retried"],
+        "failed": pub.stats["failed"],
+    }
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--items", type=int, default=100_000)
+    p.add_argument("--batch", type=int, nargs="+", default=[1, 100, 500])
+    p.add_argument("--window", type=int, nargs="+", default=[1, 32, 256])
+    p.add_argument("--confirm-latency-ms", type=float, default=0.5)
+    p.add_argument("--confirm-every", type=int, default=16)
+    p.add_argument("--nack-rate", type=float, default=0.0)
+    p.add_argument("--queue", default="bench.products")
+    p.add_argument("--amqp", action="store_true", help="Usa um RabbitMQ real.")
+    args = p.parse_args(argv)
+
+    products = make_products(args.items)
+    print(f"{'lote':>6} {'janela':>7} {'tempo(s)':>9} {'msgs/s':>10} {'itens/s':>11} {'retries':>8} {'falhas':>7}")
+    for batch in args.batch:
+        for window in args.window:
+            r = run_once(products, batch, window, args)
+            print(
+                f"{r['batch']:>6} {r['window']:>7} {r['secs']:>9.2f} {r['msgs_s']:>10.0f} "
+                f"{r['items_s']:>11.0f} {r['retried']:>8} {r['failed']:>7}"
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+"""Overhead do reactor: Twisted nativo vs asyncio vs asyncio + uvloop.
+
+Usa o mesmo stub e o mesmo crawl em leque de ``bench_http2.py`` (login pelo
+fluxo real e N páginas em paralelo, HTTP/1.1); só muda o reactor, via
+SERVIMED_REACTOR / SERVIMED_UVLOOP no processo do crawl. Com latência baixa e
+concorrência alta o tempo de CPU por resposta é dominado pelo reactor.
+
+    python benchmarks/bench_reactor.py --pages 2000 --concurrency 128 --latency-ms 2
+"""
+
+import argparse
+import importlib.util
+import os
+import sys
+
+import bench_http2
+
+MODES = {
+    "default": {"SERVIMED_REACTOR": "default", "SERVIMED_UVLOOP": "0"},
+    "asyncio": {"SERVIMED_REACTOR": "asyncio", "SERVIMED_UVLOOP": "0"},
+    "uvloop": {"SERVIMED_REACTOR": "asyncio", "SERVIMED_UVLOOP": "1"},
+}
+
+
+def run_reactor(mode: str, base: str, args) -> dict:
+    saved = {k: os.environ.get(k) for k in MODES[mode]}
+    os.environ.update(MODES[mode])
+    try:
+        return bench_http2.run_mode("h1", base, args)
+    finally:
+        for k, v in saved.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--pages", type=int, default=2000)
+    p.add_argument("--page-size", type=int, default=20)
+    p.add_argument("--concurrency", type=int, default=128)
+    p.add_argument("--latency-ms", type=float, default=2.0)
+    p.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    p.add_argument("--repeat", type=int, default=3)
+    args = p.parse_args(argv)
+    args.pattern = "fanout"
+    args.stub_no_h2 = True
+
+    modes = args.modes
+    if "uvloop" in modes and importlib.util.find_spec("uvloop") is None:
+        print("uvloop não instalado; pulando o modo uvloop (pip install '.[uvloop]').")
+        modes = [m for m in modes if m != "uvloop"]
+
+    stub, base = bench_http2._start_stub(args)
+    try:
+        print(
+            f"{args.pages} páginas x {args.page_size} itens, concorrência {args.concurrency}, "
+            f"latência {args.latency_ms:.0f}ms"
+        )
+        for mode in modes:
+            runs = [run_reactor(mode, base, args) for _ in range(args.repeat)]
+            best = min(runs, key=lambda r: r["secs"])
+            responses = max(1, best["responses"])
+            print(
+                f"{mode:<8} {best['secs']:>7.2f}s  {responses / best['secs']:>8.0f} req/s  "
+                f"cpu={best['cpu']:.2f}s ({best['cpu'] / responses * 1e6:.0f}µs/resp)  "
+                f"reactor={best['reactor']} loop={best['loop'] or '-'} itens={best['items']}"
+            )
+    finally:
+        stub.terminate()
+        stub.wait()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+"""Orçamento de tempo de inicialização (cold start) do spider e dos consumers.
+
+Roda cada alvo num interpretador novo com ``-X importtime``, soma o tempo de
+import, mostra os pacotes mais caros e compara com o baseline salvo.
+
+    python benchmarks/importtime.py                 # relatório
+    python benchmarks/importtime.py --save          # grava baseline
+    python benchmarks/importtime.py --check         # falha se regrediu
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+SCRAPER_DIR = ROOT / "servimedScraper"
+BASELINE = Path(__file__).resolve().parent / "importtime_baseline.json"
+
+TARGETS = {
+    # só o módulo: o que o --help e a validação de argumentos pagam
+    "run_spider": "import run_spider",
+    # o que cada --mode importa antes de iniciar o crawl
+    "run_spider:file": "import run_spider; run_spider.load_crawl_modules('file')",
+    "run_spider:stream": "import run_spider; run_spider.load_crawl_modules('stream')",
+    "worker_stream": "import servimedQueue.utils.worker_stream",
+    "order_consumer": "import orderQueue.consumers.order_consumer",
+}
+
+
+def _run(code: str) -> tuple[float, str]:
+    env = os.environ.copy()
+    env["PYTHONPATH"] = os.pathsep.join(
+        [str(SCRAPER_DIR), str(ROOT), env.get("PYTHONPATH", "")]
+    )
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    t0 = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=str(SCRAPER_DIR),
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    wall = time.perf_counter() - t0
+    if proc.returncode != 0:
+        raise RuntimeError(f"{code!r} falhou:\n{proc.stderr[-2000:]}")
+    return wall, proc.stderr
+
+
+def parse_importtime(stderr: str) -> tuple[int, dict[str, int]]:
+    """Retorna (soma do self em µs, soma do self por pacote de topo em µs)."""
+    total = 0
+    by_top: dict[str, int] = defaultdict(int)
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        parts = line[len("import time:") :].split("|")
+        if len(parts) != 3:
+            continue
+        try:
+            self_us = int(parts[0])
+        except ValueError:
+            continue
+        total += self_us
+        by_top[parts[2].strip().split(".")[0]] += self_us
+    return total, dict(by_top)
+
+
+def measure(name: str, repeat: int) -> dict:
+    walls, totals = [], []
+    breakdown: dict[str, int] = {}
+    for _ in range(repeat):
+        wall, stderr = _run(TARGETS[name])
+        total, by_top = parse_importtime(stderr)
+        walls.append(wall * 1000)
+        totals.append(total / 1000)
+        breakdown = by_top
+    return {
+        "wall_ms": round(min(walls), 1),
+        "wall_ms_median": round(statistics.median(walls), 1),
+        "import_ms": round(min(totals), 1),
+        "top": sorted(
+            ((k, round(v / 1000, 1)) for k, v in breakdown.items()),
+            key=lambda kv: kv[1],
+            reverse=True,
+        )[:12],
+    }
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    # Sem `choices`: com nargs="*" o argparse valida a lista vazia (ou o
+    # default inteiro) contra eles e recusa a chamada sem argumentos.
+    p.add_argument("targets", nargs="*", help=f"Alvos (default: todos): {', '.join(TARGETS)}.")
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--save", action="store_true", help="Grava o baseline.")
+    p.add_argument("--check", action="store_true", help="Compara com o baseline.")
+    p.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.20,
+        help="Regressão aceita sobre o baseline (default 0.20 = 20%%).",
+    )
+    args = p.parse_args(argv)
+    unknown = [t for t in args.targets if t not in TARGETS]
+    if unknown:
+        p.error(f"alvo(s) desconhecido(s): {', '.join(unknown)}")
+
+    results = {}
+    for name in args.targets or list(TARGETS):
+        r = measure(name, args.repeat)
+        results[name] = r
+        print(
+            f"{name:<20} wall={r['wall_ms']:>8.1f}ms  import={r['import_ms']:>8.1f}ms"
+        )
+        for pkg, ms in r["top"]:
+            print(f"    {pkg:<28}{ms:>8.1f}ms")
+
+    if args.save:
+        # Salvar só alguns alvos não apaga o baseline dos outros.
+        saved = json.loads(BASELINE.read_text()) if BASELINE.exists() else {}
+        saved.update(results)
+        BASELINE.write_text(json.dumps(saved, indent=2, sort_keys=True) + "\n")
+        print(f"Baseline salvo em {BASELINE}")
+
+    if args.check:
+        if not BASELINE.exists():
+            print(f"Baseline ausente ({BASELINE}); rode com --save.", file=sys.stderr)
+            return 2
+        baseline = json.loads(BASELINE.read_text())
+        failed = False
+        for name, r in results.items():
+            base = baseline.get(name)
+            if not base:
+                continue
+            limit = base["import_ms"] * (1 + args.tolerance)
+            status = "OK"
+            if r["import_ms"] > limit:
+                status = "REGRESSÃO"
+                failed = True
+            print(
+                f"{status:<10}{name:<20} {r['import_ms']:.1f}ms (baseline {base['import_ms']:.1f}ms, limite {limit:.1f}ms)"
+            )
+        return 1 if failed else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,563 @@
+"""Teste de carga ponta a ponta: fila -> consumer -> spider/API -> ACK.
+
+Cenários:
+
+- ``scrape``: mensagem de scrape -> ConsumerServimed -> start_scrap ->
+  run_spider.py (contra ``api_stub.py``) -> post_items na API de produtos stub;
+- ``orders``: pedido -> ProductPosterConsumer -> API_ORDER_URL stub.
+
+Os stubs HTTP (Servimed, token, produtos, pedidos) rodam neste processo. Cada
+configuração (``--config nome:CHAVE=valor,...``) roda num processo novo, com as
+variáveis aplicadas antes dos imports (os módulos leem o env na importação):
+publica M mensagens a ``--rate`` msg/s, consome com ``--replicas`` consumers
+(threads, cada um com a própria conexão) e mede vazão, latência ponta a ponta
+(publicação -> ACK/NACK final, atravessando as retentativas), reentregas e
+CPU/RSS do processo e dos spiders. O broker é o stand-in em memória de
+``standins.py``; ``--amqp`` usa um RabbitMQ real (RABBIT_HOST/RABBIT_PORT).
+
+    python benchmarks/loadtest.py orders --messages 2000 --rate 200 \\
+        --config p1:RABBIT_PREFETCH=1 --config p16:RABBIT_PREFETCH=16 \\
+        --config coalesce:RABBIT_PREFETCH=16,ORDER_COALESCE=true
+    python benchmarks/loadtest.py scrape --messages 20 --replicas 2 --catalogue 4000 \\
+        --config pool:SCRAPER_POOL=true --config nopool:SCRAPER_POOL=false
+"""
+
+import argparse
+import gzip
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from types import SimpleNamespace
+
+ROOT = Path(__file__).resolve().parent.parent
+HERE = Path(__file__).resolve().parent
+PY = sys.executable
+
+ID_HEADER = "x-loadtest-id"
+SENT_HEADER = "x-loadtest-sent"
+RESULT_PREFIX = "LOADTEST "
+
+
+# --------------------------------------------------------------------------
+# Stubs HTTP da plataforma (token, produtos, pedidos)
+# --------------------------------------------------------------------------
+
+
+class PlatformStub:
+    """Token (password grant), API de produtos e API de pedidos, com latência
+    e taxa de 503 configuráveis. ``GET /__stats`` devolve os contadores."""
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.stats: Counter = Counter()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self.base = f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self) -> "PlatformStub":
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+
+    def snapshot(self, reset: bool = False) -> dict:
+        with self._lock:
+            out = dict(self.stats)
+            if reset:
+                self.stats.clear()
+        return out
+
+    def _count(self, **inc) -> None:
+        with self._lock:
+            self.stats.update(inc)
+
+    def _fail(self) -> bool:
+        if not self.error_rate:
+            return False
+        with self._lock:
+            self.stats["_seq"] += 1
+            n = self.stats["_seq"]
+        # determinístico: 1 erro a cada 1/error_rate chamadas
+        return int(n * self.error_rate) != int((n - 1) * self.error_rate)
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status: int, payload: dict) -> None:
+                raw = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(raw)))
+                self.end_headers()
+                self.wfile.write(raw)
+
+            def do_GET(self):
+                if self.path == "/__stats":
+                    self._reply(200, stub.snapshot())
+                else:
+                    self._reply(404, {"erro": "not found"})
+
+            def do_POST(self):
+                raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                if self.path == "/token":
+                    stub._count(token_requests=1)
+                    self._reply(
+                        200,
+                        {"access_token": "loadtest", "token_type": "Bearer", "expires_in": 3600},
+                    )
+                    return
+                if self.path not in ("/produtos", "/pedidos"):
+                    self._reply(404, {"erro": "not found"})
+                    return
+                kind = self.path.strip("/")
+                if stub.latency:
+                    time.sleep(stub.latency)
+                if stub._fail():
+                    stub._count(**{f"{kind}/503": 1})
+                    self._reply(503, {"erro": "indisponível (injetado)"})
+                    return
+                if self.headers.get("Content-Encoding") == "gzip":
+                    raw = gzip.decompress(raw)
+                body = json.loads(raw or b"[]")
+                n = len(body) if isinstance(body, list) else 1
+                stub._count(**{f"{kind}/posts": 1, f"{kind}/itens": n, f"{kind}/bytes": len(raw)})
+                self._reply(201 if kind == "pedidos" else 200, {"ok": True, "itens": n})
+
+        return Handler
+
+
+# --------------------------------------------------------------------------
+# Processo de uma configuração
+# --------------------------------------------------------------------------
+
+
+class Recorder:
+    """Segue cada mensagem (header x-loadtest-id) da publicação até o desfecho
+    final, atravessando NACK requeue e as filas de atraso."""
+
+    TERMINAL = ("acked", "dropped", "parked")
+
+    def __init__(self, expected: int):
+        self.expected = expected
+        self.sent: dict[int, float] = {}
+        self.finished: dict[int, float] = {}
+        self.state: dict[int, str] = {}
+        self.deliveries: Counter = Counter()
+        self.redelivered = 0
+        self.done = threading.Event()
+        self._tags: dict[tuple, int] = {}
+        self._instrumented: set[int] = set()
+        self._lock = threading.Lock()
+
+    def published(self, mid: int, ts: float) -> None:
+        with self._lock:
+            self.sent[mid] = ts
+
+    def wrap(self, callback):
+        def on_message(ch, method, properties, body):
+            if id(ch) not in self._instrumented:
+                self.instrument(ch)  # canais de shard do ConsumerServimed
+            mid = (getattr(properties, "headers", None) or {}).get(ID_HEADER)
+            if mid is not None:
+                with self._lock:
+                    self.deliveries[mid] += 1
+                    self.redelivered += bool(method.redelivered)
+                    self.state[mid] = "inflight"
+                    self._tags[(id(ch), method.delivery_tag)] = mid
+            return callback(ch, method, properties, body)
+
+        return on_message
+
+    def instrument(self, ch) -> None:
+        self._instrumented.add(id(ch))
+        ack, nack, publish = ch.basic_ack, ch.basic_nack, ch.basic_publish
+
+        def basic_ack(delivery_tag=0, multiple=False):
+            self._settled(ch, delivery_tag, "acked")
+            return ack(delivery_tag=delivery_tag, multiple=multiple)
+
+        def basic_nack(delivery_tag=0, multiple=False, requeue=True):
+            self._settled(ch, delivery_tag, "requeued" if requeue else "dropped")
+            return nack(delivery_tag=delivery_tag, multiple=multiple, requeue=requeue)
+
+        def basic_publish(exchange, routing_key, body, properties=None, mandatory=False):
+            mid = (getattr(properties, "headers", None) or {}).get(ID_HEADER)
+            if mid is not None:
+                with self._lock:
+                    if ".parking" in routing_key:
+                        self.state[mid] = "parking"
+                    elif ".delay." in exchange:
+                        self.state[mid] = "retry"
+            return publish(
+                exchange=exchange,
+                routing_key=routing_key,
+                body=body,
+                properties=properties,
+                mandatory=mandatory,
+            )
+
+        ch.basic_ack, ch.basic_nack, ch.basic_publish = basic_ack, basic_nack, basic_publish
+
+    def _settled(self, ch, delivery_tag, outcome: str) -> None:
+        with self._lock:
+            mid = self._tags.pop((id(ch), delivery_tag), None)
+            if mid is None:
+                return
+            current = self.state.get(mid)
+            if outcome == "acked" and current == "retry":
+                return  # ACK da entrega que foi para a fila de atraso
+            if outcome == "acked" and current == "parking":
+                outcome = "parked"
+            self.state[mid] = outcome
+            if outcome in self.TERMINAL:
+                self.finished[mid] = time.time()
+                if len(self.finished) >= self.expected:
+                    self.done.set()
+
+    def report(self) -> dict:
+        with self._lock:
+            lat = sorted(self.finished[m] - self.sent[m] for m in self.finished if m in self.sent)
+            outcomes = Counter(self.state[m] for m in self.finished)
+            start = min(self.sent.values(), default=0.0)
+            end = max(self.finished.values(), default=start)
+            redeliveries = sum(n - 1 for n in self.deliveries.values() if n > 1)
+            return {
+                "published": len(self.sent),
+                "completed": len(self.finished),
+                "unfinished": len(self.sent) - len(self.finished),
+                "outcomes": dict(outcomes),
+                "secs": end - start,
+                "throughput": len(self.finished) / (end - start) if end > start else 0.0,
+                "latency": {f"p{q}": _pct(lat, q) for q in (50, 90, 99)} | {"max": lat[-1] if lat else None},
+                "redeliveries": redeliveries,
+                "redelivered_flag": self.redelivered,
+            }
+
+
+def _pct(ordered: list, q: float):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered))) - 1))]
+
+
+def _make_body(scenario: str, i: int, args) -> bytes:
+    usuario = f"loadtest{i % args.accounts}@exemplo"
+    if scenario == "scrape":
+        msg = {"usuario": usuario, "senha": "loadtest", "tipo de venda": 1}
+    else:
+        msg = {
+            "usuario": usuario,
+            "senha": "loadtest",
+            "id_pedido": i,
+            "produtos": [
+                {"gtin": f"{7890000000000 + k}", "codigo": str(100000 + k), "quantidade": 1}
+                for k in range(args.order_items)
+            ],
+        }
+    return json.dumps(msg).encode("utf-8")
+
+
+def _connection_params():
+    import pika
+
+    return pika.ConnectionParameters(
+        host=os.getenv("RABBIT_HOST", "localhost"),
+        port=int(os.getenv("RABBIT_PORT", "5672")),
+        credentials=pika.PlainCredentials(
+            os.getenv("RABBIT_USER", "guest"), os.getenv("RABBIT_PASS", "guest")
+        ),
+    )
+
+
+def _publish(args, queue: str, recorder: Recorder) -> None:
+    import pika
+
+    conn = pika.BlockingConnection(_connection_params())
+    ch = conn.channel()
+    router = None
+    if args.scenario == "scrape":
+        # Com SCRAPER_ROUTING ligado, publica como o produtor: pelo shard da conta.
+        from shared.routing import AccountRouter
+
+        router = AccountRouter(queue=queue)
+        router.declare(ch)
+    else:
+        ch.queue_declare(queue=queue, durable=True)
+    interval = 1.0 / args.rate if args.rate else 0.0
+    t0 = time.monotonic()
+    for i in range(args.messages):
+        if interval:
+            delay = t0 + i * interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        now = time.time()
+        recorder.published(i, now)
+        body = _make_body(args.scenario, i, args)
+        properties = pika.BasicProperties(
+            delivery_mode=2, headers={ID_HEADER: i, SENT_HEADER: now}
+        )
+        if router is not None:
+            router.publish(ch, body, usuario=json.loads(body)["usuario"], properties=properties)
+        else:
+            ch.basic_publish(exchange="", routing_key=queue, body=body, properties=properties)
+    conn.close()
+
+
+def _consumer(scenario: str, queue: str, recorder: Recorder) -> SimpleNamespace:
+    if scenario == "scrape":
+        from servimedQueue.consumers.consumer_start_scrapy import ConsumerServimed
+        from servimedQueue.utils import worker_stream
+        from shared.routing import AccountRouter
+
+        c = ConsumerServimed(
+            recorder.wrap(worker_stream.start_scrap),
+            queue=queue,
+            router=AccountRouter(queue=queue),
+        )
+        recorder.instrument(c.channel)
+        return SimpleNamespace(start=c.start, conn=c.connection, ch=c.channel)
+
+    from orderQueue.consumers.order_consumer import ProductPosterConsumer
+
+    c = ProductPosterConsumer(queue=queue)
+    c._on_message = recorder.wrap(c._on_message)
+    recorder.instrument(c._ch)
+    return SimpleNamespace(start=c.start, conn=c._conn, ch=c._ch)
+
+
+def _worker(args) -> int:
+    sys.path.insert(0, str(ROOT))
+    sys.path.insert(0, str(HERE))
+    broker = None
+    if not args.amqp:
+        import pika
+
+        from standins import BlockingLoopbackBroker
+
+        broker = BlockingLoopbackBroker()
+        # Os consumers abrem a conexão com pika.BlockingConnection(params).
+        pika.BlockingConnection = broker.connect
+
+    queue = args.queue
+    recorder = Recorder(args.messages)
+    consumers = [_consumer(args.scenario, queue, recorder) for _ in range(args.replicas)]
+    threads = [threading.Thread(target=c.start, daemon=True) for c in consumers]
+    cpu0, wall0 = time.process_time(), time.monotonic()
+    for t in threads:
+        t.start()
+
+    publisher = threading.Thread(target=_publish, args=(args, queue, recorder), daemon=True)
+    publisher.start()
+    finished = recorder.done.wait(args.timeout)
+    publisher.join(timeout=5)
+
+    for c in consumers:
+        c.conn.add_callback_threadsafe(c.ch.stop_consuming)
+    for t in threads:
+        t.join(timeout=30)
+    cpu = time.process_time() - cpu0
+
+    if args.scenario == "scrape":
+        from servimedQueue.utils import worker_stream
+
+        if worker_stream._POOL is not None:
+            worker_stream._POOL.close()
+
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    result = recorder.report()
+    result.update(
+        {
+            "timed_out": not finished,
+            "wall": time.monotonic() - wall0,
+            "cpu_s": cpu,
+            "maxrss_mb": own.ru_maxrss / 1024,
+            "children_cpu_s": children.ru_utime + children.ru_stime,
+            "children_maxrss_mb": children.ru_maxrss / 1024,
+            "broker": dict(broker.stats) if broker else None,
+        }
+    )
+    print(RESULT_PREFIX + json.dumps(result), flush=True)
+    return 0
+
+
+# --------------------------------------------------------------------------
+# Orquestração
+# --------------------------------------------------------------------------
+
+
+def _parse_config(spec: str) -> tuple[str, dict]:
+    name, _, pairs = spec.partition(":")
+    env = {}
+    for pair in filter(None, pairs.split(",")):
+        key, sep, value = pair.partition("=")
+        if not sep:
+            raise argparse.ArgumentTypeError(f"config inválida: {pair!r} (use CHAVE=valor)")
+        env[key.strip()] = value.strip()
+    return name or "default", env
+
+
+def _scenario_env(args, platform: PlatformStub, servimed_base: str | None) -> dict:
+    env = {
+        "LOG_LEVEL": "WARNING",
+        "RABBIT_HOST": os.getenv("RABBIT_HOST", "localhost"),
+        "PYTHONPATH": os.pathsep.join(p for p in (str(ROOT), os.getenv("PYTHONPATH", "")) if p),
+        "API_TOKEN_URL": f"{platform.base}/token",
+        "API_USERNAME_COTE": "loadtest",
+        "API_PASSWORD_COTE": "loadtest",
+        "RETRY_BASE_MS": "200",
+        "RETRY_FACTOR": "2",
+        "CATALOGUE_DB": "",
+    }
+    if args.scenario == "scrape":
+        env.update(
+            {
+                "API_PRODUCTS_URL": f"{platform.base}/produtos",
+                "PRODUCTS_SINK": "api",
+                "SERVIMED_API_BASE": servimed_base or "",
+                "SERVIMED_PAGE_SIZE": str(args.page_size),
+                "SERVIMED_PAGE_SIZE_CACHE": "",
+                "SCRAPER_POOL": "false",
+            }
+        )
+    else:
+        env["API_ORDER_URL"] = f"{platform.base}/pedidos"
+    return env
+
+
+def run_config(name: str, overrides: dict, base_env: dict, args, platform: PlatformStub) -> dict:
+    platform.snapshot(reset=True)
+    queue = f"loadtest.{args.scenario}"
+    if args.amqp:
+        queue += f".{os.getpid()}.{name}"
+    cmd = [
+        PY,
+        __file__,
+        args.scenario,
+        "--worker",
+        "--queue",
+        queue,
+        "--messages",
+        str(args.messages),
+        "--rate",
+        str(args.rate),
+        "--replicas",
+        str(args.replicas),
+        "--accounts",
+        str(args.accounts),
+        "--order-items",
+        str(args.order_items),
+        "--timeout",
+        str(args.timeout),
+    ]
+    if args.amqp:
+        cmd.append("--amqp")
+    env = os.environ.copy()
+    env.update(base_env)
+    env.update(overrides)
+    out = subprocess.run(cmd, capture_output=True, text=True, env=env, cwd=str(ROOT))
+    lines = [l for l in out.stdout.splitlines() if l.startswith(RESULT_PREFIX)]
+    if out.returncode != 0 or not lines:
+        raise RuntimeError(f"config {name} falhou:\n{(out.stderr or out.stdout)[-2000:]}")
+    result = json.loads(lines[-1][len(RESULT_PREFIX):])
+    result["config"] = name
+    result["env"] = overrides
+    result["api"] = {k: v for k, v in platform.snapshot().items() if not k.startswith("_")}
+    return result
+
+
+def _fmt_secs(v) -> str:
+    return "-" if v is None else f"{v * 1000:.0f}ms" if v < 1 else f"{v:.1f}s"
+
+
+def print_result(r: dict) -> None:
+    lat = r["latency"]
+    print(
+        f"{r['config']:<12} {r['completed']:>5}/{r['published']:<5} {r['throughput']:>8.1f} msg/s  "
+        f"p50={_fmt_secs(lat['p50'])} p90={_fmt_secs(lat['p90'])} p99={_fmt_secs(lat['p99'])}  "
+        f"reentregas={r['redeliveries']} desfechos={r['outcomes']}"
+    )
+    print(
+        f"{'':<12} cpu={r['cpu_s']:.1f}s rss={r['maxrss_mb']:.0f}MB  "
+        f"spiders: cpu={r['children_cpu_s']:.1f}s rss_max={r['children_maxrss_mb']:.0f}MB  "
+        f"api={r['api']}" + ("  [TIMEOUT]" if r["timed_out"] else "")
+    )
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("scenario", choices=["scrape", "orders"])
+    p.add_argument("--messages", "-m", type=int, default=200)
+    p.add_argument("--rate", type=float, default=0.0, help="msg/s (0 = tudo de uma vez)")
+    p.add_argument("--replicas", type=int, default=1, help="consumers por configuração")
+    p.add_argument("--accounts", type=int, default=10, help="contas distintas nas mensagens")
+    p.add_argument("--config", action="append", default=[], metavar="NOME:CHAVE=v,...")
+    p.add_argument("--timeout", type=float, default=600.0)
+    p.add_argument("--amqp", action="store_true", help="RabbitMQ real em vez do stand-in")
+    p.add_argument("--order-items", type=int, default=5)
+    p.add_argument("--catalogue", type=int, default=2000, help="itens por conta (scrape)")
+    p.add_argument("--page-size", type=int, default=200)
+    p.add_argument("--servimed-latency-ms", type=float, default=20.0)
+    p.add_argument("--api-latency-ms", type=float, default=20.0)
+    p.add_argument("--api-error-rate", type=float, default=0.0)
+    p.add_argument("--json", help="grava os resultados neste arquivo")
+    p.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    p.add_argument("--queue", help=argparse.SUPPRESS)
+    args = p.parse_args(argv)
+
+    if args.worker:
+        return _worker(args)
+
+    configs = [_parse_config(c) for c in args.config] or [("default", {})]
+    platform = PlatformStub(args.api_latency_ms / 1000, args.api_error_rate).start()
+    servimed, servimed_base = None, None
+    if args.scenario == "scrape":
+        import bench_http2
+
+        stub_args = SimpleNamespace(
+            pages=max(1, -(-args.catalogue // args.page_size)),
+            page_size=args.page_size,
+            latency_ms=args.servimed_latency_ms,
+            stub_no_h2=True,
+        )
+        servimed, servimed_base = bench_http2._start_stub(stub_args)
+    results = []
+    try:
+        base_env = _scenario_env(args, platform, servimed_base)
+        print(
+            f"{args.scenario}: {args.messages} mensagens, taxa {args.rate or 'livre'} msg/s, "
+            f"{args.replicas} consumer(s), broker {'RabbitMQ' if args.amqp else 'stand-in'}"
+        )
+        for name, overrides in configs:
+            result = run_config(name, overrides, base_env, args, platform)
+            results.append(result)
+            print_result(result)
+    finally:
+        platform.stop()
+        if servimed is not None:
+            servimed.terminate()
+            servimed.wait()
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2), encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
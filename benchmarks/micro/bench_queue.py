@@ -0,0 +1,55 @@
+import pytest
+
+from orderQueue.consumers.order_consumer import ProductPosterConsumer
+from servimedQueue.utils import worker_stream
+from servimedQueue.utils.item_buffer import ItemBuffer
+
+SIZES = [1_000, 10_000, 100_000]
+
+
+def _item(i: int) -> dict:
+    return {
+        "gtin": f"{7890000000000 + i}",
+        "codigo": str(100000 + i),
+        "descricao": f"PRODUTO TESTE {i} 500MG CX 30 COMPRIMIDOS",
+        "preco_fabrica": round(10 + (i % 997) * 0.37, 2),
+        "estoque": i % 500,
+    }
+
+
+@pytest.mark.parametrize("n", [100, 1_000, 10_000])
+def test_validate_envelope(benchmark, n):
+    msg = {
+        "usuario": "bench@exemplo",
+        "senha": "bench",
+        "id_pedido": 1,
+        "produtos": [
+            {"gtin": f"{7890000000000 + i}", "codigo": str(100000 + i), "quantidade": 1 + i % 5}
+            for i in range(n)
+        ],
+    }
+    _, _, produtos = benchmark(ProductPosterConsumer._validate_envelope, msg)
+    assert len(produtos) == n
+
+
+@pytest.mark.parametrize("gzip_on", [True, False], ids=["gzip", "raw"])
+@pytest.mark.parametrize("source", ["list", "buffer"])
+@pytest.mark.parametrize("n", SIZES)
+def test_post_body(benchmark, monkeypatch, n, source, gzip_on):
+    """Serialização (+ gzip) do corpo do POST de produtos, como em post_items."""
+    monkeypatch.setattr(worker_stream, "API_POST_GZIP", gzip_on)
+    items = [_item(i) for i in range(n)]
+    if source == "buffer":
+        buf = ItemBuffer()
+        for item in items:
+            buf.append(item)
+        items = buf
+
+    def run():
+        body = worker_stream._encode_items(items)
+        if hasattr(body, "close"):
+            body.close()
+
+    benchmark.pedantic(run, rounds=5 if n >= 100_000 else 20, warmup_rounds=1)
+    if source == "buffer":
+        items.close()
@@ -0,0 +1,97 @@
+import pytest
+from conftest import API_BASE, PAGE_SIZE
+from scrapy import Request
+from scrapy.http import TextResponse
+
+from servimedScraper.middlewares import ServimedscraperDownloaderMiddleware
+from servimedScraper.utils.jwt import decode_jwt
+from servimedScraper.utils.requests import req_clientIds, req_login, req_products
+from servimedScraper.utils.xcart import generate_x_cart
+
+ITEM = {"codigo": 1, "situacao": "ATIVO"}
+
+
+def _noop(*args, **kwargs):
+    pass
+
+
+def test_parse_products(benchmark, spider, product_pages):
+    url = f"{API_BASE}/api/carrinho/oculto?siteVersion=4.0.27"
+    responses = [
+        TextResponse(
+            url,
+            body=body,
+            encoding="utf-8",
+            request=Request(url, meta={"page_size": PAGE_SIZE, "download_latency": 0.1}),
+        )
+        for body in product_pages
+    ]
+
+    def run():
+        n = 0
+        for page, response in enumerate(responses, start=1):
+            for _ in spider.parse_products(response, page, ITEM["codigo"], ITEM):
+                n += 1
+        return n
+
+    assert benchmark(run) > len(responses)
+
+
+def test_decode_jwt(benchmark):
+    token = (
+        "eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9."
+        "eyJjb2RpZ29Vc3VhcmlvIjo0MjQyLCJ0b2tlbiI6InN0dWItYWNjZXNzLXRva2VuIn0."
+        "c2lnbmF0dXJl"
+    )
+    assert benchmark(decode_jwt, token)["codigoUsuario"] == 4242
+
+
+def test_generate_x_cart(benchmark):
+    assert len(benchmark(generate_x_cart, 1760000000000)) == 64
+
+
+@pytest.mark.parametrize("builder", ["login", "clientIds", "products"])
+def test_request_builder(benchmark, spider, builder):
+    calls = {
+        "login": lambda: req_login(API_BASE, "bench", "bench", callback=_noop, errback=_noop),
+        "clientIds": lambda: req_clientIds(
+            API_BASE, spider.state, 1, callback=_noop, errback=_noop
+        ),
+        "products": lambda: req_products(
+            API_BASE,
+            spider.state,
+            7,
+            ITEM,
+            1,
+            callback=_noop,
+            errback=_noop,
+            page_size=PAGE_SIZE,
+        ),
+    }
+    assert benchmark(calls[builder]).body
+
+
+def test_middleware_process_request(benchmark, spider):
+    mw = ServimedscraperDownloaderMiddleware()
+
+    def setup():
+        request = req_products(
+            API_BASE, spider.state, 7, ITEM, 1, callback=_noop, errback=_noop
+        )
+        return (request, spider), {}
+
+    benchmark.pedantic(mw.process_request, setup=setup, rounds=2000, warmup_rounds=50)
+
+
+def test_product_request_cycle(benchmark, spider):
+    """CPU por página de produtos: requisição, fingerprint (dupefilter) e middleware."""
+    fingerprint = spider.crawler.request_fingerprinter.fingerprint
+    mw = ServimedscraperDownloaderMiddleware()
+    offsets = iter(range(0, 10**12, PAGE_SIZE))
+
+    def run():
+        request = spider._products_request(ITEM, next(offsets))
+        fingerprint(request)
+        mw.process_request(request, spider)
+
+    benchmark(run)
@@ -0,0 +1,97 @@
+"""Fixtures da suíte de micro-benchmarks (rode por ``benchmarks/microbench.py``).
+
+``parse_products`` usa as páginas de produtos de um cassete gravado com
+``run_spider.py --record`` quando BENCH_CASSETTE aponta para ele; sem isso,
+páginas sintéticas no formato da API.
+"""
+
+import base64
+import gzip
+import json
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[2]
+for path in (ROOT, ROOT / "servimedScraper"):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
+
+PAGE_SIZE = 200
+API_BASE = "https://peapi.servimed.com.br"
+
+
+def synthetic_page(page: int, size: int = PAGE_SIZE) -> bytes:
+    start = (page - 1) * size
+    lista = [
+        {
+            "codigoBarras": f"{7890000000000 + i}",
+            "codigoExterno": 100000 + i,
+            "descricao": f"PRODUTO TESTE {i} 500MG CX 30 COMPRIMIDOS",
+            "valorBase": round(10 + (i % 997) * 0.37, 2),
+            "quantidadeEstoque": i % 500,
+        }
+        for i in range(start, start + size)
+    ]
+    return json.dumps({"lista": lista}).encode("utf-8")
+
+
+def cassette_pages(path: str) -> list[bytes]:
+    pages = []
+    with gzip.open(path, "rt", encoding="utf-8") as fh:
+        for line in fh:
+            rec = json.loads(line)
+            if "/api/carrinho/oculto" not in rec["url"] or rec.get("status") != 200:
+                continue
+            body = base64.b64decode(rec["body"])
+            if body[:2] == b"\x1f\x8b":
+                body = gzip.decompress(body)
+            pages.append(body)
+    return pages
+
+
+@pytest.fixture(scope="session")
+def product_pages() -> list[bytes]:
+    path = os.getenv("BENCH_CASSETTE")
+    if path:
+        pages = cassette_pages(path)
+        if pages:
+            return pages
+    return [synthetic_page(p) for p in range(1, 11)]
+
+
+@pytest.fixture
+def spider():
+    from scrapy.utils.reactor import install_reactor, is_reactor_installed
+    from scrapy.utils.test import get_crawler
+
+    from servimedScraper import settings as project_settings
+    from servimedScraper.spiders.products import ProductsSpider
+
+    if not is_reactor_installed():
+        install_reactor("twisted.internet.asyncioreactor.AsyncioSelectorReactor")
+    crawler = get_crawler(
+        ProductsSpider,
+        settings_dict={
+            "SERVIMED_PAGE_SIZE": PAGE_SIZE,
+            "SERVIMED_PAGE_SIZE_CACHE": "",
+            "REQUEST_FINGERPRINTER_CLASS": project_settings.REQUEST_FINGERPRINTER_CLASS,
+        },
+    )
+    spider = crawler._create_spider(usuario="bench", senha="bench", sale_type=1)
+    spider._setup_page_size()
+    spider.page_size_confirmed = True
+    spider.state.update(
+        {
+            "access_token": "eyJhbGciOiJub25lIn0.eyJ0b2tlbiI6ImJlbmNoIn0.stub",
+            "cookie_access_token": "eyJhbGciOiJub25lIn0.eyJ0b2tlbiI6ImJlbmNoIn0.stub",
+            "user_code": 4242,
+            "external_code": 777,
+            "users": [4242, 4243, 4244],
+            "timestamp": 1760000000000,
+            "x-cart": "0" * 64,
+        }
+    )
+    return spider
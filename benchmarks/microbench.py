@@ -0,0 +1,154 @@
+"""Micro-benchmarks (pytest-benchmark) com baselines versionados.
+
+Roda a suíte de ``benchmarks/micro/`` (parse_products, decode_jwt,
+generate_x_cart, builders de requisição, process_request do middleware,
+_validate_envelope e o corpo do POST de produtos em vários tamanhos), grava o
+resultado como baseline e compara rodadas novas com ele pela mediana.
+
+    python benchmarks/microbench.py                     # relatório
+    python benchmarks/microbench.py --save              # grava o baseline
+    python benchmarks/microbench.py --check             # falha se regrediu
+    python benchmarks/microbench.py -k envelope --check --tolerance 0.10
+
+O baseline guarda commit, Python e máquina; compare sempre na mesma máquina
+(``--baseline`` aceita um arquivo por máquina). Com BENCH_CASSETTE o
+parse_products usa páginas de um cassete gravado (``run_spider.py --record``).
+Requer ``pip install pytest-benchmark``.
+"""
+
+import argparse
+import datetime
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+SUITE = Path(__file__).resolve().parent / "micro"
+BASELINE = Path(__file__).resolve().parent / "micro_baseline.json"
+
+
+def run_suite(select: str | None, min_rounds: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        out = Path(tmp) / "bench.json"
+        cmd = [
+            sys.executable,
+            "-m",
+            "pytest",
+            str(SUITE),
+            "-q",
+            "-p",
+            "no:cacheprovider",
+            "-o",
+            "python_files=bench_*.py",
+            f"--rootdir={SUITE}",
+            f"--benchmark-json={out}",
+            f"--benchmark-min-rounds={min_rounds}",
+            "--benchmark-disable-gc",
+            "--benchmark-columns=min,median,mean,stddev,rounds",
+            "--benchmark-sort=fullname",
+        ]
+        if select:
+            cmd += ["-k", select]
+        proc = subprocess.run(cmd, cwd=str(ROOT))
+        if proc.returncode != 0 or not out.exists():
+            raise SystemExit(f"suíte falhou (código {proc.returncode})")
+        data = json.loads(out.read_text())
+    return {
+        b["fullname"].split("::", 1)[-1]: {
+            "median_us": round(b["stats"]["median"] * 1e6, 3),
+            "mean_us": round(b["stats"]["mean"] * 1e6, 3),
+            "stddev_us": round(b["stats"]["stddev"] * 1e6, 3),
+            "rounds": b["stats"]["rounds"],
+        }
+        for b in data["benchmarks"]
+    }
+
+
+def _meta() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=str(ROOT),
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "commit": commit or None,
+        "python": platform.python_version(),
+        "machine": f"{platform.system()} {platform.machine()} {platform.processor()}".strip(),
+        "node": platform.node(),
+        "saved_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+    }
+
+
+def check(results: dict, baseline: dict, tolerance: float) -> bool:
+    meta = baseline.get("meta", {})
+    if meta.get("python") != platform.python_version() or meta.get("node") != platform.node():
+        print(
+            f"Aviso: baseline de {meta.get('node')} / Python {meta.get('python')} "
+            f"(commit {meta.get('commit')}); a comparação só vale na mesma máquina.",
+            file=sys.stderr,
+        )
+    failed = False
+    base = baseline.get("benchmarks", {})
+    for name, r in sorted(results.items()):
+        b = base.get(name)
+        if not b:
+            print(f"{'NOVO':<10}{name}  {r['median_us']:.1f}µs")
+            continue
+        ratio = r["median_us"] / b["median_us"] if b["median_us"] else 1.0
+        status = "OK"
+        if ratio > 1 + tolerance:
+            status = "REGRESSÃO"
+            failed = True
+        elif ratio < 1 - tolerance:
+            status = "MELHOR"
+        print(
+            f"{status:<10}{name}  {r['median_us']:.1f}µs "
+            f"(baseline {b['median_us']:.1f}µs, {ratio - 1:+.0%})"
+        )
+    return failed
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("-k", dest="select", help="Filtro de nomes (como no pytest -k).")
+    p.add_argument("--save", action="store_true", help="Grava o baseline.")
+    p.add_argument("--check", action="store_true", help="Compara com o baseline.")
+    p.add_argument("--baseline", type=Path, default=BASELINE)
+    p.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.20,
+        help="Regressão aceita sobre a mediana do baseline (default 0.20 = 20%%).",
+    )
+    p.add_argument("--min-rounds", type=int, default=20)
+    args = p.parse_args(argv)
+
+    results = run_suite(args.select, args.min_rounds)
+
+    if args.save:
+        data = {"meta": _meta(), "benchmarks": results}
+        if args.select and args.baseline.exists():
+            # Com -k, só atualiza os benchmarks que rodaram.
+            old = json.loads(args.baseline.read_text())
+            data["benchmarks"] = {**old.get("benchmarks", {}), **results}
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps(data, indent=2, sort_keys=True) + "\n")
+        print(f"Baseline salvo em {args.baseline}")
+
+    if args.check:
+        if not args.baseline.exists():
+            print(f"Baseline ausente ({args.baseline}); rode com --save.", file=sys.stderr)
+            return 2
+        return 1 if check(results, json.loads(args.baseline.read_text()), args.tolerance) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,435 @@
+"""Stand-ins locais (em processo) do broker usados pelos benchmarks.
+
+`LoopbackConnection` imita a superfície de ``pika.SelectConnection`` que o
+``ProductPublisher`` usa: ioloop com ``add_callback_threadsafe``, canal com
+publisher confirms (ACK com ``multiple=True`` em rajadas, latência e taxa de
+NACK configuráveis) e uma fila em memória por routing key.
+
+`BlockingLoopbackBroker` imita ``pika.BlockingConnection`` do lado dos
+consumers (ConsumerServimed, ProductPosterConsumer, RetryPolicy): prefetch,
+ACK/NACK com requeue (``redelivered=True``), consumers exclusivos, filas de
+atraso com ``x-message-ttl`` + dead-letter e exchanges ``fanout``, ``direct``
+e ``x-consistent-hash`` (pesos dos bindings ignorados).
+"""
+
+import heapq
+import itertools
+import random
+import threading
+import time
+import zlib
+from collections import defaultdict, deque
+from types import SimpleNamespace
+
+import pika.exceptions
+from pika.spec import Basic
+
+
+class LoopbackIOLoop:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._callbacks: deque = deque()
+        self._timers: list = []
+        self._seq = itertools.count()
+        self._running = False
+
+    def add_callback_threadsafe(self, cb):
+        with self._cond:
+            self._callbacks.append(cb)
+            self._cond.notify()
+
+    def call_later(self, delay, cb):
+        with self._cond:
+            heapq.heappush(self._timers, (time.monotonic() + delay, next(self._seq), cb))
+            self._cond.notify()
+
+    def start(self):
+        self._running = True
+        while self._running:
+            with self._cond:
+                now = time.monotonic()
+                timeout = None
+                if self._timers:
+                    timeout = max(0.0, self._timers[0][0] - now)
+                if not self._callbacks and (timeout is None or timeout > 0):
+                    self._cond.wait(timeout)
+                ready = list(self._callbacks)
+                self._callbacks.clear()
+                now = time.monotonic()
+                while self._timers and self._timers[0][0] <= now:
+                    ready.append(heapq.heappop(self._timers)[2])
+            for cb in ready:
+                cb()
+
+    def stop(self):
+        self._running = False
+        self.add_callback_threadsafe(lambda: None)
+
+
+class LoopbackBroker:
+    def __init__(self, confirm_latency: float = 0.0005, confirm_every: int = 16, nack_rate: float = 0.0):
+        self.confirm_latency = confirm_latency
+        self.confirm_every = max(1, confirm_every)
+        self.nack_rate = nack_rate
+        self.queues: dict[str, deque] = defaultdict(deque)
+
+    def connection_factory(self, params, on_open_callback, on_open_error_callback=None, on_close_callback=None):
+        return LoopbackConnection(self, on_open_callback, on_close_callback)
+
+
+class LoopbackChannel:
+    def __init__(self, conn):
+        self._conn = conn
+        self._broker = conn.broker
+        self._tag = 0
+        self._pending_acks = 0
+        self._confirm_cb = None
+        self._return_cb = None
+        self._flush_scheduled = False
+
+    def add_on_return_callback(self, cb):
+        self._return_cb = cb
+
+    def confirm_delivery(self, ack_nack_callback):
+        self._confirm_cb = ack_nack_callback
+
+    def queue_declare(self, queue, durable=True, callback=None):
+        self._broker.queues[queue]
+        if callback:
+            self._conn.ioloop.add_callback_threadsafe(lambda: callback(SimpleNamespace()))
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        self._tag += 1
+        tag = self._tag
+        if self._broker.nack_rate and random.random() < self._broker.nack_rate:
+            self._flush_acks(tag - 1)
+            self._conn.ioloop.call_later(
+                self._broker.confirm_latency,
+                lambda: self._confirm_cb(SimpleNamespace(method=Basic.Nack(delivery_tag=tag, multiple=False))),
+            )
+            return
+        self._broker.queues[routing_key].append(body)
+        self._pending_acks += 1
+        if self._pending_acks >= self._broker.confirm_every:
+            self._flush_acks()
+        elif not self._flush_scheduled:
+            self._flush_scheduled = True
+            self._conn.ioloop.call_later(self._broker.confirm_latency, self._flush_acks)
+
+    def _flush_acks(self, upto=None):
+        self._flush_scheduled = False
+        if not self._pending_acks:
+            return
+        self._pending_acks = 0
+        tag = self._tag if upto is None else upto
+        frame = SimpleNamespace(method=Basic.Ack(delivery_tag=tag, multiple=True))
+        self._conn.ioloop.call_later(self._broker.confirm_latency, lambda: self._confirm_cb(frame))
+
+
+class LoopbackConnection:
+    def __init__(self, broker, on_open_callback, on_close_callback):
+        self.broker = broker
+        self.ioloop = LoopbackIOLoop()
+        self.is_open = True
+        self._on_close = on_close_callback
+        self.ioloop.add_callback_threadsafe(lambda: on_open_callback(self))
+
+    def channel(self, on_open_callback):
+        ch = LoopbackChannel(self)
+        self.ioloop.add_callback_threadsafe(lambda: on_open_callback(ch))
+
+    def close(self):
+        self.is_open = False
+        if self._on_close:
+            self._on_close(self, "closed by client")
+
+
+# --------------------------------------------------------------------------
+# Lado bloqueante (consumers)
+# --------------------------------------------------------------------------
+
+
+class BlockingLoopbackBroker:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.queues: dict[str, deque] = defaultdict(deque)
+        self.arguments: dict[str, dict] = {}
+        self.exchanges: dict[str, tuple] = {}  # nome -> (tipo, [(fila, routing key)])
+        self._delayed: list = []  # heap (vence_em, seq, exchange, routing key, mensagem)
+        self._seq = itertools.count()
+        self._exclusive: dict[str, object] = {}
+        self.consumers: dict[str, int] = defaultdict(int)
+        self.stats: dict[str, int] = defaultdict(int)
+
+    def connect(self, params=None) -> "BlockingLoopbackConnection":
+        """Use no lugar de ``pika.BlockingConnection``."""
+        return BlockingLoopbackConnection(self)
+
+    def depth(self, queue: str) -> int:
+        with self._cond:
+            return len(self.queues[queue])
+
+    def _route_locked(self, exchange: str, routing_key: str) -> list:
+        if not exchange:
+            return [routing_key]
+        kind, bindings = self.exchanges[exchange]
+        if kind == "fanout":
+            return [q for q, _ in bindings]
+        if kind == "x-consistent-hash":
+            if not bindings:
+                return []
+            return [bindings[zlib.crc32(routing_key.encode("utf-8")) % len(bindings)][0]]
+        return [q for q, key in bindings if key == routing_key]
+
+    def _enqueue_locked(self, queue: str, routing_key: str, msg) -> None:
+        args = self.arguments.get(queue) or {}
+        ttl = args.get("x-message-ttl")
+        if ttl is not None and "x-dead-letter-exchange" in args:
+            due = time.monotonic() + ttl / 1000.0
+            key = args.get("x-dead-letter-routing-key", routing_key)
+            heapq.heappush(
+                self._delayed,
+                (due, next(self._seq), args["x-dead-letter-exchange"], key, msg),
+            )
+            self.stats["delayed"] += 1
+        else:
+            self.queues[queue].append(msg)
+
+    def _publish(
+        self, routing_key: str, body: bytes, properties, redelivered=False, exchange: str = ""
+    ) -> int:
+        msg = (body, properties, redelivered)
+        with self._cond:
+            queues = self._route_locked(exchange, routing_key)
+            for queue in queues:
+                self._enqueue_locked(queue, routing_key, msg)
+            self.stats["published"] += 1
+            self._cond.notify_all()
+        return len(queues)
+
+    def _requeue(self, queue: str, msg) -> None:
+        body, properties, _ = msg
+        with self._cond:
+            self.queues[queue].appendleft((body, properties, True))
+            self.stats["requeued"] += 1
+            self._cond.notify_all()
+
+    def _promote_due_locked(self) -> float | None:
+        now = time.monotonic()
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, exchange, key, msg = heapq.heappop(self._delayed)
+            for queue in self._route_locked(exchange, key):
+                self.queues[queue].append(msg)
+        return self._delayed[0][0] - now if self._delayed else None
+
+    def _take(self, channels: list, timeout: float):
+        """Próxima entrega para um dos `channels` (respeitando o prefetch de cada
+        um), ou None no timeout."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                next_due = self._promote_due_locked()
+                for ch in channels:
+                    if not ch.is_open or not ch._has_room():
+                        continue
+                    for tag, (queue, cb) in list(ch._consumers.items()):
+                        q = self.queues[queue]
+                        if q:
+                            return ch, tag, queue, cb, q.popleft()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or any(ch._wakeup for ch in channels):
+                    return None
+                self._cond.wait(min(remaining, next_due) if next_due is not None else remaining)
+
+    def _wake(self) -> None:
+        with self._cond:
+            self._cond.notify_all()
+
+    def _count(self, key: str, n: int = 1) -> None:
+        with self._cond:
+            self.stats[key] += n
+
+
+class BlockingLoopbackConnection:
+    def __init__(self, broker: BlockingLoopbackBroker):
+        self.broker = broker
+        self.is_open = True
+        self._timers: list = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._channels: list = []
+
+    def channel(self) -> "BlockingLoopbackChannel":
+        ch = BlockingLoopbackChannel(self)
+        self._channels.append(ch)
+        return ch
+
+    def call_later(self, delay, callback):
+        with self._lock:
+            heapq.heappush(self._timers, (time.monotonic() + delay, next(self._seq), callback))
+        for ch in self._channels:
+            ch._wakeup = True
+        self.broker._wake()
+
+    def add_callback_threadsafe(self, callback):
+        self.call_later(0, callback)
+
+    def _next_timer_in(self) -> float | None:
+        with self._lock:
+            return self._timers[0][0] - time.monotonic() if self._timers else None
+
+    def _run_timers(self) -> None:
+        while True:
+            with self._lock:
+                if not self._timers or self._timers[0][0] > time.monotonic():
+                    return
+                callback = heapq.heappop(self._timers)[2]
+            callback()
+
+    def process_data_events(self, time_limit=0):
+        self._run_timers()
+
+    def sleep(self, duration: float) -> None:
+        end = time.monotonic() + duration
+        while (remaining := end - time.monotonic()) > 0:
+            nxt = self._next_timer_in()
+            time.sleep(max(0.0, min(remaining, nxt if nxt is not None else remaining)))
+            self._run_timers()
+
+    def close(self):
+        for ch in self._channels:
+            ch.close()
+        self.is_open = False
+
+
+class BlockingLoopbackChannel:
+    def __init__(self, conn: BlockingLoopbackConnection):
+        self.connection = conn
+        self._broker = conn.broker
+        self.is_open = True
+        self._prefetch = 0
+        self._consumers: dict[str, tuple] = {}
+        self._unacked: dict[int, tuple] = {}
+        self._tags = itertools.count(1)
+        self._ctags = itertools.count(1)
+        self._stopping = False
+        self._wakeup = False
+        self._delivery_confirmation = False
+
+    def _has_room(self) -> bool:
+        return not self._prefetch or len(self._unacked) < self._prefetch
+
+    def queue_declare(self, queue, passive=False, durable=False, exclusive=False,
+                      auto_delete=False, arguments=None):
+        with self._broker._cond:
+            if arguments:
+                self._broker.arguments[queue] = dict(arguments)
+            count = len(self._broker.queues[queue])
+            consumers = self._broker.consumers[queue]
+        return SimpleNamespace(
+            method=SimpleNamespace(queue=queue, message_count=count, consumer_count=consumers)
+        )
+
+    def exchange_declare(self, exchange, exchange_type="direct", durable=False, **kwargs):
+        with self._broker._cond:
+            self._broker.exchanges.setdefault(exchange, (exchange_type, []))
+
+    def queue_bind(self, queue, exchange, routing_key=None, arguments=None):
+        with self._broker._cond:
+            bindings = self._broker.exchanges[exchange][1]
+            if (queue, routing_key or queue) not in bindings:
+                bindings.append((queue, routing_key or queue))
+
+    def basic_qos(self, prefetch_size=0, prefetch_count=0, global_qos=False):
+        self._prefetch = prefetch_count
+
+    def basic_consume(self, queue, on_message_callback, auto_ack=False, exclusive=False,
+                      consumer_tag=None, arguments=None):
+        with self._broker._cond:
+            owner = self._broker._exclusive.get(queue)
+            if owner is not None and owner is not self:
+                self.is_open = False
+                raise pika.exceptions.ChannelClosedByBroker(
+                    403, f"ACCESS_REFUSED - queue '{queue}' in exclusive use"
+                )
+            if exclusive:
+                self._broker._exclusive[queue] = self
+            self._broker.consumers[queue] += 1
+        tag = consumer_tag or f"ctag.{next(self._ctags)}"
+        self._consumers[tag] = (queue, on_message_callback)
+        return tag
+
+    def basic_cancel(self, consumer_tag):
+        queue, _ = self._consumers.pop(consumer_tag, (None, None))
+        with self._broker._cond:
+            if queue is not None:
+                self._broker.consumers[queue] -= 1
+            if self._broker._exclusive.get(queue) is self:
+                del self._broker._exclusive[queue]
+
+    def confirm_delivery(self):
+        # Em memória o "ack" do broker é imediato; só a devolução de
+        # mensagem sem rota (mandatory) vira exceção, como no BlockingChannel.
+        self._delivery_confirmation = True
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        routed = self._broker._publish(routing_key, body, properties, exchange=exchange)
+        if self._delivery_confirmation and mandatory and not routed:
+            raise pika.exceptions.UnroutableError([])
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self._broker._count("acked", len(self._settle(delivery_tag, multiple)))
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        for queue, msg in self._settle(delivery_tag, multiple):
+            if requeue:
+                self._broker._requeue(queue, msg)
+            else:
+                self._broker._count("dropped")
+
+    def basic_reject(self, delivery_tag=0, requeue=True):
+        self.basic_nack(delivery_tag, requeue=requeue)
+
+    def _settle(self, delivery_tag, multiple) -> list:
+        tags = [t for t in self._unacked if t <= delivery_tag] if multiple else [delivery_tag]
+        settled = [self._unacked.pop(t) for t in tags if t in self._unacked]
+        self._broker._wake()
+        return settled
+
+    def start_consuming(self):
+        self._stopping = False
+        while self._consumers and not self._stopping and self.is_open:
+            self.connection._run_timers()
+            # Como no pika, o loop de um canal despacha os consumers de todos os
+            # canais da conexão.
+            channels = [c for c in self.connection._channels if c._consumers]
+            for c in channels:
+                c._wakeup = False
+            nxt = self.connection._next_timer_in()
+            got = self._broker._take(channels, 0.5 if nxt is None else max(0.0, min(nxt, 0.5)))
+            if got is None:
+                continue
+            ch, ctag, queue, callback, (body, properties, redelivered) = got
+            tag = next(ch._tags)
+            ch._unacked[tag] = (queue, (body, properties, redelivered))
+            method = Basic.Deliver(
+                consumer_tag=ctag,
+                delivery_tag=tag,
+                redelivered=redelivered,
+                exchange="",
+                routing_key=queue,
+            )
+            callback(ch, method, properties or pika.BasicProperties(), body)
+
+    def stop_consuming(self, consumer_tag=None):
+        self._stopping = True
+
+    def close(self):
+        if not self.is_open:
+            return
+        for tag in list(self._consumers):
+            self.basic_cancel(tag)
+        for queue, msg in self._unacked.values():
+            self._broker._requeue(queue, msg)
+        self._unacked.clear()
+        self.is_open = False
@@ -2,6 +2,8 @@
 import json
 import logging
 import os
+import time
+from dataclasses import dataclass
 from typing import Optional, Dict, Any, List, Tuple
 
 import pika
@@ -12,7 +14,13 @@ from urllib3.util.retry import Retry
 from shared.auth import (
     AuthClient,
     AuthError,
+    get_auth_client,
 )
+from shared.catalogue import CatalogueStore, catalogue_max_age, get_catalogue_store
+from shared.circuit_breaker import get_breaker
+from shared.config import env_bool, env_float, env_int, load_env
+from shared.profiling import Profiler, job_tag, profile_mode
+from shared.retry import RetryPolicy, retry_later
 
 log = logging.getLogger(__name__)
 if not log.handlers:
@@ -22,14 +30,20 @@ if not log.handlers:
     )
 
 JSONItem = Dict[str, Any]
+ACK, REQUEUE, DROP, DEFER = "ack", "requeue", "drop", "defer"
 
 
-def _env_int(name: str, default: int) -> int:
-    v = os.getenv(name)
-    try:
-        return int(v) if v is not None else default
-    except (TypeError, ValueError):
-        return default
+@dataclass
+class _PendingOrder:
+    method: Any
+    properties: Any
+    body: bytes
+    id_pedido: Any
+    produtos: List[JSONItem]
+
+    @property
+    def delivery_tag(self) -> int:
+        return self.method.delivery_tag
 
 
 class ProductPosterConsumer:
@@ -43,9 +57,17 @@ class ProductPosterConsumer:
         password: Optional[str] = None,
         api_url: Optional[str] = None,
         auth: Optional[AuthClient] = None,
+        catalogue: Optional[CatalogueStore] = None,
     ):
 
-        self.queue = queue or os.getenv("RABBIT_QUEUE_PRODUCTS", "queue.products")
+        # Fila própria dos pedidos: RABBIT_QUEUE_PRODUCTS é a dos lotes de produtos
+        # do scraper (ProductPublisher -> consumer_post_product).
+        self.queue = queue or os.getenv("RABBIT_QUEUE_ORDERS", "queue.orders")
+        if self.queue == os.getenv("RABBIT_QUEUE_PRODUCTS", "queue.products"):
+            raise ValueError(
+                f"A fila de pedidos ({self.queue!r}) não pode ser a mesma de "
+                "RABBIT_QUEUE_PRODUCTS."
+            )
         params = pika.ConnectionParameters(
             host=host or os.getenv("RABBIT_HOST", "localhost"),
             port=int(port or os.getenv("RABBIT_PORT", "5672")),
@@ -53,40 +75,73 @@ class ProductPosterConsumer:
                 user or os.getenv("RABBIT_USER", "guest"),
                 password or os.getenv("RABBIT_PASS", "guest"),
             ),
-            heartbeat=_env_int("RABBIT_HEARTBEAT", 60),
-            blocked_connection_timeout=_env_int("RABBIT_BLOCKED_CONN_TIMEOUT", 300),
+            heartbeat=env_int("RABBIT_HEARTBEAT", 60),
+            blocked_connection_timeout=env_int("RABBIT_BLOCKED_CONN_TIMEOUT", 300),
         )
         self._conn = pika.BlockingConnection(params)
         self._ch = self._conn.channel()
         self._ch.queue_declare(queue=self.queue, durable=True)
-        self._ch.basic_qos(prefetch_count=_env_int("RABBIT_PREFETCH", 8))
+        # Falhas temporárias voltam via filas de atraso com backoff exponencial.
+        self._retry = RetryPolicy(self.queue)
+        self._retry.declare(self._ch)
+
+        # Coalescência: junta pedidos do mesmo usuário numa janela curta.
+        self._coalesce = env_bool("ORDER_COALESCE", False)
+        self._coalesce_window = env_int("ORDER_COALESCE_WINDOW_MS", 200) / 1000.0
+        self._coalesce_max = max(1, env_int("ORDER_COALESCE_MAX", 20))
+        self._coalesce_array = env_bool("ORDER_COALESCE_ARRAY", False)
+        self._pending: Dict[Tuple[str, str], List[_PendingOrder]] = {}
+
+        prefetch = env_int("RABBIT_PREFETCH", 8)
+        if self._coalesce:
+            prefetch = max(prefetch, self._coalesce_max)
+        self._ch.basic_qos(prefetch_count=prefetch)
 
         self.api_url = api_url or os.getenv("API_ORDER_URL")
         if not self.api_url:
             raise RuntimeError("API_ORDER_URL ausente")
+        # Com a API de pedidos fora do ar o consumer para de consumir até o
+        # circuito meio-abrir, em vez de gastar um timeout por mensagem.
+        self._breaker = get_breaker(self.api_url)
+        self._consumer_tag: Optional[str] = None
+        self._resume_at: Optional[float] = None
 
         retry = Retry(
-            total=_env_int("API_RETRY_TOTAL", 2),
-            connect=_env_int("API_RETRY_CONNECT", 2),
-            read=_env_int("API_RETRY_READ", 2),
-            backoff_factor=float(os.getenv("API_BACKOFF_FACTOR", "0.5")),
+            total=env_int("API_RETRY_TOTAL", 2),
+            connect=env_int("API_RETRY_CONNECT", 2),
+            read=env_int("API_RETRY_READ", 2),
+            backoff_factor=env_float("API_BACKOFF_FACTOR", 0.5),
             status_forcelist=[429, 500, 502, 503, 504],
             allowed_methods={"POST"},
             raise_on_status=False,
         )
         adapter = HTTPAdapter(
             max_retries=retry,
-            pool_connections=_env_int("API_POOL_CONN", 10),
-            pool_maxsize=_env_int("API_POOL_MAX", 20),
+            pool_connections=env_int("API_POOL_CONN", 10),
+            pool_maxsize=env_int("API_POOL_MAX", 20),
         )
         self._session = requests.Session()
         self._session.mount("http://", adapter)
         self._session.mount("https://", adapter)
 
-        self._api_connect_timeout = _env_int("API_CONNECT_TIMEOUT", 10)
-        self._api_read_timeout = _env_int("API_READ_TIMEOUT", 60)
+        self._api_connect_timeout = env_int("API_CONNECT_TIMEOUT", 10)
+        self._api_read_timeout = env_int("API_READ_TIMEOUT", 60)
+
+        # Sem cliente injetado, usa o registro do processo: um AuthClient (e um
+        # token em cache) por usuário, com as requisições de token nesta sessão.
+        self._auth = auth
+
+        # Catálogo local (CATALOGUE_DB) gravado pelo worker do scraper. Com um
+        # catálogo recente, gtin fora da conta ou código que não bate descarta o
+        # pedido sem ir à API (ORDER_REJECT_FROM_CATALOGUE); estoque acima do
+        # catálogo só gera aviso, porque o estoque muda entre os crawls.
+        self._catalogue = catalogue or get_catalogue_store()
+        self._catalogue_max_age = catalogue_max_age()
+        self._check_stock = env_bool("ORDER_VALIDATE_STOCK", True)
+        self._reject_from_catalogue = env_bool("ORDER_REJECT_FROM_CATALOGUE", True)
 
-        self._auth = auth or AuthClient()
+        # Perfil por pedido (cpu|mem) em PROFILE_DIR; ver shared/profiling.py.
+        self._profile = profile_mode("ORDER_PROFILE")
 
     @staticmethod
     def _validate_envelope(msg: Any) -> Tuple[str, str, List[JSONItem]]:
@@ -155,20 +210,49 @@ class ProductPosterConsumer:
 
         return usuario.strip(), senha.strip(), cleaned
 
-    def _send_to_api(
-        self, produtos: List[JSONItem], usuario: str, senha: str
-    ) -> requests.Response:
+    def _check_catalogue(self, usuario: str, produtos: List[JSONItem]) -> bool:
+        """False se o catálogo local da conta recusa o pedido (descartar sem POST)."""
+        if self._catalogue is None:
+            return True
+        problems = self._catalogue.check_order(
+            usuario,
+            produtos,
+            max_age=self._catalogue_max_age,
+            check_stock=self._check_stock,
+        )
+        if not problems:
+            return True
+        sample = "; ".join(str(p) for p in problems[:10])
+        if self._reject_from_catalogue and any(p.fatal for p in problems):
+            log.error(
+                "Pedido recusado pelo catálogo local de '%s' (%d problemas): %s — descartando.",
+                usuario,
+                len(problems),
+                sample,
+            )
+            return False
+        log.warning(
+            "Catálogo local de '%s' diverge do pedido (%d problemas): %s — "
+            "enviando mesmo assim; a API decide.",
+            usuario,
+            len(problems),
+            sample,
+        )
+        return True
 
-        try:
+    def _auth_headers(self, usuario: str, senha: str) -> Dict[str, str]:
+        if self._auth is not None:
             headers = self._auth.auth_header(username=usuario, password=senha)
-        except TypeError:
-
-            headers = AuthClient(username=usuario, password=senha).auth_header()
-        except AuthError as e:
-
-            raise requests.RequestException(f"Auth local falhou: {e}") from e
-
+        else:
+            headers = get_auth_client(
+                username=usuario, password=senha, session=self._session
+            ).auth_header()
         headers["Content-Type"] = "application/json"
+        return headers
+
+    def _send_to_api(
+        self, produtos: List[JSONItem], headers: Dict[str, str]
+    ) -> requests.Response:
         return self._session.post(
             self.api_url,
             json=produtos,
@@ -177,6 +261,19 @@ class ProductPosterConsumer:
         )
 
     def _on_message(self, ch, method, properties, body: bytes):
+        if not self._profile:
+            return self._handle(ch, method, properties, body)
+        try:
+            id_pedido = json.loads(body).get("id_pedido")
+        except (ValueError, AttributeError):
+            id_pedido = None
+        tag = job_tag(
+            id_pedido, getattr(properties, "message_id", None), f"msg{method.delivery_tag}"
+        )
+        with Profiler(self._profile, "pedido", tag):
+            self._handle(ch, method, properties, body)
+
+    def _handle(self, ch, method, properties, body: bytes):
 
         try:
             msg = json.loads(body.decode("utf-8"))
@@ -192,25 +289,28 @@ class ProductPosterConsumer:
             ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
             return
 
-        size = len(produtos)
-        log.info("Postando %d produtos para API…", size)
+        if not self._check_catalogue(usuario, produtos):
+            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+            return
 
-        try:
-            resp = self._send_to_api(produtos, usuario, senha)
-        except (
-            requests.Timeout,
-            requests.ConnectionError,
-            requests.exceptions.SSLError,
-            requests.RequestException,
-        ) as e:
-            log.warning("Falha de rede ao enviar (size=%s): %s; NACK requeue", size, e)
-            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+        order = _PendingOrder(method, properties, body, msg.get("id_pedido"), produtos)
+        if not self._coalesce:
+            self._process_one(ch, order, usuario, senha)
             return
 
+        key = (usuario, senha)
+        group = self._pending.get(key)
+        if group is None:
+            group = self._pending[key] = []
+            self._conn.call_later(self._coalesce_window, lambda: self._flush(key))
+        group.append(order)
+        if len(group) >= self._coalesce_max:
+            self._flush(key)
+
+    def _classify(self, resp: requests.Response, size: int) -> str:
         if resp.status_code in (429, 500, 502, 503, 504):
-            log.warning("HTTP %s do endpoint; NACK requeue.", resp.status_code)
-            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
-            return
+            log.warning("HTTP %s do endpoint; retentativa com atraso.", resp.status_code)
+            return REQUEUE
 
         if 400 <= resp.status_code < 500:
             log.error(
@@ -218,26 +318,130 @@ class ProductPosterConsumer:
                 resp.status_code,
                 resp.text[:400],
             )
-            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
-            return
+            return DROP
 
         try:
             resp.raise_for_status()
         except requests.HTTPError as e:
             log.error("Erro inesperado no POST: %s; NACK descarta.", e)
-            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
-            return
+            return DROP
 
         log.info("Enviado com sucesso (status=%s, size=%s)", resp.status_code, size)
-        ch.basic_ack(delivery_tag=method.delivery_tag)
+        return ACK
+
+    def _settle(self, ch, order: _PendingOrder, outcome: str) -> None:
+        if outcome == ACK:
+            ch.basic_ack(delivery_tag=order.delivery_tag)
+        elif outcome == REQUEUE:
+            retry_later(
+                ch, order.method, order.properties, order.body, self._retry, "POST falhou"
+            )
+        elif outcome == DEFER:
+            # Não foi tentada: volta para a fila sem contar tentativa.
+            ch.basic_nack(delivery_tag=order.delivery_tag, requeue=True)
+            self._pause()
+        else:
+            ch.basic_nack(delivery_tag=order.delivery_tag, requeue=False)
+
+    def _pause(self) -> None:
+        if self._consumer_tag is None:
+            return
+        wait = max(1.0, self._breaker.retry_after())
+        log.warning("Circuito da API de pedidos aberto; pausando consumo por %.0fs.", wait)
+        # O BlockingChannel devolve (NACK requeue) o que já estava no prefetch.
+        self._ch.basic_cancel(self._consumer_tag)
+        self._consumer_tag = None
+        self._resume_at = time.monotonic() + wait
+
+    def _consume(self) -> None:
+        self._resume_at = None
+        self._consumer_tag = self._ch.basic_consume(
+            queue=self.queue, on_message_callback=self._on_message, auto_ack=False
+        )
+
+    def _post(self, payload, usuario: str, senha: str, size: int) -> str:
+        # Login antes de reservar a chamada: falha de login é do usuário/endpoint
+        # de token, não da API de pedidos, e não pode prender a sonda do breaker.
+        try:
+            headers = self._auth_headers(usuario, senha)
+        except AuthError as e:
+            log.warning("Auth local falhou (size=%s): %s; retentativa com atraso.", size, e)
+            return REQUEUE
+        if not self._breaker.allow():
+            return DEFER
+        resp = None
+        try:
+            resp = self._send_to_api(payload, headers)
+        except requests.RequestException as e:
+            self._breaker.record_failure()
+            log.warning(
+                "Falha de rede ao enviar (size=%s): %s; retentativa com atraso.", size, e
+            )
+            return REQUEUE
+        finally:
+            if resp is None:
+                self._breaker.release()
+        self._breaker.record_status(resp.status_code)
+        return self._classify(resp, size)
+
+    def _process_one(self, ch, order: _PendingOrder, usuario: str, senha: str) -> None:
+        size = len(order.produtos)
+        log.info("Postando %d produtos para API…", size)
+        self._settle(ch, order, self._post(order.produtos, usuario, senha, size))
+
+    def _flush(self, key: Tuple[str, str]) -> None:
+        group = self._pending.pop(key, None)
+        if not group:
+            return
+        if not self._profile:
+            return self._flush_group(key, group)
+        # Lote disparado pela janela: roda fora de _on_message, então mede aqui.
+        tag = job_tag(group[0].id_pedido, f"msg{group[0].delivery_tag}")
+        with Profiler(self._profile, "lote", f"{tag}+{len(group) - 1}"):
+            self._flush_group(key, group)
+
+    def _flush_group(self, key: Tuple[str, str], group: List[_PendingOrder]) -> None:
+        usuario, senha = key
+        if len(group) == 1:
+            self._process_one(self._ch, group[0], usuario, senha)
+            return
+
+        if self._coalesce_array:
+            size = sum(len(o.produtos) for o in group)
+            log.info(
+                "Postando %d pedidos (%d produtos) de '%s' num único POST…",
+                len(group),
+                size,
+                usuario,
+            )
+            payload = [{"id_pedido": o.id_pedido, "produtos": o.produtos} for o in group]
+            outcome = self._post(payload, usuario, senha, size)
+            if outcome != DROP:
+                for o in group:
+                    self._settle(self._ch, o, outcome)
+                return
+            log.warning(
+                "Lote recusado; reenviando os %d pedidos um a um para isolar o inválido.",
+                len(group),
+            )
+
+        # Pipelined: mesma sessão (conexão quente) e mesmo token para o grupo todo.
+        log.info("Postando %d pedidos de '%s' em sequência…", len(group), usuario)
+        for o in group:
+            self._process_one(self._ch, o, usuario, senha)
 
     def start(self) -> None:
         log.info("[✓] Consumindo fila '%s' para postar produtos…", self.queue)
-        self._ch.basic_consume(
-            queue=self.queue, on_message_callback=self._on_message, auto_ack=False
-        )
+        self._consume()
         try:
-            self._ch.start_consuming()
+            # start_consuming retorna quando _pause cancela o consumer.
+            while True:
+                self._ch.start_consuming()
+                if self._resume_at is None:
+                    break
+                self._conn.sleep(max(0.0, self._resume_at - time.monotonic()))
+                log.info("Retomando consumo de '%s'.", self.queue)
+                self._consume()
         except KeyboardInterrupt:
             log.info("Interrompido (Ctrl+C). Encerrando…")
         finally:
@@ -253,4 +457,5 @@ class ProductPosterConsumer:
 
 
 if __name__ == "__main__":
+    load_env()
     ProductPosterConsumer().start()
@@ -1,5 +1,9 @@
 # orderQueue/run_order_consumer.py
-from orderQueue.consumers.order_consumer import ProductPosterConsumer
+from shared.config import load_env
+
+load_env()
+
+from orderQueue.consumers.order_consumer import ProductPosterConsumer  # noqa: E402
 
 if __name__ == "__main__":
     ProductPosterConsumer().start()
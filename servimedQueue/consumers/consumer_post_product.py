@@ -0,0 +1,325 @@
+import gzip
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import pika
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from shared.auth import AuthClient, AuthError, get_auth_client
+from shared.config import env_float, env_int, load_env
+from shared.retry import RetryPolicy, retry_later
+
+log = logging.getLogger(__name__)
+if not log.handlers:
+    logging.basicConfig(
+        level=os.getenv("LOG_LEVEL", "INFO"),
+        format="%(asctime)s %(levelname)s [%(name)s] %(message)s",
+    )
+
+JSONItem = Dict[str, Any]
+
+ACK, REQUEUE, DROP = "ack", "requeue", "drop"
+REJECTED = "rejected"  # 4xx: algum item do lote foi recusado
+
+
+class _Message(NamedTuple):
+    tag: int
+    properties: Any
+    body: bytes
+    items: List[JSONItem]
+
+class ProductPosterConsumer:
+    """Agrega mensagens de produtos em lotes gzip limitados e posta em API_PRODUCTS_URL.
+
+    Mensagens (arrays JSON publicados pelo ProductPublisher) são juntadas até
+    POST_BATCH_ITEMS itens / POST_BATCH_BYTES bytes ou POST_BATCH_FLUSH_MS de
+    espera. Até POST_CONCURRENCY lotes são postados em paralelo numa sessão com
+    pool de conexões. Os ACKs saem com multiple=True assim que o prefixo
+    contíguo de delivery tags estiver confirmado.
+
+    Um 4xx divide o lote ao meio até isolar as mensagens recusadas: só as que
+    falham sozinhas são descartadas. Falhas transitórias vão para as filas de
+    atraso (``shared.retry``) em vez de voltar na hora para a fila.
+    """
+
+    def __init__(
+        self,
+        queue: Optional[str] = None,
+        host: Optional[str] = None,
+        port: Optional[int] = None,
+        user: Optional[str] = None,
+        password: Optional[str] = None,
+        api_url: Optional[str] = None,
+        auth: Optional[AuthClient] = None,
+        connection: Optional[pika.BlockingConnection] = None,
+    ):
+        self.queue = queue or os.getenv("RABBIT_QUEUE_PRODUCTS", "queue.products")
+        self.api_url = api_url or os.getenv("API_PRODUCTS_URL")
+        if not self.api_url:
+            raise RuntimeError("API_PRODUCTS_URL ausente")
+
+        self.batch_items = max(1, env_int("POST_BATCH_ITEMS", 5000))
+        self.batch_bytes = max(1, env_int("POST_BATCH_BYTES", 4 * 1024 * 1024))
+        self.flush_secs = env_int("POST_BATCH_FLUSH_MS", 500) / 1000.0
+        self.concurrency = max(1, env_int("POST_CONCURRENCY", 4))
+
+        if connection is None:
+            params = pika.ConnectionParameters(
+                host=host or os.getenv("RABBIT_HOST", "localhost"),
+                port=int(port or os.getenv("RABBIT_PORT", "5672")),
+                credentials=pika.PlainCredentials(
+                    user or os.getenv("RABBIT_USER", "guest"),
+                    password or os.getenv("RABBIT_PASS", "guest"),
+                ),
+                heartbeat=env_int("RABBIT_HEARTBEAT", 60),
+                blocked_connection_timeout=env_int("RABBIT_BLOCKED_CONN_TIMEOUT", 300),
+            )
+            connection = pika.BlockingConnection(params)
+        self._conn = connection
+        self._ch = self._conn.channel()
+        self._ch.queue_declare(queue=self.queue, durable=True)
+        self._ch.basic_qos(prefetch_count=env_int("RABBIT_PREFETCH_PRODUCTS", 2000))
+
+        retry = Retry(
+            total=env_int("API_RETRY_TOTAL", 1),
+            connect=env_int("API_RETRY_CONNECT", 2),
+            read=env_int("API_RETRY_READ", 1),
+            backoff_factor=env_float("API_BACKOFF_FACTOR", 0.5),
+            status_forcelist=[408, 429, 500, 502, 503, 504],
+            allowed_methods={"POST"},
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            max_retries=retry,
+            pool_connections=env_int("API_POOL_CONN", 10),
+            pool_maxsize=max(self.concurrency, env_int("API_POOL_MAX", 20)),
+        )
+        self._session = requests.Session()
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._timeout = (
+            env_int("API_CONNECT_TIMEOUT", 10),
+            env_int("API_READ_TIMEOUT", 120),
+        )
+        self._auth = auth or get_auth_client(session=self._session)
+        self._retry = RetryPolicy(self.queue)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.concurrency, thread_name_prefix="post-batch"
+        )
+
+        # Buffer do lote em formação.
+        self._buf: List[_Message] = []
+        self._buf_items = 0
+        self._buf_bytes = 0
+        self._timer = None
+
+        # delivery_tag -> None (em andamento) | ACK | DROP, em ordem de chegada.
+        # As que vão para retentativa saem daqui ao serem reagendadas.
+        self._outstanding: "OrderedDict[int, Optional[str]]" = OrderedDict()
+        self._inflight = 0
+
+    # --- consumo -----------------------------------------------------------
+
+    def _on_message(self, ch, method, properties, body: bytes):
+        try:
+            items = json.loads(body.decode("utf-8"))
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            log.error("Mensagem inválida (JSON malformado); descartando.")
+            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+            return
+        if isinstance(items, dict):
+            items = [items]
+        if not isinstance(items, list):
+            log.error("Mensagem deve ser um array de produtos; descartando.")
+            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+            return
+
+        size = len(body)
+        if self._buf and (
+            self._buf_items + len(items) > self.batch_items
+            or self._buf_bytes + size > self.batch_bytes
+        ):
+            self._dispatch()
+
+        self._outstanding[method.delivery_tag] = None
+        self._buf.append(_Message(method.delivery_tag, properties, body, items))
+        self._buf_items += len(items)
+        self._buf_bytes += size
+
+        if self._buf_items >= self.batch_items or self._buf_bytes >= self.batch_bytes:
+            self._dispatch()
+        elif self._timer is None:
+            self._timer = self._conn.call_later(self.flush_secs, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        if self._buf:
+            self._dispatch()
+
+    def _dispatch(self) -> None:
+        if self._timer is not None:
+            self._conn.remove_timeout(self._timer)
+            self._timer = None
+        messages, count = self._buf, self._buf_items
+        self._buf, self._buf_items, self._buf_bytes = [], 0, 0
+        if not messages:
+            return
+        self._inflight += 1
+        log.info(
+            "Lote com %d itens de %d mensagens enviado (%d lotes em voo).",
+            count,
+            len(messages),
+            self._inflight,
+        )
+        future = self._executor.submit(self._post_batch, [m.items for m in messages])
+        future.add_done_callback(
+            lambda f: self._conn.add_callback_threadsafe(
+                lambda: self._on_batch_done(messages, f)
+            )
+        )
+
+    # --- POST (threads do executor) -------------------------------------
+
+    def _post_batch(self, groups: List[List[JSONItem]]) -> List[str]:
+        """Posta as mensagens num lote só; retorna o desfecho de cada uma.
+
+        Num 4xx o lote é dividido ao meio e cada metade reenviada, até a
+        mensagem recusada ficar sozinha; só ela é descartada.
+        """
+        outcome = self._post([item for items in groups for item in items])
+        if outcome != REJECTED:
+            return [outcome] * len(groups)
+        if len(groups) == 1:
+            return [DROP]
+        mid = len(groups) // 2
+        log.warning(
+            "Lote de %d mensagens recusado; dividindo para isolar a(s) inválida(s).",
+            len(groups),
+        )
+        return self._post_batch(groups[:mid]) + self._post_batch(groups[mid:])
+
+    def _post(self, items: List[JSONItem]) -> str:
+        try:
+            headers = {"Content-Type": "application/json", "Content-Encoding": "gzip"}
+            headers.update(self._auth.auth_header())
+        except AuthError as e:
+            log.warning("Auth falhou: %s -> requeue", e)
+            return REQUEUE
+
+        payload = gzip.compress(
+            json.dumps(items, ensure_ascii=False).encode("utf-8"), compresslevel=5
+        )
+        t0 = time.monotonic()
+        try:
+            resp = self._session.post(
+                self.api_url, data=payload, headers=headers, timeout=self._timeout
+            )
+        except requests.RequestException as e:
+            log.warning("Erro de rede no POST do lote: %s -> requeue", e)
+            return REQUEUE
+        log.info(
+            "POST de %d itens em %.1fs (status=%s, gzip=%d bytes)",
+            len(items),
+            time.monotonic() - t0,
+            resp.status_code,
+            len(payload),
+        )
+
+        if resp.status_code in (408, 429, 500, 502, 503, 504):
+            return REQUEUE
+        if 400 <= resp.status_code < 500:
+            log.error(
+                "HTTP %s definitivo; body[:800]=%s", resp.status_code, resp.text[:800]
+            )
+            return REJECTED
+        if resp.status_code >= 300:
+            log.error("HTTP %s inesperado no POST do lote.", resp.status_code)
+            return DROP
+        return ACK
+
+    # --- confirmação (thread da conexão) --------------------------------
+
+    def _on_batch_done(self, messages: List[_Message], future: Future) -> None:
+        self._inflight -= 1
+        try:
+            outcomes = future.result()
+        except Exception:
+            log.exception("Falha inesperada no POST do lote; nova tentativa mais tarde.")
+            outcomes = [REQUEUE] * len(messages)
+        for msg, outcome in zip(messages, outcomes):
+            if msg.tag not in self._outstanding:
+                continue
+            if outcome == REQUEUE:
+                # retry_later faz o ACK da entrega atual por conta própria.
+                del self._outstanding[msg.tag]
+                retry_later(
+                    self._ch,
+                    SimpleNamespace(delivery_tag=msg.tag),
+                    msg.properties,
+                    msg.body,
+                    self._retry,
+                    "POST do lote falhou",
+                )
+                continue
+            self._outstanding[msg.tag] = outcome
+        self._settle_ready()
+
+    def _settle_ready(self) -> None:
+        """ACK/NACK do prefixo já resolvido, agrupando ACKs contíguos em multiple=True."""
+        last_ack = None
+        while self._outstanding:
+            tag, outcome = next(iter(self._outstanding.items()))
+            if outcome is None:
+                break
+            self._outstanding.popitem(last=False)
+            if outcome == ACK:
+                last_ack = tag
+                continue
+            if last_ack is not None:
+                self._ch.basic_ack(delivery_tag=last_ack, multiple=True)
+                last_ack = None
+            self._ch.basic_nack(delivery_tag=tag, requeue=False)
+        if last_ack is not None:
+            self._ch.basic_ack(delivery_tag=last_ack, multiple=True)
+
+    # --- ciclo de vida -----------------------------------------------------
+
+    def start(self) -> None:
+        log.info(
+            "[✓] Consumindo fila '%s' (lote=%d itens/%d bytes, concorrência=%d)…",
+            self.queue,
+            self.batch_items,
+            self.batch_bytes,
+            self.concurrency,
+        )
+        self._ch.basic_consume(
+            queue=self.queue, on_message_callback=self._on_message, auto_ack=False
+        )
+        try:
+            self._ch.start_consuming()
+        except KeyboardInterrupt:
+            log.info("Interrompido (Ctrl+C). Encerrando…")
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        try:
+            if self._ch.is_open:
+                self._ch.close()
+        finally:
+            if self._conn.is_open:
+                self._conn.close()
+
+
+if __name__ == "__main__":
+    load_env()
+    ProductPosterConsumer().start()
@@ -1,56 +1,116 @@
+import logging
 import os
 import pika
-from dotenv import load_dotenv
-from servimedQueue.utils import worker_stream  # callback
+from shared.config import env_int, load_env
 
-load_dotenv()
+load_env()
 
+from shared.routing import AccountRouter  # noqa: E402
+from servimedQueue.utils import worker_stream  # noqa: E402  # callback
 
-def _int(name, default):
-    try:
-        return int(os.getenv(name, str(default)))
-    except Exception:
-        return default
+log = logging.getLogger(__name__)
 
 
 class ConsumerServimed:
-    def __init__(self, callback) -> None:
+    def __init__(self, callback, queue=None, router: AccountRouter | None = None) -> None:
         self.host = os.getenv("RABBIT_HOST")
-        self.port = _int("RABBIT_PORT", 5672)
+        self.port = env_int("RABBIT_PORT", 5672)
         self.user = os.getenv("RABBIT_USER", "guest")
         self.password = os.getenv("RABBIT_PASS", "guest")
-        self.queue = os.getenv("RABBIT_QUEUE_SCRAPER", "queue.start_scrapy")
+        self.queue = queue or os.getenv("RABBIT_QUEUE_SCRAPER", "queue.start_scrapy")
         self.callback = callback
-        self.channel = self._create_channel()
+        # Com roteamento por conta, consome também shards `<fila>.shard.<n>`.
+        self.router = router if router is not None and router.enabled else None
+        self.shard_channels: dict = {}
+        self.prefetch = env_int("RABBIT_PREFETCH", 1)
+        self.reclaim_secs = env_int("SCRAPER_SHARD_RECLAIM_SECS", 30)
+        self.max_shards = env_int("SCRAPER_SHARDS_PER_WORKER", 0)
+        shard_id = os.getenv("SCRAPER_SHARD_ID", "").strip()
+        self.pinned_shard = int(shard_id) if shard_id.isdigit() else None
+        self._busy = False
+        self.connection = self._connect()
         self._setup_consumer()
 
-    def _create_channel(self):
+    def _connect(self):
         params = pika.ConnectionParameters(
             host=self.host,
             port=self.port,
             credentials=pika.PlainCredentials(self.user, self.password),
-            heartbeat=_int("RABBIT_HEARTBEAT", 300),  # ex: 300s
-            blocked_connection_timeout=_int("RABBIT_BLOCKED_TIMEOUT", 600),  # ex: 600s
-            connection_attempts=_int("RABBIT_CONN_ATTEMPTS", 5),
-            retry_delay=_int("RABBIT_RETRY_DELAY", 5),
+            heartbeat=env_int("RABBIT_HEARTBEAT", 300),  # ex: 300s
+            blocked_connection_timeout=env_int("RABBIT_BLOCKED_TIMEOUT", 600),  # ex: 600s
+            connection_attempts=env_int("RABBIT_CONN_ATTEMPTS", 5),
+            retry_delay=env_int("RABBIT_RETRY_DELAY", 5),
         )
-        connection = pika.BlockingConnection(params)
-        return connection.channel()
+        return pika.BlockingConnection(params)
+
+    def _on_message(self, ch, method, properties, body):
+        self._busy = True
+        try:
+            self.callback(ch, method, properties, body)
+        finally:
+            self._busy = False
 
     def _setup_consumer(self):
+        self.channel = self.connection.channel()
+        self.channel.basic_qos(prefetch_count=self.prefetch)
         self.channel.queue_declare(queue=self.queue, durable=True)
-        self.channel.basic_qos(prefetch_count=_int("RABBIT_PREFETCH", 1))
         self.channel.basic_consume(
             queue=self.queue,
             auto_ack=False,
-            on_message_callback=self.callback,
+            on_message_callback=self._on_message,
         )
+        if self.router is None:
+            return
+        self._rebalance()
+        if not self.shard_channels:
+            log.warning("Nenhum shard livre; consumindo só a fila base por enquanto.")
+        self.connection.call_later(self.reclaim_secs, self._reclaim)
+
+    def _share(self) -> int:
+        """Cota de shards deste worker: ceil(shards / workers), ou o limite configurado."""
+        if self.pinned_shard is not None:
+            return 1
+        share = self.router.fair_share(self.channel)
+        return min(share, self.max_shards) if self.max_shards else share
+
+    def _rebalance(self):
+        share = self._share()
+        released = self.router.release(self.shard_channels, share)
+        if released:
+            log.info("Devolvendo shards %s (cota de %d por worker).", released, share)
+        room = share - len(self.shard_channels)
+        if room <= 0:
+            return
+        new = self.router.claim_shards(
+            self.connection,
+            self._on_message,
+            shard_ids=[self.pinned_shard] if self.pinned_shard is not None else None,
+            limit=room,
+            prefetch=self.prefetch,
+            skip=self.shard_channels,
+        )
+        if new:
+            log.info("Assumindo shards %s (cota de %d por worker).", sorted(new), share)
+            self.shard_channels.update(new)
+
+    def _reclaim(self):
+        """Refaz a divisão: solta o excesso quando sobe worker novo e assume
+        shards sem consumer (worker que caiu)."""
+        if not self._busy:
+            try:
+                self._rebalance()
+            except pika.exceptions.AMQPError as e:
+                log.warning("Falha ao redistribuir os shards: %s", e)
+        self.connection.call_later(self.reclaim_secs, self._reclaim)
 
     def start(self):
-        print(f"[✓] Consumindo fila '{self.queue}' em {self.host}:{self.port} ...")
+        queues = [self.queue] + [self.router.shard_queue(n) for n in sorted(self.shard_channels)]
+        print(f"[✓] Consumindo {', '.join(queues)} em {self.host}:{self.port} ...")
+        # start_consuming do BlockingChannel despacha as entregas de todos os
+        # canais da conexão (shards inclusive).
         self.channel.start_consuming()
 
 
 if __name__ == "__main__":
-    c = ConsumerServimed(callback=worker_stream.start_scrap)
+    c = ConsumerServimed(callback=worker_stream.start_scrap, router=AccountRouter())
     c.start()
@@ -1,8 +1,8 @@
-from consumers.consumer_post_product import ProductPosterConsumer
-from dotenv import load_dotenv
+from shared.config import load_env
 
-load_dotenv()
+load_env()
 
-consumer_post_products = ProductPosterConsumer()
+from servimedQueue.consumers.consumer_post_product import ProductPosterConsumer  # noqa: E402
 
-consumer_post_products.start()
+if __name__ == "__main__":
+    ProductPosterConsumer().start()
@@ -1,5 +1,11 @@
-from servimedQueue.consumers.consumer_start_scrapy import ConsumerServimed
-from servimedQueue.utils.worker_stream import start_scrap
+from shared.config import load_env
 
-consumerScraper = ConsumerServimed(start_scrap)
+load_env()
+
+from servimedQueue.consumers.consumer_start_scrapy import ConsumerServimed  # noqa: E402
+from servimedQueue.utils.worker_stream import start_scrap, warm_up  # noqa: E402
+from shared.routing import AccountRouter  # noqa: E402
+
+warm_up()
+consumerScraper = ConsumerServimed(start_scrap, router=AccountRouter())
 consumerScraper.start()
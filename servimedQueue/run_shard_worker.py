@@ -0,0 +1,11 @@
+from shared.config import load_env
+
+load_env()
+
+from servimedQueue.consumers.consumer_start_scrapy import ConsumerServimed  # noqa: E402
+from servimedQueue.utils.sharding import SHARD_TASKS_QUEUE, run_shard  # noqa: E402
+from servimedQueue.utils.worker_stream import warm_up  # noqa: E402
+
+warm_up()
+consumerShards = ConsumerServimed(run_shard, queue=SHARD_TASKS_QUEUE)
+consumerShards.start()
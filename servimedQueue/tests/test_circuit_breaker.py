@@ -0,0 +1,67 @@
+from shared.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _half_open(clock: _Clock) -> CircuitBreaker:
+    breaker = CircuitBreaker(
+        "test",
+        window=4,
+        min_calls=1,
+        failure_rate=0.5,
+        open_secs=10,
+        half_open_probes=1,
+        probe_timeout=30,
+        clock=clock,
+    )
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    clock.now += 10
+    assert breaker.state == HALF_OPEN
+    return breaker
+
+
+def test_leaked_probe_expires():
+    clock = _Clock()
+    breaker = _half_open(clock)
+
+    assert breaker.allow()  # sonda reservada e nunca resolvida
+    assert not breaker.allow()
+    assert breaker.retry_after() == 30
+
+    clock.now += 29
+    assert not breaker.allow()
+    assert breaker.retry_after() == 1
+
+    clock.now += 1
+    assert breaker.allow()
+    assert breaker.stats["probes_expired"] == 1
+    breaker.record_success()
+    assert breaker.state == CLOSED
+
+
+def test_release_frees_probe():
+    clock = _Clock()
+    breaker = _half_open(clock)
+
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.retry_after() == 0
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+
+
+def test_release_outside_half_open_is_noop():
+    clock = _Clock()
+    breaker = CircuitBreaker("test", clock=clock, probe_timeout=30)
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.state == CLOSED
+    assert breaker.allow()
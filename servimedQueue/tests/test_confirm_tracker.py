@@ -0,0 +1,43 @@
+from servimedQueue.utils.post_products import _ConfirmTracker, _Ticket
+
+
+def _publish(tracker: _ConfirmTracker, ticket: _Ticket, body: bytes) -> int:
+    assert tracker.reserve(ticket, timeout=0)
+    return tracker.add(body, 0, ticket)
+
+
+def test_failures_stay_with_their_ticket():
+    tracker = _ConfirmTracker(window=8)
+    a, b = _Ticket(), _Ticket()
+    _publish(tracker, a, b"a1")
+    tag_b = _publish(tracker, b, b"b1")
+    _publish(tracker, a, b"a2")
+
+    tracker.mark_returned(tag_b)
+    assert tracker.ack(3, multiple=True) == (2, 1)
+
+    assert tracker.wait_ticket(a, timeout=0)
+    assert not tracker.wait_ticket(b, timeout=0)
+
+
+def test_nack_resolves_only_when_given_up():
+    tracker = _ConfirmTracker(window=8)
+    ticket = _Ticket()
+    tag = _publish(tracker, ticket, b"x")
+
+    (entry,) = tracker.nack(tag, multiple=False)
+    assert not tracker.wait_ticket(ticket, timeout=0)  # ainda pendente (republica)
+    tracker.add(entry.body, entry.attempt + 1, entry.ticket, reserved=False)
+    tracker.ack(tag + 1, multiple=False)
+    assert tracker.wait_ticket(ticket, timeout=0)
+
+
+def test_closed_connection_fails_pending_tickets():
+    tracker = _ConfirmTracker(window=8)
+    sent, queued = _Ticket(), _Ticket()
+    _publish(tracker, sent, b"x")
+    assert tracker.reserve(queued, timeout=0)  # ainda não chegou ao ioloop
+
+    assert len(tracker.drain()) == 1
+    assert not tracker.wait_ticket(sent, timeout=5)
+    assert not tracker.wait_ticket(queued, timeout=5)
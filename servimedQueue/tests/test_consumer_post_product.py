@@ -0,0 +1,97 @@
+import json
+import sys
+from concurrent.futures import Future
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "benchmarks"))
+
+from standins import BlockingLoopbackBroker  # noqa: E402
+
+from servimedQueue.consumers import consumer_post_product as cpp  # noqa: E402
+
+
+class _Channel:
+    def __init__(self):
+        self.calls = []
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.calls.append(("ack", delivery_tag, multiple))
+
+    def basic_nack(self, delivery_tag, requeue=True):
+        self.calls.append(("nack", delivery_tag, requeue))
+
+    def confirm_delivery(self):
+        self.calls.append(("confirm",))
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        self.calls.append(("publish", exchange, body))
+
+    def exchange_declare(self, **kwargs):
+        pass
+
+    def queue_declare(self, **kwargs):
+        pass
+
+    def queue_bind(self, **kwargs):
+        pass
+
+
+@pytest.fixture
+def consumer(monkeypatch):
+    monkeypatch.setenv("POST_BATCH_ITEMS", "100")
+    c = cpp.ProductPosterConsumer(
+        queue="test.products",
+        api_url="http://api.invalid/produtos",
+        auth=SimpleNamespace(auth_header=lambda: {}),
+        connection=BlockingLoopbackBroker().connect(),
+    )
+    c._ch = _Channel()
+    yield c
+    c._executor.shutdown(wait=True)
+
+
+def _deliver(consumer, tag, items):
+    body = json.dumps(items).encode("utf-8")
+    consumer._on_message(consumer._ch, SimpleNamespace(delivery_tag=tag), None, body)
+
+
+def _finish(consumer):
+    messages = consumer._buf
+    consumer._dispatch()
+    future = Future()
+    future.set_result(consumer._post_batch([m.items for m in messages]))
+    consumer._on_batch_done(messages, future)
+
+
+def test_rejected_batch_drops_only_the_bad_message(consumer, monkeypatch):
+    posts = []
+
+    def post(items):
+        posts.append(len(items))
+        return cpp.REJECTED if any(i.get("bad") for i in items) else cpp.ACK
+
+    monkeypatch.setattr(consumer, "_post", post)
+    monkeypatch.setattr(consumer._executor, "submit", lambda *a, **k: Future())
+    for tag in range(1, 5):
+        _deliver(consumer, tag, [{"codigo": tag, "bad": tag == 3}])
+    _finish(consumer)
+
+    assert ("nack", 3, False) in consumer._ch.calls
+    acked = [c for c in consumer._ch.calls if c[0] == "ack"]
+    assert acked == [("ack", 2, True), ("ack", 4, True)]
+    assert posts == [4, 2, 2, 1, 1]
+
+
+def test_transient_failure_goes_to_the_delay_queue(consumer, monkeypatch):
+    monkeypatch.setattr(consumer, "_post", lambda items: cpp.REQUEUE)
+    monkeypatch.setattr(consumer._executor, "submit", lambda *a, **k: Future())
+    _deliver(consumer, 1, [{"codigo": 1}])
+    _finish(consumer)
+
+    (publish,) = [c for c in consumer._ch.calls if c[0] == "publish"]
+    assert publish[1].startswith("test.products.delay.")
+    assert consumer._ch.calls.index(("confirm",)) < consumer._ch.calls.index(("ack", 1, False))
+    assert not [c for c in consumer._ch.calls if c[0] == "nack"]
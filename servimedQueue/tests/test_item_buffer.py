@@ -0,0 +1,98 @@
+import gzip
+import json
+import os
+
+import pytest
+
+from servimedQueue.utils.item_buffer import ItemBuffer, payload_size
+
+
+def _item(i: int) -> dict:
+    return {
+        "gtin": f"789{i:010d}",
+        "codigo": str(i),
+        "descricao": f"PRODUTO {i} CX 30 COMPRIMIDOS — genérico",
+        "preco_fabrica": round(10 + i % 997 * 0.37, 2),
+        "estoque": i % 500,
+    }
+
+
+def _rss_bytes() -> int:
+    with open("/proc/self/statm") as fh:
+        return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def _body(payload) -> list:
+    data = payload if isinstance(payload, bytes) else payload.read()
+    return json.loads(gzip.decompress(data))
+
+
+def test_in_memory_roundtrip():
+    with ItemBuffer(max_bytes=1 << 20) as buf:
+        for i in range(100):
+            buf.append(_item(i))
+        assert not buf.spilled
+        assert len(buf) == 100
+        assert list(buf) == [_item(i) for i in range(100)]
+        assert _body(buf.payload(compress=True)) == [_item(i) for i in range(100)]
+
+
+def test_spills_and_streams_back(tmp_path):
+    with ItemBuffer(max_bytes=4096, spill_dir=str(tmp_path)) as buf:
+        for i in range(2000):
+            buf.append(_item(i))
+        assert buf.spilled
+        assert 0 < buf.disk_bytes < buf.nbytes
+        assert list(buf) == [_item(i) for i in range(2000)]
+
+        # Itens depois de uma leitura entram num novo membro gzip.
+        buf.append(_item(2000))
+        assert len(buf) == 2001
+        assert list(buf)[-1] == _item(2000)
+
+        body = buf.payload(compress=True)
+        try:
+            assert payload_size(body) > 0
+            assert _body(body) == [_item(i) for i in range(2001)]
+        finally:
+            body.close()
+
+        plain = buf.payload(compress=False)
+        try:
+            assert len(json.loads(plain.read())) == 2001
+        finally:
+            plain.close()
+
+
+def test_empty_payload():
+    with ItemBuffer() as buf:
+        assert len(buf) == 0
+        assert buf.payload(compress=False) == b"[]"
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/statm"), reason="precisa de /proc")
+def test_rss_bounded_for_2m_items(tmp_path):
+    n = 2_000_000
+    limit = 64 * 1024 * 1024
+    with ItemBuffer(max_bytes=8 * 1024 * 1024, spill_dir=str(tmp_path)) as buf:
+        base = _rss_bytes()
+        peak = base
+        for i in range(n):
+            buf.append(_item(i))
+            if i % 50_000 == 0:
+                peak = max(peak, _rss_bytes())
+        assert buf.spilled
+        # Só a serialização já passa de 200 MB; em lista de dicts seria bem mais.
+        assert buf.nbytes > 200 * 1024 * 1024
+
+        count = 0
+        for count, item in enumerate(buf, start=1):
+            if count % 50_000 == 0:
+                peak = max(peak, _rss_bytes())
+        assert count == n
+
+        body = buf.payload(compress=True)
+        body.close()
+        peak = max(peak, _rss_bytes())
+
+    assert peak - base < limit, f"RSS cresceu {(peak - base) / 1e6:.0f} MB"
@@ -0,0 +1,81 @@
+import json
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pika
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "benchmarks"))
+
+from standins import BlockingLoopbackBroker  # noqa: E402
+
+from orderQueue.consumers.order_consumer import ProductPosterConsumer  # noqa: E402
+from shared.catalogue import CatalogueStore  # noqa: E402
+
+
+class _Channel:
+    def __init__(self):
+        self.calls = []
+
+    def basic_ack(self, delivery_tag):
+        self.calls.append(("ack", delivery_tag))
+
+    def basic_nack(self, delivery_tag, requeue=True):
+        self.calls.append(("nack", delivery_tag, requeue))
+
+
+@pytest.fixture
+def consumer(monkeypatch, tmp_path):
+    broker = BlockingLoopbackBroker()
+    monkeypatch.setattr(pika, "BlockingConnection", lambda params: broker.connect())
+    monkeypatch.setenv("API_ORDER_URL", "http://api.invalid/pedidos")
+    store = CatalogueStore(tmp_path / "catalogue.sqlite3")
+    store.replace_catalogue(
+        "Conta@Exemplo",
+        [{"gtin": "7891000000001", "codigo": "100", "estoque": 5}],
+    )
+    c = ProductPosterConsumer(queue="test.orders", catalogue=store)
+
+    def no_network(*args, **kwargs):
+        raise AssertionError("pedido recusado não pode chegar à rede")
+
+    monkeypatch.setattr(c, "_auth_headers", no_network)
+    monkeypatch.setattr(c, "_send_to_api", no_network)
+    return c
+
+
+def _order(gtin: str, codigo: str) -> bytes:
+    return json.dumps(
+        {
+            "usuario": "conta@exemplo",
+            "senha": "x",
+            "id_pedido": 1,
+            "produtos": [{"gtin": gtin, "codigo": codigo, "quantidade": 1}],
+        }
+    ).encode("utf-8")
+
+
+@pytest.mark.parametrize(
+    "gtin,codigo", [("7899999999999", "100"), ("7891000000001", "999")], ids=["gtin", "codigo"]
+)
+def test_bad_order_is_dropped_before_any_request(consumer, gtin, codigo):
+    ch = _Channel()
+    consumer._handle(ch, SimpleNamespace(delivery_tag=7), None, _order(gtin, codigo))
+    assert ch.calls == [("nack", 7, False)]
+
+
+def test_good_order_goes_to_the_api(consumer, monkeypatch):
+    posted = []
+    monkeypatch.setattr(consumer, "_auth_headers", lambda usuario, senha: {})
+    monkeypatch.setattr(
+        consumer,
+        "_send_to_api",
+        lambda produtos, headers: posted.append(produtos)
+        or SimpleNamespace(status_code=201, raise_for_status=lambda: None),
+    )
+    monkeypatch.setattr(consumer._breaker, "allow", lambda: True)
+    monkeypatch.setattr(consumer._breaker, "record_status", lambda status: None)
+    ch = _Channel()
+    consumer._handle(ch, SimpleNamespace(delivery_tag=8), None, _order("7891000000001", "100"))
+    assert posted and ch.calls == [("ack", 8)]
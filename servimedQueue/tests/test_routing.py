@@ -0,0 +1,98 @@
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import pika
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "benchmarks"))
+
+from standins import BlockingLoopbackBroker  # noqa: E402
+
+from servimedQueue.consumers.consumer_start_scrapy import ConsumerServimed  # noqa: E402
+from shared.retry import RetryPolicy, retry_later  # noqa: E402
+from shared.routing import AccountRouter  # noqa: E402
+
+QUEUE = "test.scrape"
+
+
+def _worker(monkeypatch, broker, mode="ring") -> ConsumerServimed:
+    monkeypatch.setattr(ConsumerServimed, "_connect", lambda self: broker.connect())
+    router = AccountRouter(queue=QUEUE, mode=mode, shards=4)
+    return ConsumerServimed(lambda *a: None, queue=QUEUE, router=router)
+
+
+def test_workers_split_shards_as_they_join(monkeypatch):
+    broker = BlockingLoopbackBroker()
+    a = _worker(monkeypatch, broker)
+    assert sorted(a.shard_channels) == [0, 1, 2, 3]
+
+    b = _worker(monkeypatch, broker)
+    assert b.shard_channels == {}  # tudo tomado; espera o rebalanceamento
+    a._rebalance()
+    b._rebalance()
+    assert len(a.shard_channels) == 2 and len(b.shard_channels) == 2
+    assert set(a.shard_channels).isdisjoint(b.shard_channels)
+
+    # Worker caiu: o outro assume os shards dele.
+    for ch in list(b.shard_channels.values()) + [b.channel]:
+        ch.close()
+    a._rebalance()
+    assert sorted(a.shard_channels) == [0, 1, 2, 3]
+
+
+def test_publish_goes_to_the_account_shard(monkeypatch):
+    broker = BlockingLoopbackBroker()
+    router = AccountRouter(queue=QUEUE, mode="ring", shards=4)
+    ch = broker.connect().channel()
+    router.declare(ch)
+
+    router.publish(ch, b"{}", usuario="conta@x")  # nenhum shard consumido
+    assert broker.depth(QUEUE) == 1
+
+    _worker(monkeypatch, broker)
+    router._live = None
+    router.publish(ch, b"{}", usuario="Conta@X ")
+    assert broker.depth(router.shard_queue(router.shard_for("conta@x"))) == 1
+
+
+def test_retry_returns_to_the_same_shard():
+    broker = BlockingLoopbackBroker()
+    router = AccountRouter(queue=QUEUE, mode="exchange", shards=4)
+    ch = broker.connect().channel()
+    router.declare(ch)
+    ch.basic_publish(exchange=router.exchange, routing_key=router.routing_key("conta@x"), body=b"{}")
+    (shard,) = [n for n in range(4) if broker.depth(router.shard_queue(n))]
+
+    policy = RetryPolicy(QUEUE, base_ms=1, exchange=router.dead_letter_exchange)
+    method = SimpleNamespace(delivery_tag=1, routing_key=router.routing_key("conta@x"))
+    retry_later(
+        ch, method, pika.BasicProperties(), b"{}", policy, routing_key=router.routing_key("conta@x")
+    )
+    time.sleep(0.01)
+    with broker._cond:
+        broker._promote_due_locked()
+    assert broker.depth(router.shard_queue(shard)) == 2
+    assert broker.depth(QUEUE) == 0
+
+
+def test_retry_acks_only_after_the_copy_is_confirmed(monkeypatch):
+    broker = BlockingLoopbackBroker()
+    ch = broker.connect().channel()
+    ch.queue_declare(queue=QUEUE)
+    ch.basic_publish(exchange="", routing_key=QUEUE, body=b"{}")
+    policy = RetryPolicy(QUEUE, base_ms=1)
+
+    def nacked(**kwargs):
+        assert ch._delivery_confirmation
+        raise pika.exceptions.NackError([])
+
+    def on_message(c, method, properties, body):
+        monkeypatch.setattr(c, "basic_publish", nacked)
+        retry_later(c, method, properties, body, policy)
+        c.stop_consuming()
+
+    ch.basic_consume(QUEUE, on_message)
+    ch.start_consuming()
+    assert broker.stats["acked"] == 0
+    assert broker.depth(QUEUE) == 1  # devolvida pelo NACK, não perdida
@@ -0,0 +1,46 @@
+from servimedQueue.utils.sharding import ShardMerger
+
+
+def _chunk(idx, attempt, seq, items):
+    return {"task": idx, "attempt": attempt, "chunk": seq, "items": items}
+
+
+def _done(idx, attempt, chunks, terminal=None, ok=True):
+    return {"task": idx, "attempt": attempt, "ok": ok, "chunks": chunks, "terminal_page": terminal}
+
+
+def test_shards_are_merged_in_page_order_through_buffers():
+    merger = ShardMerger("c", {"page_size": 10}, pages=2, window=3)
+    merger._shard_max_bytes = 1  # força o spill de cada faixa
+    for idx in merger.to_publish():
+        merger.tasks[idx] = {"attempts": 1, "chunks": 0}
+
+    merger.on_chunk(_chunk(2, 1, 0, [{"codigo": 5}]))
+    merger.on_chunk(_chunk(1, 1, 0, [{"codigo": 3}, {"codigo": 4}]))
+    merger.on_result(_done(2, 1, 1, terminal=6))
+    merger.on_result(_done(1, 1, 1))
+    assert len(merger.merged) == 0  # a faixa 0 ainda não chegou
+
+    merger.on_chunk(_chunk(0, 1, 0, [{"codigo": 1}]))
+    merger.on_chunk(_chunk(0, 1, 1, [{"codigo": 2}]))
+    merger.on_result(_done(0, 1, 2))
+    assert merger.complete()
+    with merger.items() as items:
+        assert [i["codigo"] for i in items] == [1, 2, 3, 4, 5]
+    merger.close()
+
+
+def test_retry_discards_the_failed_attempt():
+    merger = ShardMerger("c", {"page_size": 10}, pages=2, window=1)
+    merger.tasks[0] = {"attempts": 1, "chunks": 0}
+
+    merger.on_chunk(_chunk(0, 1, 0, [{"codigo": 1}]))
+    assert merger.on_result(_done(0, 1, 2, terminal=2)) == 0  # faltou um pedaço
+    merger.tasks[0] = {"attempts": 2, "chunks": 0}
+    merger.on_chunk(_chunk(0, 1, 1, [{"codigo": "velho"}]))  # tentativa anterior
+    merger.on_chunk(_chunk(0, 2, 0, [{"codigo": 1}, {"codigo": 2}]))
+    merger.on_result(_done(0, 2, 1, terminal=2))
+
+    assert merger.complete()
+    assert [i["codigo"] for i in merger.items()] == [1, 2]
+    merger.close()
@@ -0,0 +1,63 @@
+"""Versões awaitable dos helpers bloqueantes, para usar dentro do crawl.
+
+Com o reactor asyncio (padrão do scraper) um callback ``async def`` do spider
+ou de um pipeline roda como task do loop do asyncio; com o reactor nativo do
+Twisted, como Deferred. ``run_blocking`` manda a chamada para uma thread nos
+dois casos, sem travar o reactor. Não são clientes assíncronos: cada await
+ocupa uma thread do pool até a chamada bloqueante terminar.
+
+    async def process_item(self, item, spider):
+        ok, _ = await post_products([item])
+"""
+
+import asyncio
+import functools
+import os
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from shared.auth import AuthClient, get_auth_client
+
+JSONItem = Dict[str, Any]
+
+
+async def run_blocking(fn: Callable, *args, **kwargs):
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        # Reactor nativo: não há loop do asyncio; usa o pool de threads do Twisted.
+        from twisted.internet.threads import deferToThread
+
+        return await deferToThread(fn, *args, **kwargs)
+    return await asyncio.to_thread(fn, *args, **kwargs)
+
+
+async def auth_header(
+    client: Optional[AuthClient] = None, **credentials
+) -> Dict[str, str]:
+    """Header Authorization do cache de tokens (login só quando o token expira)."""
+    if client is None:
+        client = get_auth_client(**credentials)
+        return await run_blocking(client.auth_header)
+    return await run_blocking(client.auth_header, **credentials)
+
+
+async def publish_products(
+    products: List[JSONItem], timeout: Optional[float] = None
+) -> bool:
+    """Publica na fila de produtos e aguarda os confirms (ver ``publish_and_confirm``)."""
+    from servimedQueue.utils.post_products import publish_and_confirm
+
+    return await run_blocking(publish_and_confirm, products, timeout)
+
+
+async def post_products(
+    items: List[JSONItem], api_url: Optional[str] = None
+) -> Tuple[bool, bool]:
+    """POST único em API_PRODUCTS_URL; mesmo contrato (ok, requeue) do worker."""
+    from servimedQueue.utils import worker_stream
+
+    auth = get_auth_client(session=worker_stream.SESSION)
+    call = functools.partial(
+        worker_stream.post_items, items, api_url or os.getenv("API_PRODUCTS_URL"), auth
+    )
+    return await run_blocking(call)
@@ -0,0 +1,172 @@
+"""Buffer de itens do crawl com memória limitada.
+
+Os itens ficam em memória já serializados (uma linha JSON por item) até
+ITEM_BUFFER_MAX_BYTES; passando disso, tudo vai para um arquivo temporário
+gzip e os próximos itens são escritos direto nele. A leitura é sempre em
+stream (``for item in buf``), então o catálogo inteiro nunca é montado como
+lista de dicts.
+
+    with ItemBuffer() as buf:
+        buf.append({"gtin": "789..."})
+        body = buf.payload(compress=True)   # bytes ou arquivo, para o POST
+"""
+
+import gzip
+import io
+import json
+import os
+import tempfile
+import zlib
+from typing import IO, Any, Dict, Iterator, List, Optional, Union
+
+from shared.config import env_int
+
+JSONItem = Dict[str, Any]
+
+ITEM_BUFFER_MAX_BYTES = env_int("ITEM_BUFFER_MAX_BYTES", 64 * 1024 * 1024)
+ITEM_BUFFER_GZIP_LEVEL = env_int("ITEM_BUFFER_GZIP_LEVEL", 1)
+ITEM_BUFFER_DIR = os.getenv("ITEM_BUFFER_DIR") or None
+
+_CHUNK = 1 << 16
+
+
+class ItemBuffer:
+    def __init__(
+        self,
+        max_bytes: Optional[int] = None,
+        spill_dir: Optional[str] = None,
+        compresslevel: Optional[int] = None,
+    ):
+        self.max_bytes = ITEM_BUFFER_MAX_BYTES if max_bytes is None else max_bytes
+        self.spill_dir = spill_dir or ITEM_BUFFER_DIR
+        self.compresslevel = (
+            ITEM_BUFFER_GZIP_LEVEL if compresslevel is None else compresslevel
+        )
+        self._lines: List[bytes] = []
+        self._count = 0
+        self.nbytes = 0  # bytes de JSON (sem compressão) já recebidos
+        self._raw: Optional[IO[bytes]] = None
+        self._writer: Optional[gzip.GzipFile] = None
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def spilled(self) -> bool:
+        return self._raw is not None
+
+    @property
+    def disk_bytes(self) -> int:
+        if self._raw is None:
+            return 0
+        if self._writer is not None:
+            self._writer.flush()
+        return os.fstat(self._raw.fileno()).st_size
+
+    def append(self, item: JSONItem) -> None:
+        self.append_line(
+            json.dumps(item, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        )
+
+    def append_line(self, line: bytes) -> None:
+        """Anexa um item já serializado (uma linha JSON, sem o ``\\n``)."""
+        self._count += 1
+        self.nbytes += len(line) + 1
+        if self._raw is None:
+            self._lines.append(line)
+            if self.nbytes > self.max_bytes:
+                self._spill()
+            return
+        self._write_lines((line,))
+
+    def _spill(self) -> None:
+        self._raw = tempfile.TemporaryFile(prefix="items-", suffix=".jsonl.gz", dir=self.spill_dir)
+        lines, self._lines = self._lines, []
+        self._write_lines(lines)
+
+    def _write_lines(self, lines) -> None:
+        if self._writer is None:
+            # Depois de uma leitura o writer é fechado; um novo membro gzip é
+            # anexado no fim (GzipFile lê arquivos com vários membros).
+            self._raw.seek(0, io.SEEK_END)
+            self._writer = gzip.GzipFile(
+                fileobj=self._raw, mode="wb", compresslevel=self.compresslevel
+            )
+        for line in lines:
+            self._writer.write(line)
+            self._writer.write(b"\n")
+
+    def lines(self) -> Iterator[bytes]:
+        """Linhas JSON (sem o ``\\n``), na ordem de chegada."""
+        if self._raw is None:
+            yield from self._lines
+            return
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        self._raw.seek(0)
+        with gzip.GzipFile(fileobj=self._raw, mode="rb") as reader:
+            for line in reader:
+                yield line.rstrip(b"\n")
+
+    def __iter__(self) -> Iterator[JSONItem]:
+        for line in self.lines():
+            yield json.loads(line)
+
+    def json_chunks(self) -> Iterator[bytes]:
+        """O array JSON com todos os itens, em pedaços de ~64 KiB."""
+        out = bytearray(b"[")
+        first = True
+        for line in self.lines():
+            if not first:
+                out += b","
+            out += line
+            first = False
+            if len(out) >= _CHUNK:
+                yield bytes(out)
+                out.clear()
+        out += b"]"
+        yield bytes(out)
+
+    def payload(self, compress: bool = True) -> Union[bytes, IO[bytes]]:
+        """Corpo do POST (array JSON, opcionalmente gzip).
+
+        Sem spill devolve bytes; com spill, um arquivo temporário posicionado
+        no início (o chamador fecha), para o requests enviar em stream com
+        Content-Length.
+        """
+        if self._raw is None:
+            data = b"".join(self.json_chunks())
+            return gzip.compress(data) if compress else data
+        out = tempfile.TemporaryFile(prefix="payload-", dir=self.spill_dir)
+        if compress:
+            z = zlib.compressobj(self.compresslevel, zlib.DEFLATED, 31)
+            for chunk in self.json_chunks():
+                out.write(z.compress(chunk))
+            out.write(z.flush())
+        else:
+            for chunk in self.json_chunks():
+                out.write(chunk)
+        out.seek(0)
+        return out
+
+    def close(self) -> None:
+        self._lines = []
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self._raw is not None:
+            self._raw.close()
+            self._raw = None
+
+    def __enter__(self) -> "ItemBuffer":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def payload_size(body: Union[bytes, IO[bytes]]) -> int:
+    if isinstance(body, (bytes, bytearray)):
+        return len(body)
+    return os.fstat(body.fileno()).st_size
@@ -1,50 +1,426 @@
 import json
-from producers.post_product_producer import ProductProducer
 import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 
+import pika
+from pika.spec import Basic
 
-def postProduct(products, count, producer_product: ProductProducer):
-    publish_product(products)
-    logging.info(f"📦 {count}: {json.dumps(product, ensure_ascii=False)}")
+from shared.config import env_int
+
+log = logging.getLogger(__name__)
+
+JSONItem = Dict[str, Any]
+
+
+class PublishError(Exception):
     pass
 
 
-def publish_product(self, products) -> None:
+class _Ticket:
+    """Mensagens de uma chamada a `publish`: quantas faltam resolver e quantas falharam."""
+
+    __slots__ = ("pending", "failed")
+
+    def __init__(self):
+        self.pending = 0
+        self.failed = 0
+
+
+class _Entry:
+    __slots__ = ("body", "attempt", "ticket", "returned")
+
+    def __init__(self, body: bytes, attempt: int, ticket: _Ticket):
+        self.body = body
+        self.attempt = attempt
+        self.ticket = ticket
+        self.returned = False
+
+
+class _ConfirmTracker:
+    """Mensagens publicadas e ainda não confirmadas pelo broker.
+
+    Os delivery tags do modo confirm começam em 1 e crescem a cada publish no
+    canal; por isso `add` precisa ser chamado na mesma ordem do basic_publish.
+    Cada mensagem aponta para o `_Ticket` da chamada que a publicou, então
+    quem espera só vê os próprios confirms.
     """
-    Publica um produto (dict) como JSON UTF-8.
-    Lança exceção se a mensagem não puder ser roteada (UnroutableError) ou NACK do broker (NackError).
+
+    def __init__(self, window: int):
+        self.window = max(1, window)
+        self._cond = threading.Condition()
+        self._unconfirmed: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._reserved = 0
+        self._next_tag = 1
+        self._closed = False
+
+    def __len__(self) -> int:
+        with self._cond:
+            return len(self._unconfirmed) + self._reserved
+
+    def reserve(self, ticket: _Ticket, timeout: Optional[float] = None) -> bool:
+        """Bloqueia até haver espaço na janela de mensagens em voo."""
+        with self._cond:
+            ok = self._cond.wait_for(
+                lambda: len(self._unconfirmed) + self._reserved < self.window, timeout
+            )
+            if ok:
+                self._reserved += 1
+                ticket.pending += 1
+            return ok
+
+    def add(self, body: bytes, attempt: int, ticket: _Ticket, reserved: bool = True) -> int:
+        with self._cond:
+            if reserved:
+                self._reserved -= 1
+            tag = self._next_tag
+            self._next_tag += 1
+            self._unconfirmed[tag] = _Entry(body, attempt, ticket)
+            return tag
+
+    def mark_returned(self, tag: int) -> None:
+        """basic.return chega antes do ack da mesma mensagem: o ack vira falha."""
+        with self._cond:
+            entry = self._unconfirmed.get(tag)
+            if entry:
+                entry.returned = True
+
+    def resolve(self, ticket: _Ticket, ok: bool) -> None:
+        with self._cond:
+            ticket.pending -= 1
+            if not ok:
+                ticket.failed += 1
+            self._cond.notify_all()
+
+    def _pop(self, tag: int, multiple: bool) -> List[_Entry]:
+        if not multiple:
+            entry = self._unconfirmed.pop(tag, None)
+            return [entry] if entry else []
+        popped = []
+        while self._unconfirmed:
+            first = next(iter(self._unconfirmed))
+            if first > tag:
+                break
+            popped.append(self._unconfirmed.pop(first))
+        return popped
+
+    def ack(self, tag: int, multiple: bool) -> Tuple[int, int]:
+        """Retorna (confirmadas, devolvidas pelo broker)."""
+        with self._cond:
+            confirmed = returned = 0
+            for entry in self._pop(tag, multiple):
+                entry.ticket.pending -= 1
+                if entry.returned:
+                    entry.ticket.failed += 1
+                    returned += 1
+                else:
+                    confirmed += 1
+            self._cond.notify_all()
+            return confirmed, returned
+
+    def nack(self, tag: int, multiple: bool) -> List[_Entry]:
+        """Retira as mensagens NACKadas; o chamador republica ou chama `resolve`."""
+        with self._cond:
+            return self._pop(tag, multiple)
+
+    def drain(self) -> List[_Entry]:
+        """Esvazia o tracker (conexão caiu); retorna o que ficou sem confirmação."""
+        with self._cond:
+            entries = list(self._unconfirmed.values())
+            for entry in entries:
+                entry.ticket.pending -= 1
+                entry.ticket.failed += 1
+            self._unconfirmed.clear()
+            self._reserved = 0
+            self._closed = True
+            self._cond.notify_all()
+            return entries
+
+    def wait_empty(self, timeout: Optional[float] = None) -> bool:
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: not self._unconfirmed and not self._reserved, timeout
+            )
+
+    def wait_ticket(self, ticket: _Ticket, timeout: Optional[float] = None) -> bool:
+        """Espera as mensagens do ticket; True só se todas foram confirmadas.
+
+        Com a conexão fechada, mensagens ainda não entregues ao ioloop nunca
+        serão resolvidas: retorna False em vez de esperar o timeout.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: ticket.pending <= 0 or self._closed, timeout)
+            return ticket.pending <= 0 and not ticket.failed
+
+
+class ProductPublisher:
+    """Publica lotes de produtos na fila RABBIT_QUEUE_PRODUCTS com publisher confirms.
+
+    Roda uma SelectConnection numa thread própria: `publish` só serializa e
+    entrega o corpo ao ioloop, e as confirmações chegam de forma assíncrona
+    (inclusive `multiple=True`). No máximo `window` mensagens ficam em voo;
+    NACKs do broker são republicados até `max_retries` vezes.
     """
-    body = json.dumps(products, ensure_ascii=False).encode("utf-8")
-    props = pika.BasicProperties(
-        delivery_mode=2,  # persistente
-        content_type="application/json",
-        content_encoding="utf-8",
-    )
-    try:
 
-        self._ch.basic_publish(
-            exchange="",
-            routing_key=self.queue,
-            body=body,
-            properties=props,
-            mandatory=True,
+    def __init__(
+        self,
+        queue: Optional[str] = None,
+        host: Optional[str] = None,
+        port: Optional[int] = None,
+        user: Optional[str] = None,
+        password: Optional[str] = None,
+        batch_size: Optional[int] = None,
+        window: Optional[int] = None,
+        max_retries: Optional[int] = None,
+        connection_factory: Optional[Callable[..., Any]] = None,
+    ):
+        self.queue = queue or os.getenv("RABBIT_QUEUE_PRODUCTS", "queue.products")
+        self.batch_size = max(1, batch_size or env_int("PUBLISH_BATCH_ITEMS", 500))
+        self.max_retries = (
+            max_retries if max_retries is not None else env_int("PUBLISH_MAX_RETRIES", 3)
+        )
+        self._params = pika.ConnectionParameters(
+            host=host or os.getenv("RABBIT_HOST", "localhost"),
+            port=int(port or os.getenv("RABBIT_PORT", "5672")),
+            credentials=pika.PlainCredentials(
+                user or os.getenv("RABBIT_USER", "guest"),
+                password or os.getenv("RABBIT_PASS", "guest"),
+            ),
+            heartbeat=env_int("RABBIT_HEARTBEAT", 60),
+            blocked_connection_timeout=env_int("RABBIT_BLOCKED_CONN_TIMEOUT", 300),
         )
+        self._props = pika.BasicProperties(
+            delivery_mode=2,  # persistente
+            content_type="application/json",
+            content_encoding="utf-8",
+        )
+        self._factory = connection_factory or pika.SelectConnection
+        self._tracker = _ConfirmTracker(window or env_int("PUBLISH_CONFIRM_WINDOW", 256))
+        self._conn = None
+        self._channel = None
+        self._thread: Optional[threading.Thread] = None
+        self._ready = threading.Event()
+        self._closed = threading.Event()
+        self._error: Optional[str] = None
+        self.stats = {
+            "messages": 0,
+            "items": 0,
+            "confirmed": 0,
+            "nacked": 0,
+            "retried": 0,
+            "returned": 0,
+            "failed": 0,
+        }
+
+    # --- ciclo de vida -----------------------------------------------------
 
+    def start(self, timeout: float = 30.0) -> "ProductPublisher":
+        if self._thread and self._thread.is_alive():
+            return self
+        self._ready.clear()
+        self._closed.clear()
+        self._error = None
+        self._conn = self._factory(
+            self._params,
+            on_open_callback=self._on_connection_open,
+            on_open_error_callback=self._on_connection_error,
+            on_close_callback=self._on_connection_closed,
+        )
+        self._thread = threading.Thread(
+            target=self._conn.ioloop.start, name="product-publisher", daemon=True
+        )
+        self._thread.start()
+        if not self._ready.wait(timeout) or self._error:
+            raise PublishError(self._error or "timeout ao abrir o canal de publicação")
         log.info(
-            "Produto publicado na fila '%s'%s",
+            "Publisher pronto na fila '%s' (janela=%d, lote=%d itens).",
             self.queue,
-            " (com confirms)" if self._confirms else "",
+            self._tracker.window,
+            self.batch_size,
+        )
+        return self
+
+    def close(self, timeout: float = 30.0) -> None:
+        if not self._conn:
+            return
+        self.flush(timeout)
+
+        def _close():
+            if self._conn.is_open:
+                self._conn.close()
+
+        self._conn.ioloop.add_callback_threadsafe(_close)
+        self._closed.wait(timeout)
+        if self._thread:
+            self._thread.join(timeout)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # --- callbacks do ioloop --------------------------------------------
+
+    def _on_connection_open(self, conn):
+        conn.channel(on_open_callback=self._on_channel_open)
+
+    def _on_connection_error(self, conn, err):
+        self._error = f"falha ao conectar no RabbitMQ: {err}"
+        log.error(self._error)
+        self._ready.set()
+        self._closed.set()
+        conn.ioloop.stop()
+
+    def _on_connection_closed(self, conn, reason):
+        lost = self._tracker.drain()
+        if lost:
+            self.stats["failed"] += len(lost)
+            log.error("Conexão fechada com %d mensagens sem confirmação.", len(lost))
+        if not self._closed.is_set():
+            self._error = self._error or f"conexão fechada: {reason}"
+        self._ready.set()
+        self._closed.set()
+        conn.ioloop.stop()
+
+    def _on_channel_open(self, channel):
+        self._channel = channel
+        channel.add_on_return_callback(self._on_return)
+        channel.confirm_delivery(ack_nack_callback=self._on_confirm)
+        channel.queue_declare(
+            queue=self.queue, durable=True, callback=lambda _f: self._ready.set()
         )
 
-    except UnroutableError as e:
+    def _on_confirm(self, frame):
+        method = frame.method
+        if isinstance(method, Basic.Ack):
+            confirmed, returned = self._tracker.ack(method.delivery_tag, method.multiple)
+            self.stats["confirmed"] += confirmed
+            self.stats["failed"] += returned
+            return
+        for entry in self._tracker.nack(method.delivery_tag, method.multiple):
+            self.stats["nacked"] += 1
+            if entry.attempt < self.max_retries:
+                self.stats["retried"] += 1
+                self._basic_publish(entry.body, entry.attempt + 1, entry.ticket, reserved=False)
+            else:
+                self.stats["failed"] += 1
+                self._tracker.resolve(entry.ticket, ok=False)
+                log.error(
+                    "Broker NACKou a publicação para '%s' %d vezes; desistindo.",
+                    self.queue,
+                    entry.attempt + 1,
+                )
+
+    def _on_return(self, channel, method, properties, body):
+        # O message_id é o delivery tag (ver _basic_publish); o ack que vem em
+        # seguida conta a mensagem como falha para o ticket dela.
+        self.stats["returned"] += 1
+        try:
+            self._tracker.mark_returned(int(properties.message_id))
+        except (TypeError, ValueError):
+            pass
         log.error(
-            "Mensagem não roteada para a fila '%s' (fila inexistente ou binding incorreto)",
+            "Mensagem não roteada para a fila '%s' (%s %s)",
             self.queue,
+            method.reply_code,
+            method.reply_text,
         )
-        raise
-    except NackError as e:
-        log.error("Broker NACKou a publicação para '%s'", self.queue)
-        raise
-    except (ChannelClosedByBroker, ConnectionClosed, StreamLostError) as e:
-        log.exception("Falha de canal/conexão ao publicar")
-        raise
+
+    def _basic_publish(
+        self, body: bytes, attempt: int, ticket: _Ticket, reserved: bool = True
+    ) -> None:
+        tag = self._tracker.add(body, attempt, ticket, reserved=reserved)
+        self._channel.basic_publish(
+            exchange="",
+            routing_key=self.queue,
+            body=body,
+            properties=pika.BasicProperties(
+                delivery_mode=self._props.delivery_mode,
+                content_type=self._props.content_type,
+                content_encoding=self._props.content_encoding,
+                message_id=str(tag),
+            ),
+            mandatory=True,
+        )
+
+    # --- API ---------------------------------------------------------------
+
+    def _batches(self, products: Iterable[JSONItem]) -> Iterable[List[JSONItem]]:
+        # Aceita qualquer iterável (p.ex. o ItemBuffer do worker, lido em stream).
+        it = iter(products)
+        while batch := list(islice(it, self.batch_size)):
+            yield batch
+
+    def publish(
+        self,
+        products: List[JSONItem],
+        timeout: Optional[float] = 60.0,
+        ticket: Optional[_Ticket] = None,
+    ) -> int:
+        """Publica os produtos em mensagens de até `batch_size` itens. Retorna o nº de mensagens.
+
+        Com `ticket`, as confirmações destas mensagens podem ser esperadas com `wait`.
+        """
+        if not self._ready.is_set() or self._closed.is_set():
+            raise PublishError(self._error or "publisher não iniciado")
+        ticket = ticket or _Ticket()
+        sent = 0
+        for batch in self._batches(products):
+            body = json.dumps(batch, ensure_ascii=False).encode("utf-8")
+            if not self._tracker.reserve(ticket, timeout):
+                raise PublishError("janela de confirmações cheia (timeout)")
+            if self._closed.is_set():
+                raise PublishError(self._error or "conexão fechada")
+            self._conn.ioloop.add_callback_threadsafe(
+                lambda b=body: self._basic_publish(b, 0, ticket)
+            )
+            sent += 1
+            self.stats["messages"] += 1
+            self.stats["items"] += len(batch)
+        return sent
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Espera todas as mensagens em voo serem confirmadas."""
+        return self._tracker.wait_empty(timeout)
+
+    def wait(self, ticket: _Ticket, timeout: Optional[float] = None) -> bool:
+        """Espera só as mensagens do ticket. True se todas foram confirmadas."""
+        return self._tracker.wait_ticket(ticket, timeout)
+
+
+_publisher: Optional[ProductPublisher] = None
+
+
+def get_publisher() -> ProductPublisher:
+    """Publisher compartilhado pelo processo (aberto na primeira chamada)."""
+    global _publisher
+    if _publisher is None or _publisher._closed.is_set():
+        _publisher = ProductPublisher().start()
+    return _publisher
+
+
+def postProduct(products: List[JSONItem], count: int, producer_product: ProductPublisher):
+    producer_product.publish(products)
+    log.info("📦 %d: %d produtos publicados", count, len(products))
+
+
+def publish_and_confirm(products: List[JSONItem], timeout: Optional[float] = None) -> bool:
+    """Publica e aguarda os confirms desta chamada. True só se nada dela falhou."""
+    pub = get_publisher()
+    ticket = _Ticket()
+    t0 = time.monotonic()
+    pub.publish(products, ticket=ticket)
+    ok = pub.wait(ticket, timeout)
+    log.info(
+        "%d produtos publicados em '%s' em %.2fs (ok=%s).",
+        len(products),
+        pub.queue,
+        time.monotonic() - t0,
+        ok,
+    )
+    return ok
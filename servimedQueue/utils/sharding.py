@@ -0,0 +1,490 @@
+"""Crawl distribuído de um catálogo por faixas de páginas.
+
+Coordenador (``coordinate``, chamado pelo start_scrap): roda o spider em
+``--mode session`` (login + clientId + sondagem do page size), publica tarefas
+de SHARD_PAGES páginas em RABBIT_QUEUE_SHARD_TASKS com o estado da sessão e
+mantém SHARD_WINDOW tarefas em voo enquanto a página vazia final não aparece.
+Os resultados voltam numa fila exclusiva do crawl, em pedaços de
+SHARD_CHUNK_ITEMS itens seguidos de um resumo da faixa. Cada faixa fica num
+ItemBuffer próprio até as anteriores chegarem e então é anexada, em ordem de
+página, ao ItemBuffer do crawl, que vai para o disco passando de
+ITEM_BUFFER_MAX_BYTES. Quando a página terminal é vista e todas as faixas
+anteriores chegaram, o coordenador entrega esse buffer ao destino
+(PRODUCTS_SINK) como no crawl não distribuído e avisa em
+RABBIT_QUEUE_SHARD_DONE.
+
+Worker (``run_shard``, via ``python -m servimedQueue.run_shard_worker``): roda
+``run_spider.py --shard`` para a faixa recebida e publica os itens no
+``reply_to`` da tarefa à medida que o spider os emite.
+"""
+
+import json
+import logging
+import os
+import tempfile
+import time
+import uuid
+from typing import Optional
+
+import pika
+
+from shared.config import env_float, env_int
+from servimedQueue.utils.item_buffer import ITEM_BUFFER_MAX_BYTES, ItemBuffer
+from servimedQueue.utils.worker_stream import (
+    SCRAPER_HARD_TIMEOUT,
+    STATS_KEY,
+    _safe_ack,
+    _safe_nack,
+    crawl_complete,
+    crawl_failed,
+    deliver,
+    retry_message,
+    run_crawl,
+)
+
+logger = logging.getLogger(__name__)
+
+SESSION_KEY = "__session__"
+SHARD_KEY = "__shard__"
+
+SHARD_TASKS_QUEUE = os.getenv("RABBIT_QUEUE_SHARD_TASKS", "queue.shard_tasks")
+SHARD_DONE_QUEUE = os.getenv("RABBIT_QUEUE_SHARD_DONE", "queue.shard_done")
+SHARD_PAGES = max(1, env_int("SHARD_PAGES", 50))
+SHARD_WINDOW = max(1, env_int("SHARD_WINDOW", 4))
+SHARD_MAX_ATTEMPTS = max(1, env_int("SHARD_MAX_ATTEMPTS", 3))
+SHARD_CHUNK_ITEMS = max(1, env_int("SHARD_CHUNK_ITEMS", 1000))
+SHARD_POLL_SECS = env_float("SHARD_POLL_SECS", 0.5)
+# Fila de resultados some sozinha se o coordenador morrer no meio do crawl.
+SHARD_RESULTS_EXPIRES_MS = env_int("SHARD_RESULTS_EXPIRES_MS", 3600 * 1000)
+
+_PERSISTENT = pika.BasicProperties(delivery_mode=2, content_type="application/json")
+
+
+class ShardMerger:
+    """Estado do coordenador: tarefas publicadas, itens recebidos e página terminal.
+
+    Os itens de cada faixa ficam num ItemBuffer (limite de memória dividido
+    pela janela) até as faixas anteriores terminarem; aí são anexados a
+    `merged`, em ordem de página. Pedaços de uma tentativa anterior da faixa
+    são ignorados.
+    """
+
+    def __init__(
+        self,
+        crawl_id: str,
+        session: dict,
+        pages: int = SHARD_PAGES,
+        window: int = SHARD_WINDOW,
+    ):
+        self.crawl_id = crawl_id
+        self.session = session
+        self.pages = pages
+        self.window = window
+        self.terminal_page: Optional[int] = session.get("terminal_page")
+        self.tasks: dict[int, dict] = {}
+        self.done: set[int] = set()
+        self.incomplete: set[int] = set()  # faixas com erro de requisição
+        self.failed = False
+        self.merged = ItemBuffer()
+        self._buffers: dict[int, ItemBuffer] = {}
+        self._shard_max_bytes = max(1, ITEM_BUFFER_MAX_BYTES // max(1, window))
+        self._next = 0  # próxima faixa a anexar em `merged`
+
+    def first_page(self, idx: int) -> int:
+        return idx * self.pages + 1
+
+    def task(self, idx: int) -> dict:
+        first = self.first_page(idx)
+        return {
+            "crawl_id": self.crawl_id,
+            "task": idx,
+            "first_page": first,
+            "last_page": first + self.pages - 1,
+            "session": self.session,
+        }
+
+    def _needed(self, idx: int) -> bool:
+        return self.terminal_page is None or self.first_page(idx) < self.terminal_page
+
+    def to_publish(self) -> list[int]:
+        """Próximas tarefas para manter `window` faixas em voo (nenhuma após a terminal)."""
+        if self.terminal_page is not None:
+            return []
+        in_flight = sum(1 for i in self.tasks if i not in self.done)
+        nxt = len(self.tasks)
+        return list(range(nxt, nxt + max(0, self.window - in_flight)))
+
+    def _current(self, idx: int, msg: dict) -> bool:
+        """True se a mensagem é da tentativa em curso de uma faixa ainda aberta."""
+        if idx not in self.tasks or idx in self.done:
+            return False
+        attempt = msg.get("attempt")
+        return attempt is None or int(attempt) == self.tasks[idx]["attempts"]
+
+    def _drop_buffer(self, idx: int) -> None:
+        buf = self._buffers.pop(idx, None)
+        if buf is not None:
+            buf.close()
+        self.tasks[idx]["chunks"] = 0
+
+    def on_chunk(self, msg: dict) -> None:
+        """Guarda um pedaço dos itens de uma faixa."""
+        idx = int(msg.get("task", -1))
+        if not self._current(idx, msg) or not self._needed(idx):
+            return
+        buf = self._buffers.get(idx)
+        if buf is None:
+            buf = self._buffers[idx] = ItemBuffer(max_bytes=self._shard_max_bytes)
+        for item in msg.get("items") or []:
+            buf.append(item)
+        self.tasks[idx]["chunks"] = self.tasks[idx].get("chunks", 0) + 1
+
+    def on_result(self, msg: dict) -> Optional[int]:
+        """Registra o resumo de uma faixa. Retorna o índice a republicar, se houver."""
+        idx = int(msg.get("task", -1))
+        if not self._current(idx, msg):
+            return None
+        ok = bool(msg.get("ok"))
+        if ok and msg.get("chunks") is not None:
+            received = self.tasks[idx].get("chunks", 0)
+            if self._needed(idx) and received != int(msg["chunks"]):
+                logger.warning(
+                    "Faixa %d: %d de %d pedaços recebidos.", idx, received, msg["chunks"]
+                )
+                ok = False
+        if not ok:
+            attempts = self.tasks[idx]["attempts"]
+            self._drop_buffer(idx)
+            if not self._needed(idx):
+                self.done.add(idx)
+                self._merge_ready()
+                return None
+            if attempts >= SHARD_MAX_ATTEMPTS:
+                logger.error(
+                    "Faixa %d (páginas %d+) falhou %d vezes; abortando o crawl.",
+                    idx,
+                    self.first_page(idx),
+                    attempts,
+                )
+                self.failed = True
+                return None
+            logger.warning("Faixa %d falhou (tentativa %d); republicando.", idx, attempts)
+            return idx
+        self.done.add(idx)
+        if not msg.get("complete", True):
+            self.incomplete.add(idx)
+        terminal = msg.get("terminal_page")
+        if terminal is not None and (
+            self.terminal_page is None or terminal < self.terminal_page
+        ):
+            self.terminal_page = int(terminal)
+            logger.info("Página terminal do catálogo: %d.", self.terminal_page)
+        self._merge_ready()
+        return None
+
+    def _merge_ready(self) -> None:
+        """Anexa a `merged`, em ordem, as faixas cujas anteriores já terminaram."""
+        while self._next in self.tasks and (
+            self._next in self.done or not self._needed(self._next)
+        ):
+            buf = self._buffers.pop(self._next, None)
+            if buf is not None:
+                with buf:
+                    if self._needed(self._next):
+                        for line in buf.lines():
+                            self.merged.append_line(line)
+            self._next += 1
+
+    def complete(self) -> bool:
+        if self.terminal_page is None:
+            return False
+        return all(i in self.done for i in self.tasks if self._needed(i))
+
+    def catalogue_complete(self) -> bool:
+        """True se nenhuma faixa usada teve erro de requisição."""
+        return not any(self._needed(i) for i in self.incomplete)
+
+    def items(self) -> ItemBuffer:
+        """Os itens de todas as faixas usadas, em ordem de página."""
+        self._merge_ready()
+        return self.merged
+
+    def close(self) -> None:
+        for buf in self._buffers.values():
+            buf.close()
+        self._buffers.clear()
+        self.merged.close()
+
+
+def _publish_task(ch, merger: ShardMerger, idx: int, reply_to: str) -> None:
+    entry = merger.tasks.setdefault(idx, {"attempts": 0})
+    entry["attempts"] += 1
+    entry["chunks"] = 0
+    body = dict(merger.task(idx), attempt=entry["attempts"])
+    ch.basic_publish(
+        exchange="",
+        routing_key=SHARD_TASKS_QUEUE,
+        body=json.dumps(body, ensure_ascii=False).encode("utf-8"),
+        properties=pika.BasicProperties(
+            delivery_mode=2,
+            content_type="application/json",
+            reply_to=reply_to,
+            correlation_id=merger.crawl_id,
+        ),
+    )
+
+
+def _fetch_session(ch, msg: dict) -> Optional[dict]:
+    sale_type = msg.get("tipo de venda", int(os.getenv("SERVIMED_SALE_TYPE", "1")))
+    args = [
+        "-u",
+        str(msg.get("usuario") or ""),
+        "-p",
+        str(msg.get("senha") or ""),
+        "-s",
+        str(sale_type),
+        "-m",
+        "session",
+        "--loglevel",
+        "INFO",
+    ]
+    found: list[dict] = []
+
+    def on_record(record: dict) -> None:
+        if SESSION_KEY in record:
+            found.append(record[SESSION_KEY])
+
+    result = run_crawl(ch, args, on_record)
+    if crawl_failed(result):
+        raise RuntimeError("crawl de sessão falhou")
+    return found[0] if found else None
+
+
+def coordinate(ch, method, properties, body: bytes, msg: dict) -> None:
+    """Conduz um crawl distribuído e faz ACK/NACK da mensagem original."""
+    t0 = time.monotonic()
+    try:
+        session = _fetch_session(ch, msg)
+    except RuntimeError as e:
+        logger.error("%s.", e)
+        retry_message(ch, method, properties, body, str(e))
+        return
+    if session is None:
+        logger.warning("Sem sessão (login/clientId falhou); nada a distribuir.")
+        deliver(ch, method, properties, body, [])
+        return
+
+    crawl_id = uuid.uuid4().hex
+    results_q = f"queue.shard_results.{crawl_id}"
+    ch.queue_declare(queue=SHARD_TASKS_QUEUE, durable=True)
+    ch.queue_declare(queue=SHARD_DONE_QUEUE, durable=True)
+    ch.queue_declare(
+        queue=results_q,
+        durable=False,
+        arguments={"x-expires": SHARD_RESULTS_EXPIRES_MS},
+    )
+
+    merger = ShardMerger(crawl_id, session)
+    logger.info(
+        "Crawl distribuído %s: page size %d, %d páginas por faixa, janela %d.",
+        crawl_id,
+        session["page_size"],
+        merger.pages,
+        merger.window,
+    )
+    try:
+        _collect(ch, merger, results_q, t0)
+        elapsed = time.monotonic() - t0
+        if merger.failed:
+            retry_message(ch, method, properties, body, "crawl distribuído falhou")
+            _signal_done(ch, merger, msg, ok=False, items=0, elapsed=elapsed)
+            return
+
+        items = merger.items()
+        logger.info(
+            "Crawl distribuído %s concluído: %d itens de %d páginas em %d faixas "
+            "(%.0fs; %.1f MB%s).",
+            crawl_id,
+            len(items),
+            merger.terminal_page - 1,
+            len(merger.done),
+            elapsed,
+            items.nbytes / 1e6,
+            f", {items.disk_bytes / 1e6:.1f} MB gzip em disco" if items.spilled else "",
+        )
+        deliver(
+            ch,
+            method,
+            properties,
+            body,
+            items,
+            usuario=msg.get("usuario"),
+            complete=merger.catalogue_complete(),
+        )
+        _signal_done(ch, merger, msg, ok=True, items=len(items), elapsed=elapsed)
+    finally:
+        merger.close()
+
+
+def _collect(ch, merger: ShardMerger, results_q: str, t0: float) -> None:
+    """Publica as faixas e lê os resultados até o catálogo fechar ou falhar."""
+    try:
+        while not merger.complete() and not merger.failed:
+            for idx in merger.to_publish():
+                _publish_task(ch, merger, idx, results_q)
+            if SCRAPER_HARD_TIMEOUT and time.monotonic() - t0 > SCRAPER_HARD_TIMEOUT:
+                logger.error(
+                    "Crawl distribuído excedeu %ss; abortando.", SCRAPER_HARD_TIMEOUT
+                )
+                merger.failed = True
+                break
+            frame, _props, data = ch.basic_get(queue=results_q, auto_ack=True)
+            if frame is None:
+                ch.connection.sleep(SHARD_POLL_SECS)
+                continue
+            try:
+                result = json.loads(data.decode("utf-8"))
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                logger.warning("Resultado de faixa ilegível; ignorando.")
+                continue
+            if "chunk" in result:
+                merger.on_chunk(result)
+                continue
+            retry = merger.on_result(result)
+            if retry is not None:
+                _publish_task(ch, merger, retry, results_q)
+    finally:
+        try:
+            ch.queue_delete(queue=results_q)
+        except Exception as e:
+            logger.debug("Não consegui apagar %s: %s", results_q, e)
+
+def _signal_done(
+    ch, merger: ShardMerger, msg: dict, *, ok: bool, items: int, elapsed: float
+) -> None:
+    body = {
+        "crawl_id": merger.crawl_id,
+        "usuario": msg.get("usuario"),
+        "ok": ok,
+        "items": items,
+        "pages": (merger.terminal_page - 1) if merger.terminal_page else None,
+        "tasks": len(merger.tasks),
+        "elapsed": round(elapsed, 1),
+    }
+    try:
+        ch.basic_publish(
+            exchange="",
+            routing_key=SHARD_DONE_QUEUE,
+            body=json.dumps(body).encode("utf-8"),
+            properties=_PERSISTENT,
+        )
+    except Exception as e:
+        logger.warning("Não consegui publicar a conclusão do crawl: %s", e)
+
+
+# --------------------------------------------------------------------------
+# Worker
+# --------------------------------------------------------------------------
+
+
+def run_shard(ch, method, properties, body: bytes):
+    """Callback do worker: crawl de uma faixa e publicação do resultado no reply_to."""
+    try:
+        task = json.loads(body.decode("utf-8"))
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        logger.error("Tarefa de faixa inválida (JSON); descartando.")
+        _safe_nack(ch, method.delivery_tag, requeue=False)
+        return
+    reply_to = getattr(properties, "reply_to", None)
+    if not reply_to or "session" not in task:
+        logger.error("Tarefa de faixa sem reply_to/sessão; descartando.")
+        _safe_nack(ch, method.delivery_tag, requeue=False)
+        return
+
+    logger.info(
+        "Faixa %s do crawl %s: páginas %s-%s (tentativa %s).",
+        task.get("task"),
+        task.get("crawl_id"),
+        task.get("first_page"),
+        task.get("last_page"),
+        task.get("attempt"),
+    )
+    base = {
+        "crawl_id": task.get("crawl_id"),
+        "task": task.get("task"),
+        "attempt": task.get("attempt"),
+    }
+    reply_props = pika.BasicProperties(
+        content_type="application/json",
+        correlation_id=getattr(properties, "correlation_id", None),
+    )
+
+    def reply(payload: dict) -> None:
+        ch.basic_publish(
+            exchange="",
+            routing_key=reply_to,
+            body=json.dumps(dict(base, **payload), ensure_ascii=False).encode("utf-8"),
+            properties=reply_props,
+        )
+
+    # Os itens saem em pedaços à medida que o spider os emite: nem o worker
+    # nem uma mensagem AMQP guardam a faixa inteira.
+    chunk: list[dict] = []
+    sent = {"chunks": 0, "items": 0}
+    publish_error: list[Exception] = []
+    terminal: list[int] = []
+    summary: dict = {}
+
+    def flush_chunk() -> None:
+        if not chunk or publish_error:
+            return
+        try:
+            reply({"chunk": sent["chunks"], "items": chunk})
+        except Exception as e:
+            publish_error.append(e)
+            return
+        sent["chunks"] += 1
+        sent["items"] += len(chunk)
+        chunk.clear()
+
+    def on_record(record: dict) -> None:
+        if SHARD_KEY in record:
+            terminal.append(int(record[SHARD_KEY]["terminal_page"]))
+        elif STATS_KEY in record:
+            summary.update(record[STATS_KEY])
+        else:
+            chunk.append(record)
+            if len(chunk) >= SHARD_CHUNK_ITEMS:
+                flush_chunk()
+
+    fd, path = tempfile.mkstemp(prefix="shard-", suffix=".json")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            json.dump(task, fh, ensure_ascii=False)
+        result = run_crawl(ch, ["--shard", path, "--loglevel", "INFO"], on_record)
+    finally:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+    ok = not crawl_failed(result)
+    if ok:
+        flush_chunk()
+    try:
+        if publish_error:
+            raise publish_error[0]
+        reply(
+            {
+                "ok": ok,
+                "chunks": sent["chunks"],
+                "terminal_page": min(terminal) if terminal else None,
+                "complete": crawl_complete(summary),
+            }
+        )
+    except Exception:
+        logger.exception("Falha ao publicar o resultado da faixa; requeue.")
+        _safe_nack(ch, method.delivery_tag, requeue=True)
+        return
+    logger.info("Faixa %s: %d itens (ok=%s).", task.get("task"), sent["items"], ok)
+    _safe_ack(ch, method.delivery_tag)
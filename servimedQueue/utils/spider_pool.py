@@ -0,0 +1,434 @@
+"""Pool de "fork servers" aquecidos para rodar o spider sem cold start.
+
+Cada servidor é um processo Python que importa Scrapy, Twisted, as settings e o
+ProductsSpider uma única vez e depois fica esperando jobs num socket Unix. Para
+cada job ele faz fork: o filho herda os módulos já carregados, redireciona
+stdout/stderr para os pipes recebidos do consumer e roda ``run_spider.main``.
+O reactor só é instalado no filho, então cada crawl continua isolado num
+processo próprio — um crash derruba só o filho, nunca o consumer.
+
+O servidor se recicla depois de N jobs ou quando o pico de RSS de um crawl
+(rusage do filho, via wait4) passa do teto; o pool sobe outro na próxima
+requisição. Sinais para o crawl (timeout do supervisor) vão pelo socket e
+quem os entrega é o servidor, pai do filho.
+"""
+
+import argparse
+import importlib
+import importlib.util
+import json
+import logging
+import os
+import select
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from pathlib import Path
+from typing import Optional
+
+from shared.config import env_int
+
+logger = logging.getLogger(__name__)
+
+PY = sys.executable
+_MSG_MAX = 64 * 1024
+
+WARM_MODULES = (
+    "twisted.internet.defer",
+    "twisted.internet.error",
+    "scrapy",
+    "scrapy.crawler",
+    "scrapy.utils.project",
+    "scrapy.http",
+    "scrapy.core.downloader.handlers.http11",
+    "servimedScraper.settings",
+    "servimedScraper.middlewares",
+    "servimedScraper.spiders.products",
+)
+
+
+def _send(sock: socket.socket, msg: dict, fds: tuple[int, ...] = ()) -> None:
+    data = json.dumps(msg).encode("utf-8")
+    if fds:
+        socket.send_fds(sock, [data], list(fds))
+    else:
+        sock.send(data)
+
+
+def _recv(sock: socket.socket) -> Optional[dict]:
+    data = sock.recv(_MSG_MAX)
+    if not data:
+        return None
+    return json.loads(data)
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as fh:
+            pages = int(fh.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# --------------------------------------------------------------------------
+# Lado servidor (processo aquecido)
+# --------------------------------------------------------------------------
+
+
+def _run_child(run_spider, run_path: str, job: dict, fds: list[int]) -> None:
+    """Executa no filho forkado; nunca retorna."""
+    code = 1
+    try:
+        os.dup2(fds[0], 1)
+        os.dup2(fds[1], 2)
+        for fd in fds:
+            os.close(fd)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        sys.argv = [run_path, *job["argv"]]
+        try:
+            run_spider.main(job["argv"])
+            code = 0
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(code)
+
+
+def _wait_child(sock: socket.socket, pid: int):
+    """Espera o filho atendendo pedidos de sinal do consumer.
+
+    Só este processo (o pai) sinaliza o filho, e antes de coletá-lo com wait4:
+    o pid não pode ter sido reaproveitado. Retorna (status, rusage, shutdown).
+    """
+    try:
+        pidfd = os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        pidfd = None  # sem pidfd (kernel < 5.3): consulta o filho periodicamente
+    shutdown = False
+    try:
+        while True:
+            waits = [sock] if pidfd is None else [sock, pidfd]
+            ready, _, _ = select.select(waits, [], [], 0.5 if pidfd is None else None)
+            if pidfd is None or pidfd in ready:
+                wpid, status, usage = os.wait4(pid, os.WNOHANG if pidfd is None else 0)
+                if wpid == pid:
+                    return status, usage, shutdown
+            if sock not in ready:
+                continue
+            try:
+                msg = _recv(sock)
+            except (ConnectionResetError, OSError, ValueError):
+                msg = None
+            if msg is None or msg.get("op") == "shutdown":
+                # Consumer foi embora ou está encerrando: não deixa o crawl órfão.
+                shutdown = True
+                os.kill(pid, signal.SIGTERM)
+            elif msg.get("op") == "signal" and msg.get("pid") == pid:
+                os.kill(pid, int(msg["sig"]))
+    finally:
+        if pidfd is not None:
+            os.close(pidfd)
+
+
+def serve(fd: int, run_path: str, max_jobs: int, max_rss_mb: int) -> int:
+    sock = socket.socket(fileno=fd)
+    run_dir = str(Path(run_path).resolve().parent)
+    if run_dir not in sys.path:
+        sys.path.insert(0, run_dir)
+
+    t0 = time.perf_counter()
+    for name in WARM_MODULES:
+        importlib.import_module(name)
+    spec = importlib.util.spec_from_file_location("run_spider", run_path)
+    run_spider = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(run_spider)
+    warm_secs = time.perf_counter() - t0
+
+    _send(sock, {"event": "ready", "pid": os.getpid(), "warm_secs": warm_secs})
+
+    jobs = 0
+    while True:
+        try:
+            data, fds, _flags, _addr = socket.recv_fds(sock, _MSG_MAX, 2)
+        except (ConnectionResetError, OSError):
+            break
+        if not data:
+            break
+        job = json.loads(data)
+        if job.get("op") == "shutdown":
+            break
+
+        if job.get("op") == "signal":
+            continue  # sinal para um crawl que já terminou
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            sock.close()
+            _run_child(run_spider, run_path, job, fds)
+        for f in fds:
+            os.close(f)
+        _send(sock, {"event": "started", "pid": pid})
+
+        status, usage, shutdown = _wait_child(sock, pid)
+        jobs += 1
+        # ru_maxrss do filho (KB no Linux): é ele que carrega o crawl; o RSS do
+        # servidor só cresce se algo vazar nele mesmo.
+        child_rss = usage.ru_maxrss / 1024
+        rss = max(child_rss, _rss_mb())
+        retire = (max_jobs and jobs >= max_jobs) or (max_rss_mb and rss > max_rss_mb)
+        _send(
+            sock,
+            {
+                "event": "exit",
+                "pid": pid,
+                "rc": os.waitstatus_to_exitcode(status),
+                "jobs": jobs,
+                "rss_mb": round(rss, 1),
+                "child_rss_mb": round(child_rss, 1),
+                "cpu_s": round(usage.ru_utime + usage.ru_stime, 2),
+                "retire": bool(retire),
+            },
+        )
+        if retire or shutdown:
+            break
+    sock.close()
+    return 0
+
+
+# --------------------------------------------------------------------------
+# Lado consumer
+# --------------------------------------------------------------------------
+
+
+class _ForkServer:
+    def __init__(self, run_path: str, cwd: str, env: dict, max_jobs: int, max_rss_mb: int):
+        parent, child = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self.proc = subprocess.Popen(
+            [
+                PY,
+                "-u",
+                "-m",
+                "servimedQueue.utils.spider_pool",
+                "--fd",
+                str(child.fileno()),
+                "--run-spider",
+                run_path,
+                "--max-jobs",
+                str(max_jobs),
+                "--max-rss-mb",
+                str(max_rss_mb),
+            ],
+            cwd=cwd,
+            env=env,
+            pass_fds=(child.fileno(),),
+        )
+        child.close()
+        self.sock = parent
+        self.busy = False
+        self.dead = False
+
+        self.sock.settimeout(env_int("SCRAPER_POOL_WARM_TIMEOUT", 120))
+        try:
+            msg = _recv(self.sock)
+        except socket.timeout:
+            msg = None
+        if not msg or msg.get("event") != "ready":
+            self.close()
+            raise RuntimeError("fork server não ficou pronto")
+        logger.info(
+            "Fork server %s aquecido em %.2fs.", msg["pid"], msg.get("warm_secs", 0.0)
+        )
+
+    def alive(self) -> bool:
+        return not self.dead and self.proc.poll() is None
+
+    def close(self) -> None:
+        self.dead = True
+        try:
+            _send(self.sock, {"op": "shutdown"})
+        except OSError:
+            pass
+        self.sock.close()
+        try:
+            self.proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            self.proc.wait()
+
+
+class ForkedCrawl:
+    """Crawl rodando num filho do fork server, com a interface de subprocess.Popen."""
+
+    def __init__(self, server: _ForkServer, pid: int, out_r: int, err_r: int):
+        self._server = server
+        self.pid = pid
+        self.stdout = os.fdopen(out_r, "rb", buffering=0)
+        self.stderr = os.fdopen(err_r, "rb", buffering=0)
+        self.returncode: Optional[int] = None
+
+    def _read_exit(self, timeout: Optional[float]) -> bool:
+        sock = self._server.sock
+        if timeout is not None:
+            ready, _, _ = select.select([sock], [], [], timeout)
+            if not ready:
+                return False
+        sock.settimeout(None)
+        try:
+            msg = _recv(sock)
+        except OSError:
+            msg = None
+        if msg is None:
+            logger.error("Fork server morreu durante o crawl (pid=%s).", self.pid)
+            self._server.dead = True
+            self.returncode = 255
+        else:
+            self.returncode = int(msg.get("rc", 1))
+            if msg.get("retire"):
+                logger.info(
+                    "Reciclando fork server (jobs=%s, rss=%sMB).",
+                    msg.get("jobs"),
+                    msg.get("rss_mb"),
+                )
+                self._server.close()
+        self._server.busy = False
+        return True
+
+    def poll(self) -> Optional[int]:
+        if self.returncode is None:
+            self._read_exit(0)
+        return self.returncode
+
+    def wait(self, timeout: Optional[float] = None) -> int:
+        if self.returncode is None and not self._read_exit(timeout):
+            raise subprocess.TimeoutExpired(f"crawl pid={self.pid}", timeout)
+        return self.returncode
+
+    def _signal(self, sig: int) -> None:
+        # O pid é neto do consumer: quem sinaliza é o fork server, pai do
+        # crawl, que ainda não o coletou — sem corrida com reaproveitamento de pid.
+        if self.returncode is None and not self._server.dead:
+            try:
+                _send(self._server.sock, {"op": "signal", "pid": self.pid, "sig": int(sig)})
+            except OSError as e:
+                logger.warning("Não consegui sinalizar o crawl %s: %s", self.pid, e)
+
+    def terminate(self) -> None:
+        self._signal(signal.SIGTERM)
+
+    def kill(self) -> None:
+        self._signal(signal.SIGKILL)
+
+
+class SpiderPool:
+    """Mantém fork servers aquecidos e despacha um crawl por job."""
+
+    def __init__(
+        self,
+        run_path: str | Path,
+        cwd: str | Path,
+        env: Optional[dict] = None,
+        size: Optional[int] = None,
+        max_jobs: Optional[int] = None,
+        max_rss_mb: Optional[int] = None,
+    ):
+        self.run_path = str(run_path)
+        self.cwd = str(cwd)
+        self.env = env or os.environ.copy()
+        self.size = max(1, size or env_int("SCRAPER_POOL_SIZE", 1))
+        self.max_jobs = max_jobs if max_jobs is not None else env_int("SCRAPER_POOL_MAX_JOBS", 50)
+        self.max_rss_mb = (
+            max_rss_mb if max_rss_mb is not None else env_int("SCRAPER_POOL_MAX_RSS_MB", 512)
+        )
+        self._servers: list[_ForkServer] = []
+        self._lock = threading.Lock()
+
+    def warm_up(self) -> None:
+        with self._lock:
+            self._reap()
+            while len(self._servers) < self.size:
+                self._servers.append(self._spawn())
+
+    def _spawn(self) -> _ForkServer:
+        return _ForkServer(self.run_path, self.cwd, self.env, self.max_jobs, self.max_rss_mb)
+
+    def _reap(self) -> None:
+        for srv in [s for s in self._servers if not s.alive()]:
+            if not srv.dead:
+                logger.warning("Fork server saiu (rc=%s); descartando.", srv.proc.poll())
+            srv.close()
+            self._servers.remove(srv)
+
+    def _acquire(self) -> _ForkServer:
+        with self._lock:
+            self._reap()
+            for srv in self._servers:
+                if not srv.busy:
+                    srv.busy = True
+                    return srv
+            if len(self._servers) >= self.size:
+                raise RuntimeError("todos os fork servers estão ocupados")
+            srv = self._spawn()
+            srv.busy = True
+            self._servers.append(srv)
+            return srv
+
+    def start(self, argv: list[str]) -> ForkedCrawl:
+        srv = self._acquire()
+        out_r, out_w = os.pipe()
+        err_r, err_w = os.pipe()
+        try:
+            _send(srv.sock, {"argv": argv}, (out_w, err_w))
+            srv.sock.settimeout(30)
+            msg = _recv(srv.sock)
+        except (OSError, ValueError) as e:
+            srv.dead = True
+            os.close(out_r)
+            os.close(err_r)
+            raise RuntimeError(f"fork server falhou ao iniciar o crawl: {e}") from e
+        finally:
+            os.close(out_w)
+            os.close(err_w)
+        if not msg or msg.get("event") != "started":
+            srv.dead = True
+            os.close(out_r)
+            os.close(err_r)
+            raise RuntimeError("fork server não confirmou o início do crawl")
+        return ForkedCrawl(srv, int(msg["pid"]), out_r, err_r)
+
+    def close(self) -> None:
+        with self._lock:
+            for srv in self._servers:
+                srv.close()
+            self._servers.clear()
+
+
+def _main() -> int:
+    p = argparse.ArgumentParser(description="Fork server aquecido do spider.")
+    p.add_argument("--fd", type=int, required=True)
+    p.add_argument("--run-spider", required=True)
+    p.add_argument("--max-jobs", type=int, default=50)
+    p.add_argument("--max-rss-mb", type=int, default=512)
+    args = p.parse_args()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    return serve(args.fd, args.run_spider, args.max_jobs, args.max_rss_mb)
+
+
+if __name__ == "__main__":
+    sys.exit(_main())
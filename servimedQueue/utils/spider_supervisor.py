@@ -0,0 +1,202 @@
+import logging
+import os
+import re
+import selectors
+import signal
+import subprocess
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+_LEVEL_RE = re.compile(r"\b(DEBUG|INFO|WARNING|ERROR|CRITICAL)\b:")
+_READ_CHUNK = 64 * 1024
+
+
+@dataclass
+class SupervisorResult:
+    rc: Optional[int]
+    reason: str  # "exit" | "hard_timeout" | "idle_timeout"
+    elapsed: float
+
+    @property
+    def timed_out(self) -> bool:
+        return self.reason != "exit"
+
+
+class _LineReader:
+    """Acumula bytes lidos de um fd não bloqueante e entrega linhas completas."""
+
+    def __init__(self, on_line: Callable[[str], None]):
+        self.on_line = on_line
+        self._buf = bytearray()
+
+    def feed(self, chunk: bytes) -> None:
+        self._buf += chunk
+        start = 0
+        while True:
+            nl = self._buf.find(b"\n", start)
+            if nl < 0:
+                break
+            self.on_line(self._buf[start:nl].decode("utf-8", errors="replace"))
+            start = nl + 1
+        if start:
+            del self._buf[:start]
+
+    def flush(self) -> None:
+        if self._buf:
+            self.on_line(self._buf.decode("utf-8", errors="replace"))
+            self._buf.clear()
+
+
+class StderrForwarder:
+    """Reencaminha o stderr do Scrapy para o logger preservando o nível da linha.
+
+    Linhas de continuação (tracebacks) herdam o nível da última linha com nível.
+    """
+
+    _LEVELS = {
+        "DEBUG": logging.DEBUG,
+        "INFO": logging.INFO,
+        "WARNING": logging.WARNING,
+        "ERROR": logging.ERROR,
+        "CRITICAL": logging.CRITICAL,
+    }
+
+    def __init__(self, log: logging.Logger):
+        self.log = log
+        self.level = logging.INFO
+
+    def __call__(self, line: str) -> None:
+        line = line.rstrip()
+        if not line:
+            return
+        if ":" in line:
+            m = _LEVEL_RE.search(line)
+            if m:
+                self.level = self._LEVELS[m.group(1)]
+        self.log.log(self.level, line)
+
+
+def broker_fileno(ch) -> Optional[int]:
+    """fd do socket da conexão pika por trás do canal (None se indisponível)."""
+    try:
+        return ch.connection._impl._transport._sock.fileno()
+    except Exception:
+        return None
+
+
+def _stop(proc, grace: float) -> None:
+    try:
+        proc.terminate()
+        proc.wait(timeout=grace)
+    except subprocess.TimeoutExpired:
+        logger.warning("Spider não encerrou em %.0fs; SIGKILL.", grace)
+        try:
+            proc.kill()
+        except ProcessLookupError:
+            pass
+    except ProcessLookupError:
+        pass
+
+
+def supervise(
+    proc,
+    *,
+    on_stdout: Callable[[str], None],
+    on_stderr: Callable[[str], None],
+    tick: Callable[[], None],
+    tick_interval: float = 1.0,
+    hard_timeout: float = 0.0,
+    idle_timeout: float = 0.0,
+    wake_fd: Optional[int] = None,
+    kill_grace: float = 10.0,
+) -> SupervisorResult:
+    """Multiplexa stdout/stderr do spider e o socket do broker num único loop.
+
+    `proc` segue a interface de subprocess.Popen (stdout/stderr binários, wait,
+    terminate, kill). `tick` é chamado a cada `tick_interval` e sempre que
+    `wake_fd` (socket do broker) fica legível. `hard_timeout`/`idle_timeout`
+    em segundos; 0 desliga.
+    """
+    sel = selectors.DefaultSelector()
+    open_streams = 0
+    for stream, cb in ((proc.stdout, on_stdout), (proc.stderr, on_stderr)):
+        if stream is None:
+            continue
+        fd = stream.fileno()
+        os.set_blocking(fd, False)
+        sel.register(fd, selectors.EVENT_READ, _LineReader(cb))
+        open_streams += 1
+    if wake_fd is not None:
+        try:
+            sel.register(wake_fd, selectors.EVENT_READ, None)
+        except (ValueError, OSError) as e:
+            logger.debug("Socket do broker não registrável: %s", e)
+
+    start = last_output = time.monotonic()
+    next_tick = start + tick_interval
+    reason = "exit"
+
+    try:
+        while open_streams:
+            now = time.monotonic()
+            deadline = next_tick
+            if hard_timeout:
+                deadline = min(deadline, start + hard_timeout)
+            if idle_timeout:
+                deadline = min(deadline, last_output + idle_timeout)
+
+            for key, _ in sel.select(max(0.0, deadline - now)):
+                if key.data is None:
+                    tick()
+                    next_tick = time.monotonic() + tick_interval
+                    continue
+                try:
+                    chunk = os.read(key.fd, _READ_CHUNK)
+                except BlockingIOError:
+                    continue
+                if not chunk:
+                    key.data.flush()
+                    sel.unregister(key.fd)
+                    open_streams -= 1
+                    continue
+                key.data.feed(chunk)
+                last_output = time.monotonic()
+
+            now = time.monotonic()
+            if now >= next_tick:
+                tick()
+                next_tick = now + tick_interval
+            if hard_timeout and now - start >= hard_timeout:
+                reason = "hard_timeout"
+                break
+            if idle_timeout and now - last_output >= idle_timeout:
+                reason = "idle_timeout"
+                break
+    finally:
+        sel.close()
+
+    if reason != "exit":
+        logger.error(
+            "Spider excedeu %s (%.0fs); encerrando.",
+            "timeout total" if reason == "hard_timeout" else "timeout de inatividade",
+            hard_timeout if reason == "hard_timeout" else idle_timeout,
+        )
+        _stop(proc, kill_grace)
+
+    while True:
+        try:
+            rc = proc.wait(timeout=tick_interval)
+            break
+        except subprocess.TimeoutExpired:
+            tick()
+
+    if rc is not None and rc < 0:
+        try:
+            logger.warning("Spider finalizado por sinal %s.", signal.Signals(-rc).name)
+        except ValueError:
+            pass
+
+    return SupervisorResult(rc=rc, reason=reason, elapsed=time.monotonic() - start)
@@ -4,16 +4,31 @@ import json
 import time
 import subprocess
 from pathlib import Path
-from threading import Thread
 import logging
-import re
 import gzip
+import sqlite3
+import tempfile
 
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
-from shared.auth import AuthClient
+from shared.auth import AuthClient, auth_stats, get_auth_client, pool_stats
+from shared.catalogue import get_catalogue_store
+from shared.config import env_bool, env_float, env_int, load_env
+from shared.circuit_breaker import get_breaker
+from shared.profiling import Profiler, job_tag, profile_mode
+from shared.retry import RetryPolicy, retry_later
+from shared.routing import AccountRouter, AffinityStats
+from servimedQueue.utils.item_buffer import ItemBuffer, payload_size
+from servimedQueue.utils.spider_pool import SpiderPool
+from servimedQueue.utils.spider_supervisor import (
+    StderrForwarder,
+    broker_fileno,
+    supervise,
+)
+
+load_env()
 
 PY = sys.executable
 
@@ -24,54 +39,86 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-HEARTBEAT_TICK_SECS = float(os.getenv("RABBIT_HEARTBEAT_TICK", "1.0"))
-
-
-def _env_int(name: str, default: int) -> int:
-    try:
-        return int(os.getenv(name, str(default)))
-    except (TypeError, ValueError):
-        return default
-
-
-def _env_bool(name: str, default: bool) -> bool:
-    v = os.getenv(name)
-    if v is None:
-        return default
-    return v.strip().lower() in ("1", "true", "yes", "on")
+HEARTBEAT_TICK_SECS = env_float("RABBIT_HEARTBEAT_TICK", 1.0)
+API_CONNECT_TIMEOUT = env_int("API_CONNECT_TIMEOUT", 10)
+API_READ_TIMEOUT = env_int("API_READ_TIMEOUT", 300)
+API_RETRY_TOTAL = env_int("API_RETRY_TOTAL", 1)
+API_RETRY_CONNECT = env_int("API_RETRY_CONNECT", 2)
+API_RETRY_READ = env_int("API_RETRY_READ", 1)
+API_POOL_CONN = env_int("API_POOL_CONN", 10)
+API_POOL_MAX = env_int("API_POOL_MAX", 20)
+API_POST_GZIP = env_bool("API_POST_GZIP", True)
+SCRAPER_HARD_TIMEOUT = env_int("SCRAPER_HARD_TIMEOUT", 4 * 3600)
+SCRAPER_IDLE_TIMEOUT = env_int("SCRAPER_IDLE_TIMEOUT", 900)
+SCRAPER_POOL = env_bool("SCRAPER_POOL", os.name == "posix")
+# "api" = POST único em API_PRODUCTS_URL; "queue" = publica em RABBIT_QUEUE_PRODUCTS
+PRODUCTS_SINK = os.getenv("PRODUCTS_SINK", "api").strip().lower()
+# Crawl distribuído por faixas de páginas (ver sharding.py); a mensagem pode
+# sobrescrever com "shards": true/false.
+SCRAPER_SHARDED = env_bool("SCRAPER_SHARDED", False)
+# Perfil por mensagem (cpu|mem), repassado ao run_spider.py; ver shared/profiling.py.
+SCRAPER_PROFILE = profile_mode("SCRAPER_PROFILE")
+
+# Registro final do run_spider.py no modo stream (ver STATS_KEY lá).
+STATS_KEY = "__stats__"
+
+REPO_ROOT = Path(__file__).resolve().parent.parent.parent
+_POOL: SpiderPool | None = None
+
+
+def _find_run_spider() -> Path | None:
+    candidates = [
+        REPO_ROOT / "run_spider.py",
+        REPO_ROOT / "servimedScraper" / "run_spider.py",
+    ]
+    return next((c.resolve() for c in candidates if c.exists()), None)
+
+
+def _spider_env() -> dict:
+    env = os.environ.copy()
+    env.setdefault("PYTHONIOENCODING", "utf-8")
+    env.setdefault("SCRAPY_SETTINGS_MODULE", "servimedScraper.settings")
+    # shared/ e servimedQueue/ importáveis de dentro do crawl (helpers de utils/aio.py).
+    env["PYTHONPATH"] = os.pathsep.join(
+        p for p in (str(REPO_ROOT), env.get("PYTHONPATH", "")) if p
+    )
+    return env
 
 
-API_CONNECT_TIMEOUT = _env_int("API_CONNECT_TIMEOUT", 10)
-API_READ_TIMEOUT = _env_int("API_READ_TIMEOUT", 300)
-API_RETRY_TOTAL = _env_int("API_RETRY_TOTAL", 1)
-API_RETRY_CONNECT = _env_int("API_RETRY_CONNECT", 2)
-API_RETRY_READ = _env_int("API_RETRY_READ", 1)
-API_POOL_CONN = _env_int("API_POOL_CONN", 10)
-API_POOL_MAX = _env_int("API_POOL_MAX", 20)
-API_POST_GZIP = _env_bool("API_POST_GZIP", True)
+def _spider_pool(run_path: Path) -> SpiderPool:
+    global _POOL
+    if _POOL is None:
+        _POOL = SpiderPool(run_path, REPO_ROOT, env=_spider_env())
+    return _POOL
 
 
-def _drain_stderr(proc):
-    _LEVEL_RE = re.compile(r"\b(DEBUG|INFO|WARNING|ERROR|CRITICAL)\b:")
-    if not proc.stderr:
+def warm_up() -> None:
+    """Sobe os fork servers do spider antes da primeira mensagem."""
+    if not SCRAPER_POOL:
+        return
+    run_path = _find_run_spider()
+    if not run_path:
         return
-    level_fn = logger.info
-    for raw in proc.stderr:
-        line = raw.rstrip()
-        m = _LEVEL_RE.search(line)
-        if m:
-            lvl = m.group(1)
-            if lvl == "DEBUG":
-                level_fn = logger.debug
-            elif lvl == "INFO":
-                level_fn = logger.info
-            elif lvl == "WARNING":
-                level_fn = logger.warning
-            elif lvl == "ERROR":
-                level_fn = logger.error
-            elif lvl == "CRITICAL":
-                level_fn = logger.critical
-        level_fn(line)
+    try:
+        _spider_pool(run_path).warm_up()
+    except Exception as e:
+        logger.warning("Pool do spider indisponível (%s); usando subprocess.", e)
+
+
+def _start_spider(run_path: Path, args: list[str]):
+    """Inicia o crawl no pool aquecido; cai para subprocess se o pool falhar."""
+    if SCRAPER_POOL:
+        try:
+            return _spider_pool(run_path).start(args)
+        except Exception as e:
+            logger.warning("Pool do spider falhou (%s); usando subprocess.", e)
+    return subprocess.Popen(
+        [PY, "-u", str(run_path), *args],
+        cwd=str(REPO_ROOT),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        env=_spider_env(),
+    )
 
 
 def _make_session() -> requests.Session:
@@ -110,7 +157,51 @@ def _safe_nack(ch, tag, requeue):
         logger.warning("NACK falhou (canal fechado?): %s", e)
 
 
-def _post_all(items, api_url: str, auth: AuthClient) -> tuple[bool, bool]:
+ROUTER = AccountRouter()
+RETRY_POLICY = RetryPolicy(ROUTER.queue, exchange=ROUTER.dead_letter_exchange)
+
+
+def _retry_key(body: bytes):
+    """Routing key do shard da conta, para a retentativa manter a afinidade."""
+    if not ROUTER.enabled:
+        return None
+    try:
+        usuario = json.loads(body).get("usuario")
+    except (ValueError, AttributeError):
+        return None
+    return ROUTER.routing_key(usuario) if usuario else None
+
+
+def retry_message(
+    ch, method, properties, body: bytes, reason: str, count_attempt: bool = True
+) -> None:
+    """Reagenda a mensagem com backoff (fila de atraso) em vez de requeue imediato."""
+    try:
+        retry_later(
+            ch,
+            method,
+            properties,
+            body,
+            RETRY_POLICY,
+            reason,
+            count_attempt,
+            routing_key=_retry_key(body),
+        )
+    except Exception as e:
+        logger.warning("Retentativa com atraso falhou (%s); NACK requeue.", e)
+        _safe_nack(ch, method.delivery_tag, requeue=True)
+
+
+def _encode_items(items):
+    """Corpo do POST (array JSON, gzip com API_POST_GZIP): bytes, ou arquivo
+    temporário quando o ItemBuffer já foi para o disco."""
+    if isinstance(items, ItemBuffer):
+        return items.payload(compress=API_POST_GZIP)
+    payload = json.dumps(items, ensure_ascii=False).encode("utf-8")
+    return gzip.compress(payload) if API_POST_GZIP else payload
+
+
+def post_items(items, api_url: str, auth: AuthClient) -> tuple[bool, bool]:
     """
     Retorna (ok, requeue):
       ok=True                 -> ACK
@@ -126,52 +217,52 @@ def _post_all(items, api_url: str, auth: AuthClient) -> tuple[bool, bool]:
 
     headers = {"Content-Type": "application/json"}
     headers.update(auth.auth_header())
+    if API_POST_GZIP:
+        headers["Content-Encoding"] = "gzip"
+
+    body = _encode_items(items)
+
+    # Só agora, com token e corpo prontos, reserva a chamada (em meio-aberto, a sonda).
+    breaker = get_breaker(api_url)
+    if not breaker.allow():
+        if hasattr(body, "close"):
+            body.close()
+        logger.warning("Circuito da API de produtos aberto; POST adiado.")
+        return False, True
 
     logger.info("POSTando %d itens para %s ...", len(items), api_url)
 
+    resp = None
     try:
         t0 = time.time()
-        if API_POST_GZIP:
-            payload = json.dumps(items, ensure_ascii=False).encode("utf-8")
-            gz = gzip.compress(payload)
-            headers["Content-Encoding"] = "gzip"
-            resp = SESSION.post(
-                api_url,
-                data=gz,
-                headers=headers,
-                timeout=(API_CONNECT_TIMEOUT, API_READ_TIMEOUT),
-            )
-            dt = time.time() - t0
-            logger.info(
-                "POST gzip concluído em %.1fs (status=%s, req-bytes≈%s)",
-                dt,
-                resp.status_code,
-                len(gz),
-            )
-        else:
-            resp = SESSION.post(
-                api_url,
-                json=items,
-                headers=headers,
-                timeout=(API_CONNECT_TIMEOUT, API_READ_TIMEOUT),
-            )
-            dt = time.time() - t0
-            size = len(resp.request.body) if resp.request and resp.request.body else "?"
-            logger.info(
-                "POST concluído em %.1fs (status=%s, req-bytes≈%s)",
-                dt,
-                resp.status_code,
-                size,
-            )
+        resp = SESSION.post(
+            api_url,
+            data=body,
+            headers=headers,
+            timeout=(API_CONNECT_TIMEOUT, API_READ_TIMEOUT),
+        )
+        dt = time.time() - t0
+        logger.info(
+            "POST%s concluído em %.1fs (status=%s, req-bytes≈%s)",
+            " gzip" if API_POST_GZIP else "",
+            dt,
+            resp.status_code,
+            payload_size(body),
+        )
 
-    except (
-        requests.exceptions.Timeout,
-        requests.exceptions.ConnectionError,
-        requests.exceptions.SSLError,
-    ) as e:
+    except requests.exceptions.RequestException as e:
+        # Timeout, conexão, SSL, ChunkedEncodingError...: falha do endpoint.
         logger.warning("Erro de rede no POST: %s -> requeue", e)
+        breaker.record_failure()
         return False, True
-
+    finally:
+        if hasattr(body, "close"):
+            body.close()
+        if resp is None:
+            # Saiu sem resposta por outro motivo: não prende a sonda do meio-aberto.
+            breaker.release()
+
+    breaker.record_status(resp.status_code)
     if resp.status_code in (408, 429, 500, 502, 503, 504):
         logger.warning("HTTP %s do endpoint; requeue.", resp.status_code)
         return False, True
@@ -202,6 +293,52 @@ def _post_all(items, api_url: str, auth: AuthClient) -> tuple[bool, bool]:
     return True, False
 
 
+AFFINITY = AffinityStats()
+
+
+def _record_affinity(usuario) -> None:
+    """Loga se a conta já passou por este worker (caches quentes) e a taxa acumulada."""
+    if not usuario:
+        return
+    hit = AFFINITY.record(usuario)
+    logger.info(
+        "Afinidade: conta %s neste worker — acerto %.0f%% (%d/%d mensagens).",
+        "já vista" if hit else "nova",
+        100 * AFFINITY.hit_rate,
+        AFFINITY.hits,
+        AFFINITY.hits + AFFINITY.misses,
+    )
+
+
+def _log_reuse_stats() -> None:
+    pool = pool_stats(SESSION)
+    tokens = auth_stats()
+    logger.info(
+        "Reuso: conexões %.0f%% (%d conexões/%d requisições), tokens %.0f%% (%d novos/%d reutilizados).",
+        pool["connection_reuse_rate"] * 100,
+        pool["connections"],
+        pool["requests"],
+        tokens["token_reuse_rate"] * 100,
+        tokens["token_requests"],
+        tokens["token_reuses"],
+    )
+
+
+def _publish_all(items) -> tuple[bool, bool]:
+    """Publica os itens na fila de produtos com confirms. Mesmo contrato de post_items."""
+    from servimedQueue.utils.post_products import PublishError, publish_and_confirm
+
+    if not items:
+        logger.info("Nenhum produto coletado; nada a publicar.")
+        return True, False
+    try:
+        ok = publish_and_confirm(items, timeout=API_READ_TIMEOUT)
+    except PublishError as e:
+        logger.warning("Falha ao publicar produtos: %s -> requeue", e)
+        return False, True
+    return ok, not ok
+
+
 def _tick_heartbeat(ch):
     """Processa eventos/heartbeats do pika sem liberar o callback."""
     try:
@@ -210,7 +347,138 @@ def _tick_heartbeat(ch):
         logger.debug("tick heartbeat falhou: %s", e)
 
 
+def run_crawl(ch, args: list[str], on_record):
+    """Roda run_spider.py com `args`, entregando cada linha JSON do stdout a `on_record`.
+
+    Retorna o SupervisorResult, ou None se o spider nem chegou a iniciar.
+    """
+    run_path = _find_run_spider()
+    if not run_path:
+        logger.error("run_spider.py não encontrado na raiz nem em servimedScraper/.")
+        return None
+
+    proc = _start_spider(run_path, args)
+    if not proc.stdout:
+        logger.error("stdout do subprocesso indisponível.")
+        return None
+
+    def on_stdout(line: str) -> None:
+        line = line.strip()
+        if not line:
+            return
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            logger.warning("Linha não é JSON válido: %s", line)
+            return
+        on_record(record)
+
+    return supervise(
+        proc,
+        on_stdout=on_stdout,
+        on_stderr=StderrForwarder(logger),
+        tick=lambda: _tick_heartbeat(ch),
+        tick_interval=HEARTBEAT_TICK_SECS,
+        hard_timeout=SCRAPER_HARD_TIMEOUT,
+        idle_timeout=SCRAPER_IDLE_TIMEOUT,
+        wake_fd=broker_fileno(ch),
+    )
+
+
+def crawl_failed(result) -> bool:
+    """Loga e devolve True se o crawl não terminou bem (deve ir para requeue)."""
+    if result is None:
+        return True
+    if result.timed_out:
+        logger.error(
+            "run_spider.py interrompido (%s) após %.0fs; requeue.",
+            result.reason,
+            result.elapsed,
+        )
+        return True
+    if result.rc not in (0, None):
+        logger.error("run_spider.py saiu com código %s; requeue.", result.rc)
+        return True
+    return False
+
+
+def crawl_complete(stats: dict | None) -> bool:
+    """True se o resumo do crawl (registro STATS_KEY) indica catálogo completo."""
+    if not stats:
+        return False
+    return stats.get("finish_reason") == "finished" and not stats.get("request_errors")
+
+
+def _store_catalogue(usuario, items, partial: bool = False, complete: bool = True) -> None:
+    """Guarda o catálogo da conta no store local (CATALOGUE_DB) para o consumer de pedidos.
+
+    Com `partial` (refresh de GTINs) só os itens recebidos são atualizados. Um
+    crawl com páginas perdidas (`complete=False`) não troca o catálogo: apagaria
+    da conta os produtos dessas páginas.
+    """
+    store = get_catalogue_store()
+    if store is None or not usuario or not items:
+        return
+    if not partial and not complete:
+        logger.warning(
+            "Crawl incompleto (erros de requisição); catálogo local mantido como estava."
+        )
+        return
+    try:
+        t0 = time.time()
+        if partial:
+            n = store.upsert_items(usuario, items)
+        else:
+            n = store.replace_catalogue(usuario, items)
+        logger.info("Catálogo local atualizado: %d itens em %.2fs.", n, time.time() - t0)
+    except sqlite3.Error as e:
+        logger.warning("Falha ao gravar o catálogo local: %s", e)
+
+
+def products_api_closed_for() -> float:
+    """Segundos até o circuito da API de produtos aceitar uma sonda (0 = pode enviar)."""
+    api_url = os.getenv("API_PRODUCTS_URL")
+    if PRODUCTS_SINK == "queue" or not api_url:
+        return 0.0
+    return get_breaker(api_url).retry_after()
+
+
+def deliver(
+    ch, method, properties, body, items, usuario=None, partial=False, complete=True
+) -> None:
+    """Envia os itens ao destino (PRODUCTS_SINK) e faz ACK/NACK da mensagem."""
+    _store_catalogue(usuario, items, partial, complete)
+    if PRODUCTS_SINK == "queue":
+        ok, requeue = _publish_all(items)
+    else:
+        api_url = os.getenv("API_PRODUCTS_URL")
+        auth = get_auth_client(session=SESSION)
+        ok, requeue = post_items(items, api_url, auth)
+        _log_reuse_stats()
+
+    if ok:
+        _safe_ack(ch, method.delivery_tag)
+        logger.info("Mensagem ACK (POST OK).")
+    elif requeue:
+        retry_message(ch, method, properties, body, "envio dos produtos falhou")
+    else:
+        _safe_nack(ch, method.delivery_tag, requeue=False)
+        logger.info("Mensagem NACK (descartada).")
+
+
 def start_scrap(ch, method, properties, body: bytes):
+    if not SCRAPER_PROFILE:
+        return _start_scrap(ch, method, properties, body)
+    tag = job_tag(
+        getattr(properties, "message_id", None),
+        getattr(properties, "correlation_id", None),
+        f"msg{method.delivery_tag}",
+    )
+    with Profiler(SCRAPER_PROFILE, "scrap", tag):
+        _start_scrap(ch, method, properties, body, profile_tag=tag)
+
+
+def _start_scrap(ch, method, properties, body: bytes, profile_tag=None):
     try:
         LOG_EACH_ITEM = os.getenv("LOG_EACH_ITEM", "0").lower() in ("1", "true", "yes")
         LOG_EVERY_N = int(os.getenv("LOG_EVERY_N", "0"))
@@ -221,25 +489,35 @@ def start_scrap(ch, method, properties, body: bytes):
         mode = "stream"
 
         logger.info("Mensagem recebida: usuario=%s tipo_venda=%s", usuario, sale_type)
-
-        here = Path(__file__).resolve().parent
-        repo_root = here.parent.parent
-        candidates = [
-            repo_root / "run_spider.py",
-            repo_root / "servimedScraper" / "run_spider.py",
-        ]
-        run_path = next((c.resolve() for c in candidates if c.exists()), None)
-        if not run_path:
-            logger.error(
-                "run_spider.py não encontrado na raiz nem em servimedScraper/."
+        _record_affinity(usuario)
+
+        # Com a API fora do ar o crawl inteiro seria jogado fora no POST:
+        # adia a mensagem sem gastar uma tentativa.
+        wait = products_api_closed_for()
+        if wait:
+            retry_message(
+                ch,
+                method,
+                properties,
+                body,
+                f"circuito da API de produtos aberto (~{wait:.0f}s)",
+                count_attempt=False,
             )
-            _safe_nack(ch, method.delivery_tag, requeue=True)
             return
 
-        cmd = [
-            PY,
-            "-u",
-            str(run_path),
+        gtins = msg.get("gtins")
+        if gtins is not None and not isinstance(gtins, list):
+            logger.error("Campo 'gtins' deve ser uma lista; NACK descarta.")
+            _safe_nack(ch, method.delivery_tag, requeue=False)
+            return
+
+        if not gtins and msg.get("shards", SCRAPER_SHARDED):
+            from servimedQueue.utils.sharding import coordinate
+
+            coordinate(ch, method, properties, body, msg)
+            return
+
+        args = [
             "-u",
             str(usuario or ""),
             "-p",
@@ -251,93 +529,72 @@ def start_scrap(ch, method, properties, body: bytes):
             "--loglevel",
             "INFO",
         ]
-
-        env = os.environ.copy()
-        env.setdefault("PYTHONIOENCODING", "utf-8")
-        env.setdefault("SCRAPY_SETTINGS_MODULE", "servimedScraper.settings")
-
-        proc = subprocess.Popen(
-            cmd,
-            cwd=str(repo_root),
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            bufsize=1,
-            encoding="utf-8",
-            env=env,
-        )
-        if not proc.stdout:
-            logger.error("stdout do subprocesso indisponível.")
-            _safe_nack(ch, method.delivery_tag, requeue=True)
-            return
-
-        t_err = Thread(target=_drain_stderr, args=(proc,), daemon=True)
-        t_err.start()
-
-        items: list[dict] = []
-        last_tick = time.monotonic()
-
-        for line in proc.stdout:
-            line = line.strip()
-            if not line:
-                if time.monotonic() - last_tick >= HEARTBEAT_TICK_SECS:
-                    _tick_heartbeat(ch)
-                    last_tick = time.monotonic()
-                continue
-
+        if profile_tag:
+            args += ["--profile", SCRAPER_PROFILE, "--profile-tag", profile_tag]
+
+        gtins_file = None
+        if gtins:
+            # Refresh parcial: só os GTINs pedidos, mesclados no catálogo existente.
+            with tempfile.NamedTemporaryFile(
+                "w", suffix=".gtins", delete=False, encoding="utf-8"
+            ) as fh:
+                fh.write("\n".join(str(g) for g in gtins))
+            gtins_file = fh.name
+            args += ["--gtins", gtins_file]
+            logger.info("Refresh parcial de %d GTINs.", len(gtins))
+
+        # Itens serializados em memória até ITEM_BUFFER_MAX_BYTES; depois, em disco (gzip).
+        items = ItemBuffer()
+        summary: dict = {}
+
+        def on_item(item: dict) -> None:
+            if STATS_KEY in item:
+                summary.update(item[STATS_KEY])
+                return
+            items.append(item)
+            count = len(items)
+            if LOG_EACH_ITEM:
+                logger.info("📦 %d: %s", count, json.dumps(item, ensure_ascii=False))
+            elif LOG_EVERY_N and count % LOG_EVERY_N == 0:
+                logger.info(
+                    "📦 [%d] último item: %s",
+                    count,
+                    json.dumps(item, ensure_ascii=False)[:300],
+                )
+
+        with items:
             try:
-                item = json.loads(line)
-            except json.JSONDecodeError:
-                logger.warning("Linha não é JSON válido: %s", line)
-            else:
-                items.append(item)
-                count = len(items)
-                if LOG_EACH_ITEM:
-                    logger.info(
-                        "📦 %d: %s", count, json.dumps(item, ensure_ascii=False)
-                    )
-                elif LOG_EVERY_N and count % LOG_EVERY_N == 0:
-                    logger.info(
-                        "📦 [%d] último item: %s",
-                        count,
-                        json.dumps(item, ensure_ascii=False)[:300],
-                    )
-
-            if time.monotonic() - last_tick >= HEARTBEAT_TICK_SECS:
-                _tick_heartbeat(ch)
-                last_tick = time.monotonic()
-
-        while True:
-            rc = proc.poll()
-            if rc is not None:
-                break
-            _tick_heartbeat(ch)
-            time.sleep(min(HEARTBEAT_TICK_SECS, 0.5))
-
-        if rc not in (0, None):
-            logger.error("run_spider.py saiu com código %s; requeue.", rc)
-            _safe_nack(ch, method.delivery_tag, requeue=True)
-            return
-
-        logger.info("Spider finalizado. Total de itens: %d", len(items))
-
-        api_url = os.getenv("API_PRODUCTS_URL")
-        auth = AuthClient()
-        ok, requeue = _post_all(items, api_url, auth)
+                result = run_crawl(ch, args, on_item)
+            finally:
+                if gtins_file:
+                    os.unlink(gtins_file)
+            if crawl_failed(result):
+                retry_message(ch, method, properties, body, "crawl falhou")
+                return
 
-        if ok:
-            _safe_ack(ch, method.delivery_tag)
-            logger.info("Mensagem ACK (POST OK).")
-        else:
-            _safe_nack(ch, method.delivery_tag, requeue=requeue)
-            logger.info("Mensagem NACK (requeue=%s).", requeue)
+            logger.info(
+                "Spider finalizado. Total de itens: %d (%.1f MB%s)",
+                len(items),
+                items.nbytes / 1e6,
+                f", {items.disk_bytes / 1e6:.1f} MB gzip em disco" if items.spilled else "",
+            )
+            deliver(
+                ch,
+                method,
+                properties,
+                body,
+                items,
+                usuario=usuario,
+                partial=bool(gtins),
+                complete=crawl_complete(summary),
+            )
 
     except json.JSONDecodeError:
         logger.exception("Mensagem inválida (JSON); NACK descarta.")
         _safe_nack(ch, method.delivery_tag, requeue=False)
-    except Exception:
-        logger.exception("Erro inesperado; NACK requeue.")
-        _safe_nack(ch, method.delivery_tag, requeue=True)
+    except Exception as e:
+        logger.exception("Erro inesperado; retentativa com atraso.")
+        retry_message(ch, method, properties, body, f"erro inesperado: {e!r}")
 
 
 if __name__ == "__main__":
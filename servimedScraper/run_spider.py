@@ -1,19 +1,51 @@
 # run_spider.py
 import os
 import sys
-import argparse
 import json
+import argparse
 from pathlib import Path
-from scrapy.crawler import CrawlerProcess
-from scrapy.utils.project import get_project_settings
-from scrapy import signals
-from servimedScraper.spiders.products import ProductsSpider
-from dotenv import load_dotenv
+from types import SimpleNamespace
+
+import servimedScraper  # noqa: F401  (põe a raiz do repositório, com shared/, no sys.path)
+from shared.config import load_env
+
+# Último registro do modo stream: resumo do crawl para o worker.
+STATS_KEY = "__stats__"
+
+
+def load_crawl_modules(mode: str, refresh: bool = False) -> SimpleNamespace:
+    """Importa só o que o modo escolhido usa (Scrapy fica fora do caminho do --help)."""
+    from scrapy.crawler import CrawlerProcess
+    from scrapy.utils.project import get_project_settings
+    from servimedScraper.spiders.products import ProductsSpider
+
+    mods = SimpleNamespace(
+        CrawlerProcess=CrawlerProcess,
+        get_project_settings=get_project_settings,
+        ProductsSpider=ProductsSpider,
+    )
+    if mode in ("session", "shard"):
+        from servimedScraper.spiders.products_shard import (
+            ProductsSessionSpider,
+            ProductsShardSpider,
+            load_shard,
+        )
+
+        mods.ProductsSessionSpider = ProductsSessionSpider
+        mods.ProductsShardSpider = ProductsShardSpider
+        mods.load_shard = load_shard
+    if refresh:
+        from servimedScraper.spiders.products_refresh import (
+            ProductsRefreshSpider,
+            load_gtins,
+        )
 
-load_dotenv()
+        mods.ProductsRefreshSpider = ProductsRefreshSpider
+        mods.load_gtins = load_gtins
+    return mods
 
 
-def parse_args():
+def parse_args(argv=None):
     p = argparse.ArgumentParser(
         description="Executa o spider de produtos (login + listagem + extração)."
     )
@@ -45,34 +77,277 @@ def parse_args():
     p.add_argument(
         "--mode",
         "-m",
-        choices=["file", "stream"],
+        choices=["file", "stream", "session"],
         default="file",
-        help="Modo de saída: file (escreve em arquivo) ou stream (imprime itens no stdout).",
+        help=(
+            "Modo de saída: file (escreve em arquivo), stream (imprime itens no stdout) "
+            "ou session (só login + clientId; imprime o estado da sessão para o crawl distribuído)."
+        ),
+    )
+    p.add_argument(
+        "--shard",
+        metavar="ARQUIVO",
+        default=None,
+        help="Crawl distribuído: busca só a faixa de páginas descrita no JSON (sessão + páginas), em modo stream.",
+    )
+    p.add_argument(
+        "--accounts",
+        metavar="ARQUIVO",
+        default=None,
+        help=(
+            "JSONL de contas (usuario, senha, sale_type): roda todas no mesmo processo. "
+            "Com {conta} no --output, um arquivo por conta; senão um arquivo/stream com o campo 'conta'."
+        ),
+    )
+    p.add_argument(
+        "--parallel",
+        type=int,
+        default=int(os.getenv("SERVIMED_ACCOUNTS_PARALLEL", 4)),
+        help="No --accounts, quantas contas rodam ao mesmo tempo (cada uma com --concurrency requisições).",
+    )
+    p.add_argument(
+        "--gtins",
+        metavar="ARQUIVO",
+        default=None,
+        help="Refresh parcial: consulta só os GTINs do arquivo (um por linha) via filtro, sem paginar o catálogo.",
+    )
+    cassette = p.add_mutually_exclusive_group()
+    cassette.add_argument(
+        "--record",
+        metavar="CASSETE",
+        default=None,
+        help="Grava todas as respostas da API num cassete (.jsonl.gz).",
     )
-    return p.parse_args()
+    cassette.add_argument(
+        "--replay",
+        metavar="CASSETE",
+        default=None,
+        help="Reproduz as respostas de um cassete gravado, sem acessar a rede.",
+    )
+    p.add_argument(
+        "--realtime",
+        action="store_true",
+        help="No --replay, respeita a latência original de cada resposta.",
+    )
+    p.add_argument(
+        "--http2",
+        action="store_true",
+        default=None,
+        help="Baixa da API em HTTP/2 multiplexado (env SERVIMED_HTTP2), com fallback para HTTP/1.1.",
+    )
+    p.add_argument(
+        "--reactor",
+        choices=["asyncio", "default"],
+        default=None,
+        help="Reactor do Twisted (env SERVIMED_REACTOR): asyncio (padrão) ou o nativo da plataforma.",
+    )
+    p.add_argument(
+        "--uvloop",
+        action="store_true",
+        default=None,
+        help="Com o reactor asyncio, usa o event loop do uvloop se instalado (env SERVIMED_UVLOOP).",
+    )
+    p.add_argument(
+        "--api-base",
+        default=None,
+        help="URL base alternativa da API (env SERVIMED_API_BASE), p.ex. um stub local.",
+    )
+    p.add_argument(
+        "--profile",
+        choices=["cpu", "mem"],
+        default=None,
+        help=(
+            "Perfil do crawl (env SERVIMED_PROFILE): cpu (cProfile/pstats) ou mem "
+            "(maiores alocações do tracemalloc no fim e no pico), gravado em PROFILE_DIR."
+        ),
+    )
+    p.add_argument(
+        "--profile-tag",
+        default=None,
+        help="Identificador do job no nome dos arquivos de perfil (default: o modo).",
+    )
+    return p.parse_args(argv)
+
+
+def run_accounts(process, args, mode: str) -> int:
+    """Várias contas num CrawlerProcess: até --parallel crawls simultâneos."""
+    from scrapy import signals
+    from scrapy.exporters import CsvItemExporter, JsonItemExporter, JsonLinesItemExporter
+    from twisted.internet.defer import DeferredList, DeferredSemaphore
+
+    from servimedScraper.spiders.products import ProductsSpider
+    from servimedScraper.utils.accounts import (
+        AccountExporter,
+        account_output,
+        load_accounts,
+        print_summary,
+        summary_row,
+    )
+
+    try:
+        accounts = load_accounts(args.accounts, args.saleType)
+    except ValueError as e:
+        print(f"Erro: {e}", file=sys.stderr)
+        return 2
+    except OSError as e:
+        print(f"Erro: não consegui ler {args.accounts}: {e.strerror or e}", file=sys.stderr)
+        return 2
+    if not accounts:
+        print(f"Erro: nenhuma conta em {args.accounts}", file=sys.stderr)
+        return 2
 
+    exporter_cls = {
+        "jsonlines": JsonLinesItemExporter,
+        "json": JsonItemExporter,
+        "csv": CsvItemExporter,
+    }[args.format if mode == "file" else "jsonlines"]
 
-def main():
-    args = parse_args()
+    def open_exporter(fh):
+        exporter = exporter_cls(fh, encoding="utf-8")
+        exporter.start_exporting()
+        return exporter
+
+    per_account = mode == "file" and "{conta}" in args.output
+    shared = None
+    if mode == "stream":
+        shared = (open_exporter(sys.stdout.buffer), sys.stdout.buffer)
+    elif not per_account:
+        path = Path(args.output).expanduser().resolve()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fh = open(path, "wb")
+        shared = (open_exporter(fh), fh)
+
+    outputs: dict[str, AccountExporter] = {}
+    rows: dict[str, dict] = {}
+
+    def start_one(acc):
+        if shared is None:
+            path = account_output(args.output, acc.label)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fh = open(path, "wb")
+            out = AccountExporter(open_exporter(fh), fh)
+        else:
+            out = AccountExporter(shared[0], shared[1], tag=acc.label, owns_file=False)
+        outputs[acc.label] = out
+
+        crawler = process.create_crawler(ProductsSpider)
+        crawler.signals.connect(out.on_item, signal=signals.item_scraped)
+
+        def finish(result):
+            out.close()
+            rows[acc.label] = summary_row(acc.label, crawler.stats.get_stats())
+            return result
+
+        d = process.crawl(
+            crawler, usuario=acc.usuario, senha=acc.senha, sale_type=acc.sale_type
+        )
+        return d.addBoth(finish)
+
+    sem = DeferredSemaphore(max(1, args.parallel))
+    done = DeferredList([sem.run(start_one, acc) for acc in accounts], consumeErrors=True)
+
+    def stop(_):
+        from twisted.internet import reactor
+
+        if reactor.running:
+            reactor.stop()
+
+    done.addBoth(stop)
+    process.start(stop_after_crawl=False)
+
+    if shared is not None:
+        shared[0].finish_exporting()
+        if mode == "file":
+            shared[1].close()
+        else:
+            shared[1].flush()
+
+    ordered = [rows.get(a.label) or summary_row(a.label, {}) for a in accounts]
+    print_summary(ordered)
+    return 0 if all(r["motivo"] == "finished" for r in ordered) else 1
+
+
+def main(argv=None):
+    load_env()
+    args = parse_args(argv)
 
     usuario = args.usuario or os.getenv("SERVIMED_USER")
     senha = args.senha or os.getenv("SERVIMED_PASS")
-    sale_type = args.saleType
+    mode = "shard" if args.shard else args.mode
+
+    if args.accounts and (mode not in ("file", "stream") or args.gtins):
+        print("Erro: --accounts só vale nos modos file e stream, sem --gtins.", file=sys.stderr)
+        sys.exit(2)
 
-    if not usuario or not senha:
+    if mode != "shard" and not args.accounts and (not usuario or not senha):
         print(
             "Erro: informe credenciais (--usuario/--senha ou env SERVIMED_USER/SERVIMED_PASS)",
             file=sys.stderr,
         )
         sys.exit(2)
 
-    settings = get_project_settings()
+    if args.gtins and mode not in ("file", "stream"):
+        print("Erro: --gtins só vale nos modos file e stream.", file=sys.stderr)
+        sys.exit(2)
+
+    profile = args.profile or os.getenv("SERVIMED_PROFILE", "").strip().lower()
+    if not profile:
+        crawl(args, mode, usuario, senha)
+        return
+
+    from shared.profiling import Profiler
+
+    try:
+        profiler = Profiler(profile, "spider", args.profile_tag or mode)
+    except ValueError as e:
+        print(f"Erro: {e}", file=sys.stderr)
+        sys.exit(2)
+    with profiler:
+        crawl(args, mode, usuario, senha)
+
+
+def crawl(args, mode: str, usuario, senha):
+    sale_type = args.saleType
+    mods = load_crawl_modules(mode, refresh=bool(args.gtins))
+    ProductsSpider = mods.ProductsSpider
+    spider_kwargs = {"usuario": usuario, "senha": senha, "sale_type": sale_type}
+    if args.gtins:
+        ProductsSpider = mods.ProductsRefreshSpider
+        spider_kwargs["gtins"] = mods.load_gtins(args.gtins)
+
+    settings = mods.get_project_settings()
     settings.set("LOG_LEVEL", args.loglevel, priority="cmdline")
     settings.set("CONCURRENT_REQUESTS", args.concurrency, priority="cmdline")
     settings.set("DOWNLOAD_DELAY", args.delay, priority="cmdline")
     settings.set("AUTOTHROTTLE_ENABLED", True, priority="cmdline")
 
-    if args.mode == "file":
+    if args.http2:
+        settings.set("SERVIMED_HTTP2_ENABLED", True, priority="cmdline")
+    if args.api_base:
+        settings.set("SERVIMED_API_BASE", args.api_base, priority="cmdline")
+    if args.reactor or args.uvloop:
+        from servimedScraper.utils.reactor import reactor_settings
+
+        reactor = args.reactor or os.getenv("SERVIMED_REACTOR", "asyncio")
+        uvloop = bool(args.uvloop) or bool(settings.get("ASYNCIO_EVENT_LOOP"))
+        for key, value in reactor_settings(reactor, uvloop).items():
+            settings.set(key, value, priority="cmdline")
+
+    if args.record or args.replay:
+        settings.set(
+            "SERVIMED_CASSETTE_MODE",
+            "record" if args.record else "replay",
+            priority="cmdline",
+        )
+        settings.set(
+            "SERVIMED_CASSETTE_PATH", args.record or args.replay, priority="cmdline"
+        )
+        settings.set("SERVIMED_CASSETTE_REALTIME", args.realtime, priority="cmdline")
+        if args.replay:
+            settings.set("AUTOTHROTTLE_ENABLED", False, priority="cmdline")
+            settings.set("DOWNLOAD_DELAY", 0, priority="cmdline")
+
+    if mode == "file" and not args.accounts:
         out_path = Path(args.output).expanduser().resolve()
         out_path.parent.mkdir(parents=True, exist_ok=True)
         settings.set(
@@ -89,22 +364,46 @@ def main():
     else:
         settings.set("FEEDS", {}, priority="cmdline")
 
-    process = CrawlerProcess(settings)
+    process = mods.CrawlerProcess(settings)
 
-    if args.mode == "stream":
+    if args.accounts:
+        sys.exit(run_accounts(process, args, mode))
+
+    if mode != "file":
+        from scrapy import signals
 
         def on_item_scraped(item, response, spider):
             print(json.dumps(dict(item), ensure_ascii=False), flush=True)
 
-        crawler = process.create_crawler(ProductsSpider)
+        if mode == "shard":
+            crawler = process.create_crawler(mods.ProductsShardSpider)
+            spider_kwargs = {"shard": mods.load_shard(args.shard)}
+        else:
+            spidercls = mods.ProductsSessionSpider if mode == "session" else ProductsSpider
+            crawler = process.create_crawler(spidercls)
         crawler.signals.connect(on_item_scraped, signal=signals.item_scraped)
-        process.crawl(crawler, usuario=usuario, senha=senha, sale_type=sale_type)
+
+        def on_spider_closed(spider, reason):
+            # Registro de controle (como __shard__/__session__): o worker só troca
+            # o catálogo local inteiro se o crawl terminou sem erro de requisição.
+            stats = crawler.stats
+            record = {
+                STATS_KEY: {
+                    "finish_reason": reason,
+                    "request_errors": stats.get_value("servimed/request_errors", 0),
+                    "items": stats.get_value("item_scraped_count", 0),
+                }
+            }
+            print(json.dumps(record), flush=True)
+
+        crawler.signals.connect(on_spider_closed, signal=signals.spider_closed)
+        process.crawl(crawler, **spider_kwargs)
     else:
-        process.crawl(ProductsSpider, usuario=usuario, senha=senha, sale_type=sale_type)
+        process.crawl(ProductsSpider, **spider_kwargs)
 
     try:
         process.start()
-        if args.mode == "file":
+        if mode == "file":
             print(f"\n✅ Concluído. Saída em: {args.output}")
         sys.exit(0)
     except Exception as e:
@@ -0,0 +1,9 @@
+import sys
+from pathlib import Path
+
+# shared/ (config, profiling) fica na raiz do repositório, um nível acima do
+# projeto Scrapy; o worker e a imagem já a põem no PYTHONPATH, isto cobre
+# ``scrapy crawl``/``python run_spider.py`` rodados de dentro de servimedScraper/.
+_ROOT = Path(__file__).resolve().parents[2]
+if (_ROOT / "shared").is_dir() and str(_ROOT) not in sys.path:
+    sys.path.append(str(_ROOT))
@@ -0,0 +1,240 @@
+import logging
+import time
+from urllib.parse import urlparse
+
+from scrapy import signals
+from scrapy.core.downloader.handlers.http11 import HTTP11DownloadHandler
+from twisted.internet import defer
+from twisted.internet.error import ConnectionDone, ConnectionLost
+from twisted.python.failure import Failure
+from twisted.web._newclient import ResponseFailed
+
+from servimedScraper.utils.hedging import HedgeBudget, LatencyTracker, endpoint_key
+
+logger = logging.getLogger(__name__)
+
+
+class ServimedDownloadHandler:
+    """Handler de https: HTTP/2 multiplexado para a API, HTTP/1.1 para o resto.
+
+    Com SERVIMED_HTTP2_ENABLED, requisições para SERVIMED_HTTP2_DOMAINS vão pelo
+    H2DownloadHandler do Scrapy (uma conexão TLS por host, N streams em paralelo).
+    Se o servidor não negociar h2 via ALPN (ou a conexão cair antes da primeira
+    resposta h2), o host é marcado como só-HTTP/1.1 e a requisição é refeita
+    pelo handler padrão. Sem o pacote ``h2`` instalado, tudo segue em HTTP/1.1.
+
+    Com SERVIMED_HEDGE_ENABLED, requisições para SERVIMED_HEDGE_PATHS que passam
+    do percentil SERVIMED_HEDGE_PERCENTILE da latência do endpoint ganham uma
+    duplicata (até SERVIMED_HEDGE_BUDGET das requisições); vale a primeira
+    resposta e a outra é cancelada. Fica abaixo dos middlewares: slot, retry e
+    stats veem uma única requisição.
+    """
+
+    lazy = False
+
+    def __init__(self, settings, crawler):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self._http11 = HTTP11DownloadHandler(settings, crawler)
+        self._h2 = None
+        self._h2_errors: tuple = ()
+        self._h2_hosts = {
+            h.strip().lower()
+            for h in settings.getlist("SERVIMED_HTTP2_DOMAINS")
+            if h.strip()
+        }
+        self._h2_confirmed: set[str] = set()
+        self._h1_only: set[str] = set()
+
+        if settings.getbool("SERVIMED_HTTP2_ENABLED") and self._h2_hosts:
+            try:
+                from h2.exceptions import ProtocolError
+                from OpenSSL.SSL import Error as SSLError
+                from scrapy.core.downloader.handlers.http2 import H2DownloadHandler
+                from scrapy.core.http2.protocol import InvalidNegotiatedProtocol
+            except ImportError as e:
+                logger.warning(
+                    "HTTP/2 indisponível (%s); instale o extra 'http2'. Usando HTTP/1.1.",
+                    e,
+                )
+            else:
+                self._h2 = H2DownloadHandler(settings, crawler)
+                self._h2_errors = (
+                    InvalidNegotiatedProtocol,
+                    ProtocolError,
+                    SSLError,
+                    ConnectionLost,
+                    ConnectionDone,
+                )
+                logger.info(
+                    "HTTP/2 habilitado para %s (fallback automático para HTTP/1.1).",
+                    ", ".join(sorted(self._h2_hosts)),
+                )
+
+        self._hedge_paths: tuple = ()
+        if settings.getbool("SERVIMED_HEDGE_ENABLED"):
+            self._hedge_paths = tuple(
+                p.strip() for p in settings.getlist("SERVIMED_HEDGE_PATHS") if p.strip()
+            )
+            self._hedge_q = settings.getfloat("SERVIMED_HEDGE_PERCENTILE", 95.0)
+            self._hedge_min_delay = settings.getfloat("SERVIMED_HEDGE_MIN_DELAY", 0.05)
+            self._latency = LatencyTracker(
+                window=settings.getint("SERVIMED_HEDGE_WINDOW", 200),
+                min_samples=settings.getint("SERVIMED_HEDGE_MIN_SAMPLES", 20),
+            )
+            self._budget = HedgeBudget(settings.getfloat("SERVIMED_HEDGE_BUDGET", 0.05))
+            crawler.signals.connect(self._log_hedge_stats, signal=signals.spider_closed)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings, crawler)
+
+    def _use_h2(self, request, host: str) -> bool:
+        return (
+            self._h2 is not None
+            and host in self._h2_hosts
+            and host not in self._h1_only
+            and not request.meta.get("proxy")
+        )
+
+    def download_request(self, request, spider):
+        if self._hedge_paths and urlparse(request.url).path in self._hedge_paths:
+            return self._download_hedged(request, spider)
+        return self._download(request, spider)
+
+    def _download(self, request, spider):
+        host = (urlparse(request.url).hostname or "").lower()
+        if not self._use_h2(request, host):
+            self.stats.inc_value("servimed/http11/requests")
+            return self._http11.download_request(request, spider)
+
+        self.stats.inc_value("servimed/http2/requests")
+        d = self._h2.download_request(request, spider)
+        d.addCallback(self._on_h2_response, host)
+        d.addErrback(self._on_h2_failure, request, spider, host)
+        return d
+
+    def _on_h2_response(self, response, host: str):
+        if host not in self._h2_confirmed:
+            self._h2_confirmed.add(host)
+            logger.info("Conexão HTTP/2 estabelecida com %s.", host)
+        return response
+
+    def _is_negotiation_failure(self, failure) -> bool:
+        if failure.check(*self._h2_errors):
+            return True
+        if failure.check(ResponseFailed):
+            for reason in failure.value.reasons:
+                exc = getattr(reason, "value", reason)
+                if isinstance(exc, self._h2_errors):
+                    return True
+        return False
+
+    def _on_h2_failure(self, failure, request, spider, host: str):
+        # Depois que o host já respondeu em h2, erros são erros de rede comuns
+        # (RetryMiddleware cuida); só caímos para HTTP/1.1 na negociação.
+        if host in self._h2_confirmed or not self._is_negotiation_failure(failure):
+            return failure
+        if host not in self._h1_only:
+            self._h1_only.add(host)
+            logger.warning(
+                "%s não negociou HTTP/2 (%s); usando HTTP/1.1.",
+                host,
+                failure.getErrorMessage(),
+            )
+        self.stats.inc_value("servimed/http2/fallback")
+        self.stats.inc_value("servimed/http11/requests")
+        return self._http11.download_request(request, spider)
+
+    # ------------------------------------------------------------------
+    # Hedging
+    # ------------------------------------------------------------------
+
+    def _download_hedged(self, request, spider):
+        from twisted.internet import reactor
+
+        key = endpoint_key(request.url)
+        self._budget.count_request()
+        threshold = self._latency.percentile(key, self._hedge_q)
+        start = time.monotonic()
+        attempts: list = []
+        state = {"pending": 0, "done": False}
+        outcome = defer.Deferred(lambda _: [d.cancel() for d in attempts])
+        timer = None
+
+        def settle(result, which: str):
+            state["pending"] -= 1
+            if which == "primary" and (state["done"] or not isinstance(result, Failure)):
+                # A janela mede a tentativa original, mesmo quando a duplicata
+                # vence: cancelada, ela levou pelo menos até aqui. Medir só o
+                # vencedor encolheria o percentil a cada duplicata bem-sucedida.
+                self._latency.observe(key, time.monotonic() - start)
+            if state["done"]:
+                return None  # perdedor (ou cancelado): descarta
+            if isinstance(result, Failure) and state["pending"] > 0:
+                return None  # a outra tentativa ainda pode responder
+            state["done"] = True
+            if timer is not None and timer.active():
+                timer.cancel()
+            for d in attempts:
+                if not d.called:
+                    d.cancel()
+            if isinstance(result, Failure):
+                outcome.errback(result)
+                return None
+            elapsed = time.monotonic() - start
+            request.meta["download_latency"] = elapsed
+            if len(attempts) > 1:
+                self.stats.inc_value(f"servimed/hedge/{which}_won")
+                self._update_win_rate()
+            outcome.callback(result)
+            return None
+
+        def launch(req, which: str):
+            state["pending"] += 1
+            d = self._download(req, spider)
+            attempts.append(d)
+            d.addBoth(settle, which)
+
+        def hedge():
+            if state["done"]:
+                return
+            if not self._budget.take():
+                self.stats.inc_value("servimed/hedge/skipped_budget")
+                return
+            self.stats.inc_value("servimed/hedge/issued")
+            launch(request.copy(), "hedge")
+
+        launch(request, "primary")
+        if threshold is not None and not state["done"]:
+            timer = reactor.callLater(max(threshold, self._hedge_min_delay), hedge)
+        return outcome
+
+    def _update_win_rate(self) -> float:
+        issued = self.stats.get_value("servimed/hedge/issued", 0)
+        if not issued:
+            return 0.0
+        rate = self.stats.get_value("servimed/hedge/hedge_won", 0) / issued
+        self.stats.set_value("servimed/hedge/win_rate", round(rate, 3))
+        return rate
+
+    def _log_hedge_stats(self, spider=None) -> None:
+        # No spider_closed: as stats ainda não foram despejadas (no close do
+        # handler, em engine_stopped, já foram).
+        issued = self.stats.get_value("servimed/hedge/issued", 0)
+        if not issued:
+            return
+        rate = self._update_win_rate()
+        logger.info(
+            "Hedging: %d duplicatas em %d requisições elegíveis (%.1f%%); "
+            "a duplicata venceu %.0f%% das vezes.",
+            issued,
+            self._budget.requests,
+            100 * issued / max(1, self._budget.requests),
+            100 * rate,
+        )
+
+    def close(self):
+        if self._h2 is not None:
+            self._h2.close()
+        return self._http11.close()
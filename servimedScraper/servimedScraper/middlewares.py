@@ -1,8 +1,10 @@
 from scrapy import signals
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
 import json
-from dotenv import load_dotenv
-
-load_dotenv()
+from servimedScraper.utils.cassette import Cassette, CassetteWriter, request_key
+from servimedScraper.utils.requests import req_login, req_timestamp
 
 
 class ServimedscraperSpiderMiddleware:
@@ -36,6 +38,11 @@ class ServimedscraperSpiderMiddleware:
 
 
 class ServimedscraperDownloaderMiddleware:
+    def __init__(self):
+        self._auth_key = None
+        self._auth_headers: tuple = ()
+        self._auth_cookies: tuple = ()
+
     @classmethod
     def from_crawler(cls, crawler):
 
@@ -43,6 +50,35 @@ class ServimedscraperDownloaderMiddleware:
         crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
         return s
 
+    def _auth_bundle(self, state: dict) -> tuple[tuple, tuple]:
+        """Headers e cookies de auth, refeitos só quando o login troca o estado.
+
+        O spider substitui os valores de ``state`` (nunca muta a lista de users),
+        então comparar os próprios objetos basta.
+        """
+        key = (
+            state.get("access_token"),
+            state.get("user_code"),
+            state.get("cookie_access_token"),
+            state.get("users"),
+        )
+        if key != self._auth_key:
+            access_token, user_code, cookie_access_token, users = key
+            headers = []
+            cookies = []
+            if user_code:
+                headers.append(("loggeduser", str(user_code)))
+            if access_token:
+                headers.append(("accesstoken", str(access_token)))
+            if users:
+                cookies.append(("users", json.dumps(users)))
+            if cookie_access_token:
+                cookies.append(("accesstoken", str(cookie_access_token)))
+            self._auth_key = key
+            self._auth_headers = tuple(headers)
+            self._auth_cookies = tuple(cookies)
+        return self._auth_headers, self._auth_cookies
+
     def process_request(self, request, spider):
         request.headers.setdefault("Content-Type", "application/json")
         request.headers.setdefault("Accept", "application/json")
@@ -51,20 +87,11 @@ class ServimedscraperDownloaderMiddleware:
         if not request.meta.get("needs_auth"):
             return None
 
-        state = getattr(spider, "state", {}) or {}
-        access_token = state.get("access_token")
-        user_code = state.get("user_code")
-        cookie_access_token = state.get("cookie_access_token")
-        users = state.get("users")
-
-        if user_code:
-            request.headers.setdefault("loggeduser", str(user_code))
-        if access_token:
-            request.headers.setdefault("accesstoken", str(access_token))
-        if users:
-            request.cookies.setdefault("users", json.dumps(users))
-        if cookie_access_token:
-            request.cookies.setdefault("accesstoken", str(cookie_access_token))
+        headers, cookies = self._auth_bundle(getattr(spider, "state", {}) or {})
+        for name, value in headers:
+            request.headers.setdefault(name, value)
+        for name, value in cookies:
+            request.cookies.setdefault(name, value)
 
         return None
 
@@ -78,3 +105,230 @@ class ServimedscraperDownloaderMiddleware:
 
     def spider_opened(self, spider):
         spider.logger.info("Spider opened: %s" % spider.name)
+
+
+class ServimedscraperReauthMiddleware:
+    """Refaz login e timestamp quando a API rejeita o token no meio do crawl.
+
+    Uma resposta com status em SERVIMED_REAUTH_HTTP_CODES para uma requisição
+    autenticada dispara um único re-login + get-timestamp (atualizando
+    ``spider.state``); enquanto isso as requisições autenticadas que saem
+    esperam, e as rejeitadas são reenviadas com o token novo. Cada requisição
+    é reenviada no máximo uma vez; SERVIMED_REAUTH_MAX limita os re-logins.
+    """
+
+    _AUTH_HEADERS = (b"accesstoken", b"loggeduser", b"Cookie")
+
+    def __init__(self, crawler, codes, max_refreshes: int):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.codes = set(codes)
+        self.max_refreshes = max_refreshes
+        self.generation = 0
+        self.refreshing = False
+        self._waiters: list = []
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("SERVIMED_REAUTH_ENABLED", True):
+            raise NotConfigured
+        return cls(
+            crawler,
+            [int(c) for c in crawler.settings.getlist("SERVIMED_REAUTH_HTTP_CODES")],
+            crawler.settings.getint("SERVIMED_REAUTH_MAX", 3),
+        )
+
+    @staticmethod
+    def _skip(request) -> bool:
+        return request.meta.get("servimed_reauth") or not request.meta.get("needs_auth")
+
+    async def _wait(self) -> bool:
+        from scrapy.utils.defer import maybe_deferred_to_future
+        from twisted.internet import defer
+
+        d = defer.Deferred()
+        self._waiters.append(d)
+        return await maybe_deferred_to_future(d)
+
+    async def process_request(self, request, spider):
+        if self._skip(request):
+            return None
+        if self.refreshing:
+            self.stats.inc_value("servimed/reauth/paused")
+            await self._wait()
+        request.meta["auth_generation"] = self.generation
+        state = getattr(spider, "state", {}) or {}
+        # Requisições criadas antes do refresh carregam o par antigo.
+        if b"x-cart" in request.headers and state.get("x-cart"):
+            request.headers[b"x-peperone"] = str(state["timestamp"])
+            request.headers[b"x-cart"] = str(state["x-cart"])
+        return None
+
+    async def process_response(self, request, response, spider):
+        if self._skip(request) or response.status not in self.codes:
+            return response
+        if request.meta.get("reauth_times", 0) >= 1:
+            spider.logger.error(
+                "HTTP %s mesmo após re-login em %s.", response.status, request.url
+            )
+            return response
+        # Resposta de antes do último refresh: o token já foi trocado, só reenvia.
+        if request.meta.get("auth_generation", 0) == self.generation:
+            if not await self._refresh(spider, f"HTTP {response.status}"):
+                return response
+        self.stats.inc_value("servimed/reauth/replayed")
+        return self._replay(request, spider)
+
+    def _replay(self, request, spider):
+        headers = request.headers.copy()
+        for name in self._AUTH_HEADERS:
+            headers.pop(name, None)
+        cookies = request.cookies if isinstance(request.cookies, dict) else {}
+        cookies = {k: v for k, v in cookies.items() if k not in ("accesstoken", "users")}
+        return request.replace(
+            headers=headers,
+            cookies=cookies,
+            dont_filter=True,
+            meta={**request.meta, "reauth_times": request.meta.get("reauth_times", 0) + 1},
+        )
+
+    async def _refresh(self, spider, reason: str) -> bool:
+        if self.refreshing:
+            return await self._wait()
+        if self.generation >= self.max_refreshes or not getattr(spider, "senha", None):
+            spider.logger.error(
+                "Token rejeitado (%s) e re-login indisponível (%d feitos).",
+                reason,
+                self.generation,
+            )
+            return False
+
+        from scrapy.utils.defer import maybe_deferred_to_future
+
+        self.refreshing = True
+        spider.logger.warning("Token rejeitado (%s); refazendo login e timestamp.", reason)
+        ok = False
+        try:
+            engine = self.crawler.engine
+            login = req_login(
+                spider.api_base, spider.usuario, spider.senha, callback=None, errback=None
+            )
+            login.meta["servimed_reauth"] = True
+            response = await maybe_deferred_to_future(engine.download(login))
+            if response.status < 400 and spider.apply_login(response):
+                ts = req_timestamp(spider.api_base, callback=None, errback=None)
+                ts.meta["servimed_reauth"] = True
+                response = await maybe_deferred_to_future(engine.download(ts))
+                if response.status < 400:
+                    spider.apply_timestamp(response)
+                    ok = True
+        except Exception as e:
+            spider.logger.error("Re-login falhou: %r", e)
+        finally:
+            self.generation += 1
+            self.refreshing = False
+            self.stats.inc_value(f"servimed/reauth/{'ok' if ok else 'failed'}")
+            waiters, self._waiters = self._waiters, []
+            for d in waiters:
+                d.callback(ok)
+        return ok
+
+
+class ServimedscraperCassetteMiddleware:
+    """Grava (record) ou reproduz (replay) as respostas da API num cassete gzip.
+
+    SERVIMED_CASSETTE_MODE=record|replay liga o middleware; SERVIMED_CASSETTE_PATH
+    aponta o arquivo. Em replay, SERVIMED_CASSETTE_REALTIME=true respeita a latência
+    gravada de cada resposta; por padrão serve tudo o mais rápido possível.
+    """
+
+    def __init__(self, mode: str, path: str, realtime: bool = False):
+        self.mode = mode
+        self.path = path
+        self.realtime = realtime
+        self.writer: CassetteWriter | None = None
+        self.cassette: Cassette | None = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        mode = (crawler.settings.get("SERVIMED_CASSETTE_MODE") or "").strip().lower()
+        if mode not in ("record", "replay"):
+            raise NotConfigured
+        path = crawler.settings.get("SERVIMED_CASSETTE_PATH")
+        if not path:
+            raise NotConfigured("SERVIMED_CASSETTE_PATH não configurado")
+        s = cls(
+            mode,
+            path,
+            realtime=crawler.settings.getbool("SERVIMED_CASSETTE_REALTIME", False),
+        )
+        s.crawler = crawler
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    async def process_request(self, request, spider):
+        if self.mode != "replay" or self.cassette is None:
+            return None
+
+        key = request_key(request.method, request.url, request.body)
+        record = self.cassette.pop(key)
+        if record is None:
+            self.crawler.stats.inc_value("cassette/miss")
+            spider.logger.warning(
+                "Cassete sem resposta para %s %s", request.method, request.url
+            )
+            raise IgnoreRequest(f"cassette miss: {request.url}")
+
+        self.crawler.stats.inc_value("cassette/hit")
+        if self.realtime and record.get("elapsed"):
+            from scrapy.utils.defer import maybe_deferred_to_future
+            from twisted.internet import reactor
+            from twisted.internet.task import deferLater
+
+            await maybe_deferred_to_future(
+                deferLater(reactor, float(record["elapsed"]), lambda: None)
+            )
+
+        headers = Headers(record["headers"])
+        body = Cassette.body_of(record)
+        respcls = responsetypes.from_args(headers=headers, url=record["url"], body=body)
+        request.meta["download_latency"] = float(record.get("elapsed") or 0.0)
+        return respcls(
+            url=record["url"],
+            status=int(record["status"]),
+            headers=headers,
+            body=body,
+            request=request,
+        )
+
+    def process_response(self, request, response, spider):
+        if self.mode == "record" and self.writer is not None:
+            self.writer.write(
+                request_key(request.method, request.url, request.body),
+                method=request.method,
+                url=response.url,
+                status=response.status,
+                headers={
+                    k.decode("latin-1"): [v.decode("latin-1") for v in vs]
+                    for k, vs in response.headers.items()
+                },
+                body=response.body,
+                elapsed=float(request.meta.get("download_latency") or 0.0),
+            )
+            self.crawler.stats.inc_value("cassette/recorded")
+        return response
+
+    def spider_opened(self, spider):
+        if self.mode == "record":
+            self.writer = CassetteWriter(self.path)
+            spider.logger.info("Gravando cassete em %s", self.path)
+        else:
+            self.cassette = Cassette(self.path)
+            spider.logger.info(
+                "Reproduzindo cassete %s (realtime=%s)", self.path, self.realtime
+            )
+
+    def spider_closed(self, spider):
+        if self.writer is not None:
+            self.writer.close()
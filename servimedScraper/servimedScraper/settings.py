@@ -1,42 +1,15 @@
-from dotenv import load_dotenv
 import os
 
-load_dotenv()
+from shared.config import (
+    env_bool as _env_bool,
+    env_bool_any as _env_bool_any,
+    env_float as _env_float,
+    env_int as _env_int,
+    load_env,
+)
+from servimedScraper.utils.reactor import reactor_settings as _reactor_settings
 
-
-def _env_bool(name: str, default: bool) -> bool:
-    v = os.getenv(name)
-    if v is None:
-        return default
-    return v.strip().lower() in ("1", "true", "yes", "on")
-
-
-def _env_int(name: str, default: int) -> int:
-    v = os.getenv(name)
-    if v is None:
-        return default
-    try:
-        return int(v)
-    except (TypeError, ValueError):
-        return default
-
-
-def _env_float(name: str, default: float) -> float:
-    v = os.getenv(name)
-    if v is None:
-        return default
-    try:
-        return float(v)
-    except (TypeError, ValueError):
-        return default
-
-
-def _env_bool_any(names: list[str], default: bool) -> bool:
-    """Lê a primeira env existente em names, útil para compat ('AUTOTHROTTLE' vs 'AUTOTHROTTLE_ENABLED')."""
-    for n in names:
-        if os.getenv(n) is not None:
-            return _env_bool(n, default)
-    return default
+load_env()
 
 
 BOT_NAME = "servimedScraper"
@@ -53,8 +26,62 @@ RETRY_TIMES = _env_int("RETRY_TIMES", 1)
 DOWNLOAD_TIMEOUT = _env_int("DOWNLOAD_TIMEOUT", 30)
 REDIRECT_ENABLED = _env_bool("REDIRECT_ENABLED", True)
 DOWNLOADER_MIDDLEWARES = {
+    "servimedScraper.middlewares.ServimedscraperReauthMiddleware": 530,
     "servimedScraper.middlewares.ServimedscraperDownloaderMiddleware": 540,
+    "servimedScraper.middlewares.ServimedscraperCassetteMiddleware": 950,
+}
+SERVIMED_REAUTH_ENABLED = _env_bool("SERVIMED_REAUTH", True)
+SERVIMED_REAUTH_HTTP_CODES = [
+    int(c)
+    for c in os.getenv("SERVIMED_REAUTH_HTTP_CODES", "401,403").split(",")
+    if c.strip().isdigit()
+]
+SERVIMED_REAUTH_MAX = _env_int("SERVIMED_REAUTH_MAX", 3)
+SERVIMED_CASSETTE_MODE = os.getenv("SERVIMED_CASSETTE_MODE", "")
+SERVIMED_CASSETTE_PATH = os.getenv("SERVIMED_CASSETTE_PATH", "")
+SERVIMED_CASSETTE_REALTIME = _env_bool("SERVIMED_CASSETTE_REALTIME", False)
+SERVIMED_PAGE_SIZE = _env_int("SERVIMED_PAGE_SIZE", 200)
+SERVIMED_PAGE_SIZE_MIN = _env_int("SERVIMED_PAGE_SIZE_MIN", 20)
+SERVIMED_PAGE_SLOW_SECS = _env_float("SERVIMED_PAGE_SLOW_SECS", 15.0)
+SERVIMED_PAGE_MAX_SKIPS = _env_int("SERVIMED_PAGE_MAX_SKIPS", 3)
+SERVIMED_CLIENT_PAGE_SIZE = _env_int("SERVIMED_CLIENT_PAGE_SIZE", 20)
+SERVIMED_PAGE_SIZE_CACHE = os.getenv(
+    "SERVIMED_PAGE_SIZE_CACHE", "~/.cache/servimed/page_size.json"
+)
+SERVIMED_API_BASE = os.getenv("SERVIMED_API_BASE", "")
+# Páginas de produtos: fingerprint pela chave montada em req_products.
+REQUEST_FINGERPRINTER_CLASS = "servimedScraper.utils.requests.ServimedRequestFingerprinter"
+DOWNLOAD_HANDLERS = {
+    "https": "servimedScraper.handlers.ServimedDownloadHandler",
 }
+SERVIMED_HTTP2_ENABLED = _env_bool("SERVIMED_HTTP2", False)
+SERVIMED_HTTP2_DOMAINS = [
+    d.strip()
+    for d in os.getenv("SERVIMED_HTTP2_DOMAINS", "peapi.servimed.com.br").split(",")
+    if d.strip()
+]
+SERVIMED_HTTP2_MAX_STREAMS = _env_int("SERVIMED_HTTP2_MAX_STREAMS", 32)
+SERVIMED_HEDGE_ENABLED = _env_bool("SERVIMED_HEDGE", False)
+SERVIMED_HEDGE_PATHS = [
+    p.strip()
+    for p in os.getenv("SERVIMED_HEDGE_PATHS", "/api/carrinho/oculto").split(",")
+    if p.strip()
+]
+SERVIMED_HEDGE_PERCENTILE = _env_float("SERVIMED_HEDGE_PERCENTILE", 95.0)
+SERVIMED_HEDGE_BUDGET = _env_float("SERVIMED_HEDGE_BUDGET", 0.05)
+SERVIMED_HEDGE_MIN_SAMPLES = _env_int("SERVIMED_HEDGE_MIN_SAMPLES", 20)
+SERVIMED_HEDGE_MIN_DELAY = _env_float("SERVIMED_HEDGE_MIN_DELAY", 0.05)
+SERVIMED_HEDGE_WINDOW = _env_int("SERVIMED_HEDGE_WINDOW", 200)
+SERVIMED_REFRESH_BATCH = _env_int("SERVIMED_REFRESH_BATCH", 1)
+SERVIMED_REFRESH_SEPARATOR = os.getenv("SERVIMED_REFRESH_SEPARATOR", " ")
+SERVIMED_REFRESH_PAGE_SIZE = _env_int("SERVIMED_REFRESH_PAGE_SIZE", 20)
+SERVIMED_REFRESH_MAX_PAGES = _env_int("SERVIMED_REFRESH_MAX_PAGES", 3)
+_REACTOR = _reactor_settings(
+    os.getenv("SERVIMED_REACTOR", "asyncio"), _env_bool("SERVIMED_UVLOOP", False)
+)
+TWISTED_REACTOR = _REACTOR["TWISTED_REACTOR"]
+ASYNCIO_EVENT_LOOP = _REACTOR["ASYNCIO_EVENT_LOOP"]
+COMPRESSION_ENABLED = True
 API_POST_GZIP = "false"
 FEED_EXPORT_ENCODING = os.getenv("FEED_EXPORT_ENCODING", "utf-8")
 LOG_LEVEL = os.getenv("SCRAPY_LOG_LEVEL", "INFO")
@@ -5,6 +5,9 @@ import logging
 from servimedScraper.utils.jwt import decode_jwt
 from scrapy.spidermiddlewares.httperror import HttpError
 from servimedScraper.utils.xcart import generate_x_cart
+from scrapy import signals
+from servimedScraper.utils.accounts import SpiderErrorCounter
+from servimedScraper.utils.page_size import PageSizeCache, fit_page_size
 from twisted.internet.error import TimeoutError, TCPTimedOutError, DNSLookupError
 from servimedScraper.utils.requests import (
     req_login,
@@ -12,10 +15,8 @@ from servimedScraper.utils.requests import (
     req_products,
     req_timestamp,
 )
-from dotenv import load_dotenv
 import re
-
-load_dotenv()
+from urllib.parse import urlparse
 
 logger = logging.getLogger(__name__)
 
@@ -41,6 +42,36 @@ class ProductsSpider(scrapy.Spider):
             "timestamp": None,
             "x-cart": None,
         }
+        self.page_size = None
+        self.page_size_confirmed = False
+        self.page_size_cap_pending = False
+
+    @classmethod
+    def update_settings(cls, settings):
+        super().update_settings(settings)
+        if not settings.getbool("SERVIMED_HTTP2_ENABLED"):
+            return
+        # Em HTTP/2 todas as requisições do host dividem uma conexão; o limite
+        # do slot passa a ser o número de streams simultâneos.
+        slots = dict(settings.getdict("DOWNLOAD_SLOTS"))
+        streams = settings.getint("SERVIMED_HTTP2_MAX_STREAMS", 32)
+        for host in settings.getlist("SERVIMED_HTTP2_DOMAINS"):
+            slots.setdefault(host.strip(), {"concurrency": streams})
+        settings.set("DOWNLOAD_SLOTS", slots, priority="spider")
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        spider._error_counter = SpiderErrorCounter(spider)
+        crawler.signals.connect(spider._error_counter.detach, signal=signals.spider_closed)
+        api_base = crawler.settings.get("SERVIMED_API_BASE")
+        if api_base:
+            spider.api_base = api_base.rstrip("/")
+            spider.allowed_domains = [
+                *spider.allowed_domains,
+                urlparse(spider.api_base).hostname,
+            ]
+        return spider
 
     async def start(self):
         if not self.usuario or not self.senha:
@@ -48,6 +79,7 @@ class ProductsSpider(scrapy.Spider):
                 "Credenciais ausentes: passe --usuario e --senha ou use as variáveis de ambiente."
             )
             return
+        self._setup_page_size()
         yield req_login(
             self.api_base,
             self.usuario,
@@ -57,7 +89,20 @@ class ProductsSpider(scrapy.Spider):
         )
 
     def after_login(self, response):
+        if not self.apply_login(response):
+            return
 
+        yield req_timestamp(
+            self.api_base,
+            callback=self.set_xcart,
+            errback=self.on_client_error,
+        )
+
+    def apply_login(self, response) -> bool:
+        """Atualiza self.state com token/cookie do login. False se não veio token."""
+        # Num re-login o token antigo não pode mascarar uma resposta sem token.
+        self.state["access_token"] = None
+        self.state["cookie_access_token"] = None
         try:
             data = response.json()
 
@@ -102,26 +147,25 @@ class ProductsSpider(scrapy.Spider):
 
         if not (self.state["cookie_access_token"] or self.state["access_token"]):
             self.logger.error("Não consegui obter token/cookie após login.")
-            return
-
-        yield req_timestamp(
-            self.api_base,
-            callback=self.set_xcart,
-            errback=self.on_client_error,
-        )
+            return False
+        return True
 
     def set_xcart(self, response):
-        data = response.json()
-        self.state["timestamp"] = data["timestamp"]
-        self.state["x-cart"] = generate_x_cart(self.state["timestamp"])
+        self.apply_timestamp(response)
         yield req_clientIds(
             self.api_base,
             self.state,
             1,
             callback=self.find_valid_clientId,
             errback=self.on_client_error,
+            page_size=self.client_page_size,
         )
 
+    def apply_timestamp(self, response) -> None:
+        data = response.json()
+        self.state["timestamp"] = data["timestamp"]
+        self.state["x-cart"] = generate_x_cart(self.state["timestamp"])
+
     def find_valid_clientId(self, response, page):
         try:
             data = response.json()
@@ -136,18 +180,8 @@ class ProductsSpider(scrapy.Spider):
         found_active = False
         for item in lista:
             if item["situacao"] != "INATIVO":
-                page = 1
                 found_active = True
-
-                yield req_products(
-                    self.api_base,
-                    self.state,
-                    page,
-                    item,
-                    self.sale_type,
-                    callback=self.parse_products,
-                    errback=self.on_client_error,
-                )
+                yield from self._start_products(item)
                 break
 
         if not found_active:
@@ -158,15 +192,17 @@ class ProductsSpider(scrapy.Spider):
                 next_page,
                 callback=self.find_valid_clientId,
                 errback=self.on_client_error,
+                page_size=self.client_page_size,
             )
 
     def on_login_error(self, failure):
         self.logger.error(f"Erro no login: {failure!r}")
 
     def on_client_error(self, failure):
+        self.crawler.stats.inc_value("servimed/request_errors")
         req = failure.request
-        page = req.meta.get("page")
-        clientID = req.meta.get("clientID")
+        page = req.cb_kwargs.get("page")
+        clientID = req.cb_kwargs.get("clientID")
 
         if failure.check(TimeoutError, TCPTimedOutError):
             self.logger.warning("Timeout na página %s — pulando para a próxima.", page)
@@ -180,35 +216,156 @@ class ProductsSpider(scrapy.Spider):
         else:
             self.logger.warning("Falha na página %s: %r — pulando.", page, failure)
 
-        if page is not None and clientID:
-            yield self._req_products(page + 1, clientID)
+        item = req.cb_kwargs.get("item")
+        if page is None or not clientID or not item:
+            return
+
+        page_size = req.meta.get("page_size") or self.page_size
+        offset = (page - 1) * page_size + req.meta.get("page_skip", 0)
+        if self._shrink_page_size(offset, "falha na página"):
+            yield self._products_request(item, offset)
+            return
+        yield from self._skip_page(item, page, page_size)
+
+    def _skip_page(self, item: dict, page: int, page_size: int):
+        """Pula a página que falhou (já no page size mínimo), até page_max_skips seguidas."""
+        self.page_errors += 1
+        if self.page_errors > self.page_max_skips:
+            self.logger.error(
+                "%d páginas seguidas falharam — encerrando a paginação.",
+                self.page_errors,
+            )
+            return
+        yield self._products_request(item, (page - 1) * page_size + page_size)
 
     def parse_products(self, response, page, clientID, item):
-        products = response.json().get("lista", [])
+        self.crawler.stats.inc_value("servimed/pages")
+        page_size = response.meta.get("page_size") or self.page_size
+        # Página re-baseada (ver fit_page_size): os primeiros `skip` já foram coletados.
+        skip = response.meta.get("page_skip", 0)
+        offset = (page - 1) * page_size + skip
+        try:
+            products = response.json().get("lista", [])
+        except ValueError:
+            self.logger.warning("Resposta truncada na página %s.", page)
+            if self._shrink_page_size(offset, "resposta truncada"):
+                yield self._products_request(item, offset)
+                return
+            # Já no mínimo: a página se perde, então o crawl não pode contar como completo.
+            self.crawler.stats.inc_value("servimed/request_errors")
+            yield from self._skip_page(item, page, page_size)
+            return
+        products = products[skip:]
         if not products:
+            self.logger.info(
+                "Página %s vazia (page size %s) — fim do catálogo.", page, page_size
+            )
             return
-        page = page + 1
 
+        if offset == 0 and not self.page_size_confirmed:
+            self.page_size_confirmed = True
+            if self.page_size_min <= len(products) < page_size:
+                # Pode ser limite da API ou catálogo pequeno: só cacheia se a
+                # página seguinte vier cheia.
+                self.logger.info(
+                    "API devolveu %d de %d registros na 1ª página; usando page size %d.",
+                    len(products),
+                    page_size,
+                    len(products),
+                )
+                page_size = len(products)
+                self.page_size = page_size
+                self.page_size_cap_pending = True
+            elif len(products) == page_size:
+                self.page_size_cache.set(self.usuario, page_size)
+        elif offset > 0 and self.page_size_cap_pending:
+            self.page_size_cap_pending = False
+            self.page_size_cache.set(self.usuario, self.page_size)
+
+        self.page_errors = 0
         for product in products:
-            raw_gtin = re.sub(r"\D", "", str(product.get("codigoBarras", "")).strip())
-            if not raw_gtin:
-                continue
-
-            gtin_min8 = raw_gtin.zfill(8)
-
-            yield {
-                "gtin": gtin_min8,
-                "codigo": str(product.get("codigoExterno", "")),
-                "descricao": str(product.get("descricao", "")),
-                "preco_fabrica": float(product.get("valorBase", 0) or 0),
-                "estoque": int(product.get("quantidadeEstoque", 0) or 0),
-            }
-            yield req_products(
-                self.api_base,
-                self.state,
-                page,
-                item,
-                self.sale_type,
-                callback=self.parse_products,
-                errback=self.on_client_error,
-            )
+            out = self._product_item(product)
+            if out is not None:
+                yield out
+
+        next_offset = (page - 1) * page_size + page_size
+        latency = response.meta.get("download_latency") or 0.0
+        if latency > self.page_slow_secs:
+            self._shrink_page_size(next_offset, f"página lenta ({latency:.1f}s)")
+        yield self._products_request(item, next_offset)
+
+    @staticmethod
+    def _product_item(product: dict):
+        raw_gtin = re.sub(r"\D", "", str(product.get("codigoBarras", "")).strip())
+        if not raw_gtin:
+            return None
+
+        gtin_min8 = raw_gtin.zfill(8)
+
+        return {
+            "gtin": gtin_min8,
+            "codigo": str(product.get("codigoExterno", "")),
+            "descricao": str(product.get("descricao", "")),
+            "preco_fabrica": float(product.get("valorBase", 0) or 0),
+            "estoque": int(product.get("quantidadeEstoque", 0) or 0),
+        }
+
+    def _start_products(self, item: dict):
+        yield self._products_request(item, 0)
+
+    def _setup_page_size(self):
+        self.page_size_min = max(1, self.settings.getint("SERVIMED_PAGE_SIZE_MIN", 20))
+        self.page_slow_secs = self.settings.getfloat("SERVIMED_PAGE_SLOW_SECS", 15.0)
+        self.client_page_size = self.settings.getint("SERVIMED_CLIENT_PAGE_SIZE", 20)
+        self.page_max_skips = self.settings.getint("SERVIMED_PAGE_MAX_SKIPS", 3)
+        self.page_errors = 0
+        self.page_size_cache = PageSizeCache(
+            self.settings.get("SERVIMED_PAGE_SIZE_CACHE")
+        )
+        cached = self.page_size_cache.get(self.usuario)
+        self.page_size = cached or self.settings.getint("SERVIMED_PAGE_SIZE", 200)
+        self.page_size = max(self.page_size, self.page_size_min)
+        self.logger.info(
+            "Page size inicial: %d (%s)",
+            self.page_size,
+            "cache" if cached else "sondagem",
+        )
+
+    def _shrink_page_size(self, offset: int, reason: str) -> bool:
+        """Reduz o page size pela metade (alinhado ao offset). False se já está no mínimo."""
+        if self.page_size <= self.page_size_min:
+            return False
+        target = max(self.page_size // 2, self.page_size_min)
+        new_size = fit_page_size(target, offset, self.page_size_min)
+        self.logger.warning(
+            "%s — page size %d -> %d.", reason.capitalize(), self.page_size, new_size
+        )
+        self.page_size = new_size
+        self.page_size_cache.set(self.usuario, new_size)
+        self.crawler.stats.inc_value("page_size/backoff")
+        return True
+
+    def _products_request(self, item: dict, offset: int):
+        page_size = fit_page_size(self.page_size, offset, self.page_size_min)
+        page = offset // page_size + 1
+        request = req_products(
+            self.api_base,
+            self.state,
+            page,
+            item,
+            self.sale_type,
+            callback=self.parse_products,
+            errback=self.on_client_error,
+            page_size=page_size,
+        )
+        skip = offset - (page - 1) * page_size
+        if skip:
+            request.meta["page_skip"] = skip
+            self.crawler.stats.inc_value("page_size/rebase")
+        return request
+
+    def closed(self, reason):
+        cache = getattr(self, "page_size_cache", None)
+        if cache is not None:
+            self.crawler.stats.set_value("page_size/final", self.page_size)
+            cache.save()
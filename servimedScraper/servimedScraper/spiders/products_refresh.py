@@ -0,0 +1,111 @@
+import re
+
+from servimedScraper.spiders.products import ProductsSpider
+from servimedScraper.utils.requests import req_products
+
+
+def normalize_gtin(value) -> str:
+    digits = re.sub(r"\D", "", str(value or "").strip())
+    return digits.zfill(8) if digits else ""
+
+
+def load_gtins(path: str) -> list[str]:
+    """Um GTIN por linha (vírgulas também separam); linhas com # são ignoradas."""
+    gtins: list[str] = []
+    with open(path, encoding="utf-8") as fh:
+        for line in fh:
+            line = line.split("#", 1)[0]
+            gtins.extend(g for g in (normalize_gtin(t) for t in line.split(",")) if g)
+    return list(dict.fromkeys(gtins))
+
+
+class ProductsRefreshSpider(ProductsSpider):
+    """Atualiza preço e estoque só dos GTINs pedidos, sem paginar o catálogo.
+
+    Depois do login e do clientId, dispara uma consulta com ``filtro`` por
+    lote de GTINs (SERVIMED_REFRESH_BATCH por consulta, unidos por
+    SERVIMED_REFRESH_SEPARATOR — 1 por consulta se a API não aceitar vários),
+    todas em paralelo. A busca é textual, então só saem os itens cujo GTIN foi
+    pedido.
+    """
+
+    name = "products_refresh"
+
+    def __init__(self, usuario: str, senha: str, sale_type: int, gtins, *args, **kwargs):
+        super().__init__(usuario, senha, sale_type, *args, **kwargs)
+        self.gtins = list(dict.fromkeys(g for g in map(normalize_gtin, gtins) if g))
+        self.wanted = set(self.gtins)
+        self.found: set[str] = set()
+
+    async def start(self):
+        if not self.gtins:
+            self.logger.error("Nenhum GTIN para atualizar.")
+            return
+        self.logger.info("Refresh parcial de %d GTINs.", len(self.gtins))
+        async for request in super().start():
+            yield request
+
+    def _start_products(self, item: dict):
+        batch = max(1, self.settings.getint("SERVIMED_REFRESH_BATCH", 1))
+        sep = self.settings.get("SERVIMED_REFRESH_SEPARATOR", " ")
+        for i in range(0, len(self.gtins), batch):
+            filtro = sep.join(self.gtins[i : i + batch])
+            yield self._filter_request(item, filtro, 1)
+
+    def _filter_request(self, item: dict, filtro: str, page: int):
+        request = req_products(
+            self.api_base,
+            self.state,
+            page,
+            item,
+            self.sale_type,
+            callback=self.parse_filtered,
+            errback=self.on_filter_error,
+            page_size=self.settings.getint("SERVIMED_REFRESH_PAGE_SIZE", 20),
+            filtro=filtro,
+        )
+        request.cb_kwargs["filtro"] = filtro
+        self.crawler.stats.inc_value("refresh/queries")
+        return request
+
+    def parse_filtered(self, response, page, clientID, item, filtro):
+        try:
+            products = response.json().get("lista", [])
+        except ValueError:
+            self.logger.warning("Resposta inválida para o filtro %r.", filtro)
+            self.crawler.stats.inc_value("refresh/errors")
+            return
+        for product in products:
+            out = self._product_item(product)
+            if out is None or out["gtin"] not in self.wanted or out["gtin"] in self.found:
+                continue
+            self.found.add(out["gtin"])
+            yield out
+
+        page_size = response.meta.get("page_size") or len(products)
+        max_pages = self.settings.getint("SERVIMED_REFRESH_MAX_PAGES", 3)
+        pending = any(g not in self.found for g in self._filter_gtins(filtro))
+        if pending and len(products) >= page_size and page < max_pages:
+            yield self._filter_request(item, filtro, page + 1)
+
+    def _filter_gtins(self, filtro: str):
+        sep = self.settings.get("SERVIMED_REFRESH_SEPARATOR", " ")
+        return [normalize_gtin(t) for t in filtro.split(sep) if t.strip()]
+
+    def on_filter_error(self, failure):
+        self.crawler.stats.inc_value("refresh/errors")
+        self.logger.warning(
+            "Falha no filtro %r: %r", failure.request.cb_kwargs.get("filtro"), failure
+        )
+
+    def closed(self, reason):
+        missing = len(self.wanted - self.found)
+        stats = self.crawler.stats
+        stats.set_value("refresh/requested", len(self.wanted))
+        stats.set_value("refresh/found", len(self.found))
+        stats.set_value("refresh/missing", missing)
+        if missing:
+            self.logger.warning(
+                "Refresh: %d de %d GTINs não encontrados.", missing, len(self.wanted)
+            )
+        super().closed(reason)
@@ -0,0 +1,116 @@
+import json
+
+from servimedScraper.spiders.products import ProductsSpider
+from servimedScraper.utils.page_size import PageSizeCache
+
+SESSION_KEY = "__session__"
+SHARD_KEY = "__shard__"
+
+
+class ProductsSessionSpider(ProductsSpider):
+    """Faz login, resolve o clientId e sonda o page size na 1ª página.
+
+    Em vez de paginar, emite um único registro ``{"__session__": {...}}`` com o
+    estado da sessão; o coordenador do crawl distribuído repassa esse estado
+    para os workers de cada faixa de páginas.
+    """
+
+    name = "products_session"
+
+    def parse_products(self, response, page, clientID, item):
+        # Reaproveita a adoção do page size do spider base; os itens da 1ª
+        # página são descartados (o shard 0 busca de novo).
+        for _ in super().parse_products(response, page, clientID, item):
+            pass
+        try:
+            empty = not response.json().get("lista")
+        except ValueError:
+            empty = False
+        yield {
+            SESSION_KEY: {
+                "usuario": self.usuario,
+                "sale_type": self.sale_type,
+                "api_base": self.api_base,
+                "state": self.state,
+                "item": item,
+                "page_size": self.page_size,
+                "terminal_page": 1 if empty else None,
+            }
+        }
+
+
+class ProductsShardSpider(ProductsSpider):
+    """Busca só as páginas [first_page, last_page] de uma sessão já autenticada.
+
+    Não faz login: o estado (tokens, x-cart, clientId e page size) vem do
+    coordenador. Se encontrar a página vazia que encerra o catálogo, emite
+    ``{"__shard__": {"terminal_page": N}}`` com N na numeração da sessão.
+    """
+
+    name = "products_shard"
+
+    def __init__(self, shard: dict, *args, **kwargs):
+        session = shard["session"]
+        super().__init__(session["usuario"], "", session["sale_type"], *args, **kwargs)
+        self.session = session
+        self.api_base = session.get("api_base") or self.api_base
+        self.state.update(session["state"])
+        self.session_page_size = int(session["page_size"])
+        self.first_page = int(shard["first_page"])
+        self.last_page = int(shard["last_page"])
+        self.offset_start = (self.first_page - 1) * self.session_page_size
+        self.offset_end = self.last_page * self.session_page_size
+
+    async def start(self):
+        self._setup_page_size()
+        self.logger.info(
+            "Shard: páginas %d-%d (page size %d).",
+            self.first_page,
+            self.last_page,
+            self.session_page_size,
+        )
+        yield self._products_request(self.session["item"], self.offset_start)
+
+    def _setup_page_size(self):
+        super()._setup_page_size()
+        # O tamanho é fixado pela sessão; o shard nunca grava o cache.
+        self.page_size_cache = PageSizeCache(None)
+        self.page_size = self.session_page_size
+        self.page_size_confirmed = True
+
+    def _products_request(self, item: dict, offset: int):
+        if offset >= self.offset_end:
+            return None
+        return super()._products_request(item, offset)
+
+    def parse_products(self, response, page, clientID, item):
+        for out in super().parse_products(response, page, clientID, item):
+            if out is not None:
+                yield out
+        skip = response.meta.get("page_skip", 0)
+        try:
+            empty = len(response.json().get("lista") or []) <= skip
+        except ValueError:
+            return
+        if empty:
+            page_size = response.meta.get("page_size") or self.page_size
+            offset = (page - 1) * page_size + skip
+            yield {SHARD_KEY: {"terminal_page": offset // self.session_page_size + 1}}
+
+    def on_client_error(self, failure):
+        for out in super().on_client_error(failure):
+            if out is not None:
+                yield out
+
+    def closed(self, reason):
+        self.crawler.stats.set_value("shard/pages", f"{self.first_page}-{self.last_page}")
+        super().closed(reason)
+
+
+def load_shard(path: str) -> dict:
+    with open(path, encoding="utf-8") as fh:
+        shard = json.load(fh)
+    if not isinstance(shard, dict) or "session" not in shard:
+        raise ValueError(f"arquivo de shard inválido: {path}")
+    return shard
+
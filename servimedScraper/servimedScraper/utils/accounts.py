@@ -0,0 +1,132 @@
+"""Crawl de várias contas num único processo (``run_spider.py --accounts``)."""
+
+import json
+import logging
+import sys
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+
+
+@dataclass
+class Account:
+    usuario: str
+    senha: str
+    sale_type: int
+    # Nome no resumo, no arquivo ({conta}) e no campo "conta" dos itens: o
+    # usuário, com "-tipo<N>" quando a mesma conta roda nos dois tipos de venda.
+    label: str = ""
+
+
+def load_accounts(path: str, default_sale_type: int) -> list[Account]:
+    """JSONL com ``usuario``, ``senha`` e opcionalmente ``sale_type`` (ou ``tipo de venda``).
+
+    Linhas repetidas para o mesmo (usuário, tipo de venda) são ignoradas.
+    """
+    accounts: list[Account] = []
+    seen: set[tuple[str, int]] = set()
+    with open(path, encoding="utf-8") as fh:
+        for n, line in enumerate(fh, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                rec = json.loads(line)
+                usuario, senha = str(rec["usuario"]).strip(), str(rec["senha"])
+            except (ValueError, KeyError, TypeError) as e:
+                raise ValueError(f"{path}:{n}: conta inválida ({e})") from e
+            sale_type = rec.get("sale_type", rec.get("tipo de venda", default_sale_type))
+            try:
+                sale_type = int(sale_type)
+            except (TypeError, ValueError) as e:
+                raise ValueError(f"{path}:{n}: tipo de venda inválido ({e})") from e
+            key = (usuario.lower(), sale_type)
+            if key in seen:
+                continue
+            seen.add(key)
+            accounts.append(Account(usuario, senha, sale_type))
+    tipos = Counter(acc.usuario.lower() for acc in accounts)
+    for acc in accounts:
+        multi = tipos[acc.usuario.lower()] > 1
+        acc.label = f"{acc.usuario}-tipo{acc.sale_type}" if multi else acc.usuario
+    return accounts
+
+
+def account_output(template: str, usuario: str) -> Path:
+    safe = "".join(c if c.isalnum() or c in "._-@" else "_" for c in usuario)
+    return Path(template.format(conta=safe)).expanduser().resolve()
+
+
+class AccountExporter:
+    """Itens de uma conta: num arquivo próprio, ou num arquivo/stream
+    compartilhado com o campo ``conta`` em cada item."""
+
+    def __init__(self, exporter, fh, tag: str | None = None, owns_file: bool = True):
+        self.exporter = exporter
+        self.fh = fh
+        self.tag = tag
+        self.owns_file = owns_file
+        self.flush = fh is getattr(sys.stdout, "buffer", None)
+
+    def on_item(self, item, response, spider) -> None:
+        item = dict(item)
+        if self.tag is not None:
+            item["conta"] = self.tag
+        self.exporter.export_item(item)
+        if self.flush:
+            self.fh.flush()
+
+    def close(self) -> None:
+        if self.owns_file:
+            self.exporter.finish_exporting()
+            self.fh.close()
+
+
+class SpiderErrorCounter(logging.Handler):
+    """Conta em ``servimed/errors`` os ERRORs logados pelo próprio spider.
+
+    ``log_count/ERROR`` vem do handler do Scrapy no logger raiz e soma os logs de
+    todos os crawls do processo; aqui só entram registros com ``record.spider``
+    igual a este spider (``spider.logger`` e middlewares que logam por ele).
+    """
+
+    def __init__(self, spider):
+        super().__init__(logging.ERROR)
+        self.spider = spider
+        self.logger = logging.getLogger(spider.name)
+        self.logger.addHandler(self)
+
+    def emit(self, record) -> None:
+        if getattr(record, "spider", None) is self.spider:
+            self.spider.crawler.stats.inc_value("servimed/errors")
+
+    def detach(self, spider=None) -> None:
+        self.logger.removeHandler(self)
+
+
+def summary_row(usuario: str, stats: dict) -> dict:
+    elapsed = stats.get("elapsed_time_seconds")
+    if elapsed is None and stats.get("start_time") and stats.get("finish_time"):
+        elapsed = (stats["finish_time"] - stats["start_time"]).total_seconds()
+    return {
+        "conta": usuario,
+        "segundos": round(elapsed or 0.0, 1),
+        "paginas": stats.get("servimed/pages", 0),
+        "itens": stats.get("item_scraped_count", 0),
+        "erros": stats.get("servimed/request_errors", 0) + stats.get("servimed/errors", 0),
+        "motivo": stats.get("finish_reason", "?"),
+    }
+
+
+def print_summary(rows: list[dict], out=sys.stderr) -> None:
+    width = max([len(r["conta"]) for r in rows] + [5])
+    print(
+        f"\n{'conta':<{width}}  {'tempo':>8}  {'páginas':>7}  {'itens':>7}  {'erros':>5}  motivo",
+        file=out,
+    )
+    for r in rows:
+        print(
+            f"{r['conta']:<{width}}  {r['segundos']:>7.1f}s  {r['paginas']:>7}  "
+            f"{r['itens']:>7}  {r['erros']:>5}  {r['motivo']}",
+            file=out,
+        )
@@ -0,0 +1,102 @@
+import base64
+import gzip
+import hashlib
+import json
+import logging
+from collections import defaultdict, deque
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+def request_key(method: str, url: str, body: bytes | None) -> str:
+    """Chave estável de uma requisição: método + URL + corpo (sem headers de auth)."""
+    h = hashlib.sha1()
+    h.update(method.upper().encode("ascii"))
+    h.update(b" ")
+    h.update(url.encode("utf-8"))
+    h.update(b"\n")
+    h.update(body or b"")
+    return h.hexdigest()
+
+
+class CassetteWriter:
+    """Grava pares request/response em JSONL comprimido com gzip (um registro por linha)."""
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path).expanduser()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._fh = gzip.open(self.path, "wt", encoding="utf-8", compresslevel=6)
+        self.count = 0
+
+    def write(
+        self,
+        key: str,
+        *,
+        method: str,
+        url: str,
+        status: int,
+        headers: dict[str, list[str]],
+        body: bytes,
+        elapsed: float,
+    ) -> None:
+        record = {
+            "key": key,
+            "method": method,
+            "url": url,
+            "status": status,
+            "headers": headers,
+            "body": base64.b64encode(body).decode("ascii"),
+            "elapsed": round(elapsed, 4),
+        }
+        self._fh.write(json.dumps(record, separators=(",", ":")))
+        self._fh.write("\n")
+        self.count += 1
+
+    def close(self) -> None:
+        if not self._fh.closed:
+            self._fh.close()
+            logger.info("Cassete gravado: %s (%d respostas)", self.path, self.count)
+
+
+class Cassette:
+    """Cassete carregado em memória, indexado pela chave da requisição.
+
+    Requisições repetidas com a mesma chave recebem as respostas na ordem de gravação;
+    quando acabam, a última resposta é reutilizada.
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path).expanduser()
+        self._index: dict[str, deque[dict]] = defaultdict(deque)
+        self._last: dict[str, dict] = {}
+        with gzip.open(self.path, "rt", encoding="utf-8") as fh:
+            for line in fh:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                self._index[record["key"]].append(record)
+        logger.info("Cassete carregado: %s (%d chaves)", self.path, len(self._index))
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._index or key in self._last
+
+    def pop(self, key: str) -> dict | None:
+        queue = self._index.get(key)
+        if queue:
+            record = queue.popleft()
+            self._last[key] = record
+            return record
+        return self._last.get(key)
+
+    def records(self):
+        """Itera todos os registros na ordem de gravação por chave."""
+        for queue in self._index.values():
+            yield from queue
+
+    @staticmethod
+    def body_of(record: dict) -> bytes:
+        return base64.b64decode(record["body"])
@@ -0,0 +1,49 @@
+from collections import deque
+from urllib.parse import urlparse
+
+
+def endpoint_key(url: str) -> str:
+    parts = urlparse(url)
+    return f"{parts.hostname or ''}{parts.path}"
+
+
+class LatencyTracker:
+    """Latências recentes por endpoint (janela deslizante das últimas `window`)."""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.window = max(1, window)
+        self.min_samples = max(1, min_samples)
+        self._samples: dict[str, deque] = {}
+
+    def observe(self, key: str, secs: float) -> None:
+        samples = self._samples.get(key)
+        if samples is None:
+            samples = self._samples[key] = deque(maxlen=self.window)
+        samples.append(secs)
+
+    def percentile(self, key: str, q: float) -> float | None:
+        """Percentil q (0-100) das latências do endpoint; None até ter min_samples."""
+        samples = self._samples.get(key)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        idx = min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered))) - 1))
+        return ordered[idx]
+
+
+class HedgeBudget:
+    """Limita as duplicatas a `ratio` das requisições elegíveis (p.ex. 0.05 = 5%)."""
+
+    def __init__(self, ratio: float):
+        self.ratio = max(0.0, ratio)
+        self.requests = 0
+        self.hedges = 0
+
+    def count_request(self) -> None:
+        self.requests += 1
+
+    def take(self) -> bool:
+        if self.hedges + 1 > self.ratio * self.requests:
+            return False
+        self.hedges += 1
+        return True
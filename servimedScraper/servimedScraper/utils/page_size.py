@@ -0,0 +1,70 @@
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+def account_key(usuario: str) -> str:
+    """Identificador da conta no cache (hash do usuário, para não gravar o e-mail em disco)."""
+    return hashlib.sha1(usuario.strip().lower().encode("utf-8")).hexdigest()[:16]
+
+
+def fit_page_size(target: int, offset: int, minimum: int = 1) -> int:
+    """Maior tamanho em [minimum, target] que divide offset, para não desalinhar a paginação.
+
+    Sem divisor no intervalo devolve ``target``: quem chama pede a página desse
+    tamanho que contém o offset e descarta o começo já coletado (``page_skip``),
+    em vez de cair para páginas minúsculas (offset 194 e alvo 48 dariam 2).
+    """
+    target = max(1, int(target))
+    minimum = max(1, min(int(minimum), target))
+    if offset <= 0:
+        return target
+    for size in range(target, minimum - 1, -1):
+        if offset % size == 0:
+            return size
+    return target
+
+
+class PageSizeCache:
+    """Cache em JSON do page size aceito pela API para cada conta."""
+
+    def __init__(self, path: str | Path | None):
+        self.path = Path(path).expanduser() if path else None
+        self._data: dict[str, int] = self._read()
+        self._dirty: set[str] = set()
+
+    def _read(self) -> dict[str, int]:
+        if not (self.path and self.path.exists()):
+            return {}
+        try:
+            return {k: int(v) for k, v in json.loads(self.path.read_text()).items()}
+        except (OSError, ValueError, TypeError) as e:
+            logger.warning("Cache de page size ilegível (%s): %s", self.path, e)
+            return {}
+
+    def get(self, usuario: str) -> int | None:
+        return self._data.get(account_key(usuario))
+
+    def set(self, usuario: str, size: int) -> None:
+        key = account_key(usuario)
+        self._data[key] = int(size)
+        self._dirty.add(key)
+
+    def save(self) -> None:
+        if not self.path or not self._dirty:
+            return
+        # Relê o arquivo e grava só as contas alteradas aqui: vários spiders
+        # (--accounts) dividem o mesmo cache no mesmo processo.
+        data = self._read()
+        data.update({k: self._data[k] for k in self._dirty})
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(f"{self.path.suffix}.{os.getpid()}.{id(self)}.tmp")
+            tmp.write_text(json.dumps(data, sort_keys=True))
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.warning("Não consegui salvar o cache de page size: %s", e)
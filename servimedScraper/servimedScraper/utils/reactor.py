@@ -0,0 +1,30 @@
+"""Escolha do reactor do Twisted e do event loop do asyncio."""
+
+import importlib.util
+import logging
+
+logger = logging.getLogger(__name__)
+
+ASYNCIO_REACTOR = "twisted.internet.asyncioreactor.AsyncioSelectorReactor"
+REACTORS = ("asyncio", "default")
+
+
+def reactor_settings(reactor: str = "asyncio", uvloop: bool = False) -> dict:
+    """TWISTED_REACTOR / ASYNCIO_EVENT_LOOP para o modo pedido.
+
+    "asyncio" roda o Twisted sobre o loop do asyncio (callbacks ``async def``
+    podem dar await direto em corrotinas), com uvloop se pedido e instalado;
+    "default" deixa o reactor nativo do Twisted (epoll/kqueue/select).
+    """
+    reactor = (reactor or "asyncio").strip().lower()
+    if reactor == "default":
+        return {"TWISTED_REACTOR": None, "ASYNCIO_EVENT_LOOP": None}
+    if reactor != "asyncio":
+        logger.warning("Reactor %r desconhecido; usando asyncio.", reactor)
+    loop = None
+    if uvloop:
+        if importlib.util.find_spec("uvloop") is not None:
+            loop = "uvloop.Loop"
+        else:
+            logger.warning("uvloop não instalado; usando o event loop padrão do asyncio.")
+    return {"TWISTED_REACTOR": ASYNCIO_REACTOR, "ASYNCIO_EVENT_LOOP": loop}
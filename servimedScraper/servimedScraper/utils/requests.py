@@ -1,6 +1,14 @@
+import hashlib
+import json
+from functools import lru_cache
+
 from scrapy.http import JsonRequest
+from scrapy.utils.request import RequestFingerprinter
 import scrapy
 
+DEFAULT_PAGE_SIZE = 20
+PRODUCTS_PATH = "/api/carrinho/oculto"
+
 
 def req_login(api_base: str, usuario: str, senha: str, *, callback, errback):
     return JsonRequest(
@@ -13,13 +21,21 @@ def req_login(api_base: str, usuario: str, senha: str, *, callback, errback):
     )
 
 
-def req_clientIds(api_base: str, state: dict, page: int, *, callback, errback):
+def req_clientIds(
+    api_base: str,
+    state: dict,
+    page: int,
+    *,
+    callback,
+    errback,
+    page_size: int = DEFAULT_PAGE_SIZE,
+):
     return JsonRequest(
         url=f"{api_base}/api/cliente/findByFilter",
         data={
             "filtro": "",
             "pagina": page,
-            "registrosPorPagina": 20,
+            "registrosPorPagina": page_size,
             "codigoExterno": state["external_code"],
             "codigoUsuario": state["user_code"],
             "users": state["users"],
@@ -42,6 +58,47 @@ def req_timestamp(api_base: str, *, callback, errback):
     )
 
 
+@lru_cache(maxsize=512)
+def products_template(
+    api_base: str,
+    client_id,
+    sale_type: int,
+    page_size: int,
+    user_code,
+    filtro: str = "",
+) -> tuple[str, bytes, bytes]:
+    """URL e corpo de req_products já serializados, partidos no número da página.
+
+    O corpo sai byte a byte igual ao do JsonRequest (sort_keys), então cassetes
+    gravados antes continuam casando.
+    """
+    data = {
+        "filtro": filtro,
+        "pagina": 0,
+        "registrosPorPagina": page_size,
+        "ordenarDecrescente": False,
+        "colunaOrdenacao": "nenhuma",
+        "clienteId": client_id,
+        "tipoVendaId": sale_type,
+        "pIIdFiltro": 0,
+        "cestaPPFiltro": False,
+        "codigoExterno": 0,
+        "codigoUsuario": user_code,
+        "promocaoSelecionada": "",
+        "indicadorTipoUsuario": "CLI",
+        "kindUser": 0,
+        "xlsx": [],
+        "principioAtivo": "",
+        "master": False,
+        "kindSeller": 0,
+        "grupoEconomico": "",
+        "list": True,
+    }
+    body = json.dumps(data, sort_keys=True).encode("utf-8")
+    head, _, tail = body.partition(b'"pagina": 0')
+    return f"{api_base}{PRODUCTS_PATH}?siteVersion=4.0.27", head + b'"pagina": ', tail
+
+
 def req_products(
     api_base: str,
     state: dict,
@@ -51,37 +108,48 @@ def req_products(
     *,
     callback,
     errback,
+    page_size: int = DEFAULT_PAGE_SIZE,
+    filtro: str = "",
 ):
+    client_id = item["codigo"]
+    url, head, tail = products_template(
+        api_base, client_id, saleType, page_size, state["user_code"], filtro
+    )
     return JsonRequest(
-        url=f"{api_base}/api/carrinho/oculto?siteVersion=4.0.27",
-        data={
-            "filtro": "",
-            "pagina": page,
-            "registrosPorPagina": 20,
-            "ordenarDecrescente": False,
-            "colunaOrdenacao": "nenhuma",
-            "clienteId": item["codigo"],
-            "tipoVendaId": saleType,
-            "pIIdFiltro": 0,
-            "cestaPPFiltro": False,
-            "codigoExterno": 0,
-            "codigoUsuario": state["user_code"],
-            "promocaoSelecionada": "",
-            "indicadorTipoUsuario": "CLI",
-            "kindUser": 0,
-            "xlsx": [],
-            "principioAtivo": "",
-            "master": False,
-            "kindSeller": 0,
-            "grupoEconomico": "",
-            "list": True,
-        },
+        url=url,
+        body=head + str(page).encode() + tail,
         headers={
             "x-peperone": str(state["timestamp"]),
             "x-cart": str(state["x-cart"]),
         },
-        meta={"needs_auth": True},
-        cb_kwargs={"page": page, "clientID": item["codigo"], "item": item},
+        meta={
+            "needs_auth": True,
+            "page_size": page_size,
+            "fingerprint": (PRODUCTS_PATH, client_id, saleType, page, page_size, filtro),
+        },
+        cb_kwargs={"page": page, "clientID": client_id, "item": item},
         callback=callback,
         errback=errback,
     )
+
+
+class ServimedRequestFingerprinter:
+    """Fingerprint das páginas de produtos pela chave em ``meta["fingerprint"]``.
+
+    (endpoint, clientId, tipo de venda, página, page size, filtro) identifica a
+    página sem hashear o corpo inteiro; as demais requisições usam o
+    fingerprinter padrão do Scrapy.
+    """
+
+    def __init__(self, crawler=None):
+        self._default = RequestFingerprinter(crawler)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def fingerprint(self, request) -> bytes:
+        key = request.meta.get("fingerprint")
+        if key is None:
+            return self._default.fingerprint(request)
+        return hashlib.sha1(repr(key).encode()).digest()
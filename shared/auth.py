@@ -6,6 +6,8 @@ from typing import Optional, Dict
 
 import requests
 
+from shared.config import env_int
+
 _LOG_LEVEL_NAME = os.getenv("LOG_LEVEL", "INFO").upper()
 _LOG_LEVEL = getattr(logging, _LOG_LEVEL_NAME, logging.INFO)
 
@@ -20,17 +22,6 @@ if not logger.handlers:
 class AuthError(Exception):
     pass
 
-
-def _env_int(name: str, default: int) -> int:
-    v = os.getenv(name)
-    if v is None:
-        return default
-    try:
-        return int(v)
-    except (TypeError, ValueError):
-        return default
-
-
 class AuthClient:
 
     def __init__(
@@ -64,11 +55,11 @@ class AuthClient:
         )
         self.scope = scope if scope is not None else os.getenv("API_SCOPE_COTE", "")
 
-        self.timeout = int(timeout) if timeout is not None else _env_int("TIMEOUT", 30)
+        self.timeout = int(timeout) if timeout is not None else env_int("TIMEOUT", 30)
         self.expiry_skew = (
             int(expiry_skew)
             if expiry_skew is not None
-            else _env_int("EXPIRE_TOKEN_TIME", 20)
+            else env_int("EXPIRE_TOKEN_TIME", 20)
         )
 
         self.session = session or requests.Session()
@@ -76,6 +67,7 @@ class AuthClient:
         self._access_token: Optional[str] = None
         self._exp_ts: float = 0.0
         self._lock = threading.RLock()
+        self.stats = {"token_requests": 0, "token_reuses": 0}
 
         missing = [
             k
@@ -104,8 +96,7 @@ class AuthClient:
 
         with self._lock:
             self._apply_call_overrides_unlocked(username, password)
-            if not self._is_token_valid_unlocked():
-                self._password_grant_unlocked()
+            self._ensure_token_unlocked()
             return self._access_token
 
     def auth_header(
@@ -114,10 +105,16 @@ class AuthClient:
 
         with self._lock:
             self._apply_call_overrides_unlocked(username, password)
-            if not self._is_token_valid_unlocked():
-                self._password_grant_unlocked()
+            self._ensure_token_unlocked()
             return {"Authorization": f"{self._token_type} {self._access_token}"}
 
+    def _ensure_token_unlocked(self) -> None:
+        if self._is_token_valid_unlocked():
+            self.stats["token_reuses"] += 1
+            return
+        self.stats["token_requests"] += 1
+        self._password_grant_unlocked()
+
     def _apply_call_overrides_unlocked(
         self, username: Optional[str], password: Optional[str]
     ) -> None:
@@ -186,10 +183,81 @@ class AuthClient:
         except (TypeError, ValueError):
             expires_in = 0
         if expires_in <= 0:
-            expires_in = _env_int("DEFAULT_TOKEN_TTL", 300)
+            expires_in = env_int("DEFAULT_TOKEN_TTL", 300)
 
         self._token_type = token_type or "Bearer"
         self._access_token = access
         self._exp_ts = time.time() + max(expires_in, self.expiry_skew + 1)
 
         logger.info("Token obtido (%s); expires_in=%ss", self._token_type, expires_in)
+
+
+_REGISTRY: Dict[tuple, AuthClient] = {}
+_REGISTRY_LOCK = threading.Lock()
+
+
+def get_auth_client(
+    username: Optional[str] = None,
+    password: Optional[str] = None,
+    token_url: Optional[str] = None,
+    session: Optional[requests.Session] = None,
+    **kwargs,
+) -> AuthClient:
+    """AuthClient compartilhado pelo processo, um por conjunto de credenciais.
+
+    O token fica em cache entre mensagens e as requisições de token usam a
+    `session` do primeiro chamador (pool de conexões com keep-alive).
+    """
+    key = (
+        token_url or os.getenv("API_TOKEN_URL"),
+        username if username is not None else os.getenv("API_USERNAME_COTE"),
+        password if password is not None else os.getenv("API_PASSWORD_COTE"),
+        tuple(sorted(kwargs.items())),
+    )
+    with _REGISTRY_LOCK:
+        client = _REGISTRY.get(key)
+        if client is None:
+            client = AuthClient(
+                token_url=token_url,
+                username=username,
+                password=password,
+                session=session,
+                **kwargs,
+            )
+            _REGISTRY[key] = client
+        return client
+
+
+def auth_stats() -> Dict[str, float]:
+    """Totais de tokens solicitados/reutilizados por todos os clientes do registro."""
+    with _REGISTRY_LOCK:
+        clients = list(_REGISTRY.values())
+    requested = sum(c.stats["token_requests"] for c in clients)
+    reused = sum(c.stats["token_reuses"] for c in clients)
+    total = requested + reused
+    return {
+        "clients": len(clients),
+        "token_requests": requested,
+        "token_reuses": reused,
+        "token_reuse_rate": (reused / total) if total else 0.0,
+    }
+
+
+def pool_stats(session: requests.Session) -> Dict[str, float]:
+    """Conexões abertas vs requisições feitas nos pools urllib3 da sessão."""
+    conns = reqs = 0
+    for adapter in set(session.adapters.values()):
+        pools = getattr(getattr(adapter, "poolmanager", None), "pools", None)
+        if pools is None:
+            continue
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            conns += getattr(pool, "num_connections", 0)
+            reqs += getattr(pool, "num_requests", 0)
+    return {
+        "connections": conns,
+        "requests": reqs,
+        "connection_reuse_rate": (1 - conns / reqs) if reqs else 0.0,
+    }
@@ -0,0 +1,222 @@
+"""Catálogo local por conta (SQLite) para validar pedidos sem ir à API.
+
+O worker do scraper grava o último catálogo completo de cada conta (o
+``usuario`` de login na Servimed) depois de um crawl sem erros de requisição;
+o consumer de pedidos consulta por (conta, gtin) numa tabela
+``WITHOUT ROWID`` — a chave primária é o próprio B-tree, então cada busca é
+O(log n) e lê só as páginas do índice. Em WAL, leitores não bloqueiam a
+escrita do próximo catálogo.
+"""
+
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+from shared.config import env_int
+
+log = logging.getLogger(__name__)
+
+JSONItem = Dict[str, Any]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS produtos (
+    conta      TEXT NOT NULL,
+    gtin       TEXT NOT NULL,
+    codigo     TEXT NOT NULL,
+    descricao  TEXT,
+    preco      REAL,
+    estoque    INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (conta, gtin, codigo)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS catalogos (
+    conta       TEXT PRIMARY KEY,
+    atualizado  REAL NOT NULL,
+    itens       INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+def normalize_gtin(value: Any) -> str:
+    """Mesma normalização do spider: só dígitos, com no mínimo 8 casas."""
+    digits = re.sub(r"\D", "", str(value or "").strip())
+    return digits.zfill(8) if digits else ""
+
+
+def account_key(usuario: str) -> str:
+    return (usuario or "").strip().lower()
+
+
+@dataclass(frozen=True)
+class CatalogueEntry:
+    gtin: str
+    codigo: str
+    estoque: int
+    preco: Optional[float] = None
+
+
+@dataclass(frozen=True)
+class OrderProblem:
+    """Divergência de um item do pedido. `fatal`: gtin/código que não existem
+    na conta (o pedido não tem como passar); estoque é só um retrato."""
+
+    gtin: str
+    message: str
+    fatal: bool = True
+
+    def __str__(self) -> str:
+        return self.message
+
+
+class CatalogueStore:
+    def __init__(self, path: str | Path):
+        self.path = Path(path).expanduser()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+
+    @staticmethod
+    def _rows(conta: str, items: Iterable[JSONItem]):
+        for it in items:
+            gtin = normalize_gtin(it.get("gtin"))
+            if not gtin:
+                continue
+            try:
+                estoque = int(it.get("estoque") or 0)
+            except (TypeError, ValueError):
+                estoque = 0
+            yield (
+                conta,
+                gtin,
+                str(it.get("codigo") or ""),
+                it.get("descricao"),
+                it.get("preco_fabrica"),
+                estoque,
+            )
+
+    def _write(self, usuario: str, items: Iterable[JSONItem], replace: bool) -> int:
+        conta = account_key(usuario)
+        with self._lock, self._db:
+            if replace:
+                self._db.execute("DELETE FROM produtos WHERE conta = ?", (conta,))
+            cur = self._db.executemany(
+                "INSERT OR REPLACE INTO produtos"
+                " (conta, gtin, codigo, descricao, preco, estoque)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                self._rows(conta, items),
+            )
+            written = cur.rowcount
+            total = self._db.execute(
+                "SELECT COUNT(*) FROM produtos WHERE conta = ?", (conta,)
+            ).fetchone()[0]
+            if replace:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO catalogos (conta, atualizado, itens)"
+                    " VALUES (?, ?, ?)",
+                    (conta, time.time(), total),
+                )
+            else:
+                # Refresh parcial não renova a idade do catálogo nem cria um
+                # catálogo para a conta: o resto dos itens continua tão velho quanto era.
+                self._db.execute(
+                    "UPDATE catalogos SET itens = ? WHERE conta = ?", (total, conta)
+                )
+        return written
+
+    def replace_catalogue(self, usuario: str, items: Iterable[JSONItem]) -> int:
+        """Troca atomicamente o catálogo inteiro da conta. Retorna o nº de linhas gravadas."""
+        return self._write(usuario, items, replace=True)
+
+    def upsert_items(self, usuario: str, items: Iterable[JSONItem]) -> int:
+        """Atualiza só os itens informados (refresh parcial)."""
+        return self._write(usuario, items, replace=False)
+
+    def updated_at(self, usuario: str) -> Optional[float]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT atualizado FROM catalogos WHERE conta = ?",
+                (account_key(usuario),),
+            ).fetchone()
+        return row[0] if row else None
+
+    def lookup(self, usuario: str, gtin: Any) -> List[CatalogueEntry]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT gtin, codigo, estoque, preco FROM produtos"
+                " WHERE conta = ? AND gtin = ?",
+                (account_key(usuario), normalize_gtin(gtin)),
+            ).fetchall()
+        return [CatalogueEntry(*r) for r in rows]
+
+    def check_order(
+        self,
+        usuario: str,
+        produtos: List[JSONItem],
+        max_age: float = 0,
+        check_stock: bool = True,
+    ) -> Optional[List[OrderProblem]]:
+        """Problemas do pedido contra o catálogo local.
+
+        Retorna None se não há catálogo utilizável para a conta (ausente ou
+        mais velho que `max_age` segundos) — nesse caso não dá para julgar.
+        """
+        updated = self.updated_at(usuario)
+        if updated is None or (max_age and time.time() - updated > max_age):
+            return None
+        problems: List[OrderProblem] = []
+        for it in produtos:
+            gtin, codigo = it.get("gtin"), str(it.get("codigo") or "")
+            entries = self.lookup(usuario, gtin)
+            match = next((e for e in entries if e.codigo == codigo), None)
+            if not entries:
+                problems.append(OrderProblem(gtin, f"gtin {gtin} fora do catálogo"))
+            elif match is None:
+                problems.append(
+                    OrderProblem(gtin, f"gtin {gtin} não corresponde ao código {codigo}")
+                )
+            elif check_stock and int(it.get("quantidade") or 0) > match.estoque:
+                problems.append(
+                    OrderProblem(
+                        gtin,
+                        f"gtin {gtin}: quantidade {it.get('quantidade')} > estoque {match.estoque}",
+                        fatal=False,
+                    )
+                )
+        return problems
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+_STORE: Optional[CatalogueStore] = None
+_STORE_LOCK = threading.Lock()
+
+
+def get_catalogue_store() -> Optional[CatalogueStore]:
+    """Store compartilhado pelo processo em CATALOGUE_DB (None se não configurado)."""
+    global _STORE
+    path = os.getenv("CATALOGUE_DB", "").strip()
+    if not path:
+        return None
+    with _STORE_LOCK:
+        if _STORE is None:
+            try:
+                _STORE = CatalogueStore(path)
+            except (OSError, sqlite3.Error) as e:
+                log.warning("Catálogo local indisponível (%s): %s", path, e)
+                return None
+        return _STORE
+
+
+def catalogue_max_age() -> float:
+    """Idade máxima (s) do catálogo para validar pedidos; 0 = sem limite."""
+    return env_int("CATALOGUE_MAX_AGE_HOURS", 24) * 3600
@@ -0,0 +1,171 @@
+"""Circuit breaker por endpoint para as APIs de produtos e de pedidos.
+
+Fechado: tudo passa e os resultados entram numa janela das últimas
+CB_WINDOW chamadas. Se, com pelo menos CB_MIN_CALLS chamadas, a taxa de falha
+passar de CB_FAILURE_RATE, o circuito abre por CB_OPEN_SECS e ninguém envia.
+Depois disso fica meio-aberto: só CB_HALF_OPEN_PROBES requisições de sonda
+passam; sucesso fecha o circuito, falha reabre. Quem reservou uma sonda e
+não chegou a chamar a API devolve a reserva com ``release()``; reservas sem
+resultado expiram em CB_PROBE_TIMEOUT_SECS, para o circuito nunca ficar
+preso em meio-aberto.
+
+"Falha" aqui é erro de rede/timeout ou 408/429/5xx — um 4xx é problema da
+requisição, não do endpoint.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+from shared.config import env_float, env_int
+
+log = logging.getLogger(__name__)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+RETRYABLE_STATUS = frozenset({408, 429, 500, 502, 503, 504})
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        window: Optional[int] = None,
+        min_calls: Optional[int] = None,
+        failure_rate: Optional[float] = None,
+        open_secs: Optional[float] = None,
+        half_open_probes: Optional[int] = None,
+        probe_timeout: Optional[float] = None,
+        clock=time.monotonic,
+    ):
+        self.name = name
+        self.window = max(1, window or env_int("CB_WINDOW", 20))
+        self.min_calls = max(1, min_calls or env_int("CB_MIN_CALLS", 3))
+        self.failure_rate = (
+            failure_rate if failure_rate is not None else env_float("CB_FAILURE_RATE", 0.5)
+        )
+        self.open_secs = open_secs if open_secs is not None else env_float("CB_OPEN_SECS", 60.0)
+        self.half_open_probes = max(1, half_open_probes or env_int("CB_HALF_OPEN_PROBES", 1))
+        self.probe_timeout = (
+            probe_timeout
+            if probe_timeout is not None
+            else env_float("CB_PROBE_TIMEOUT_SECS", 120.0)
+        )
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._results: deque = deque(maxlen=self.window)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes: deque = deque()  # instantes das sondas reservadas
+        self.stats = {"rejected": 0, "opened": 0, "probes_expired": 0}
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        if self._state == OPEN and self._clock() - self._opened_at >= self.open_secs:
+            self._state = HALF_OPEN
+            self._probes.clear()
+            log.info("Circuito '%s' meio-aberto: liberando sonda.", self.name)
+        if self._state == HALF_OPEN:
+            now = self._clock()
+            while self._probes and now - self._probes[0] >= self.probe_timeout:
+                self._probes.popleft()
+                self.stats["probes_expired"] += 1
+                log.warning("Circuito '%s': sonda sem resultado expirou.", self.name)
+        return self._state
+
+    def retry_after(self) -> float:
+        """Segundos até o circuito aceitar uma sonda (0 se já aceita chamadas)."""
+        with self._lock:
+            state = self._current_state()
+            if state == OPEN:
+                return max(0.0, self.open_secs - (self._clock() - self._opened_at))
+            if state == HALF_OPEN and len(self._probes) >= self.half_open_probes:
+                # Sondas em voo: a próxima vaga abre quando a mais antiga expirar.
+                return max(0.0, self.probe_timeout - (self._clock() - self._probes[0]))
+            return 0.0
+
+    def allow(self) -> bool:
+        """True se a chamada pode seguir; em meio-aberto, reserva uma sonda."""
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and len(self._probes) < self.half_open_probes:
+                self._probes.append(self._clock())
+                return True
+            self.stats["rejected"] += 1
+            return False
+
+    def release(self) -> None:
+        """Devolve a sonda reservada por ``allow()`` quando a chamada não aconteceu
+        (ou terminou sem resultado); fora de meio-aberto não faz nada."""
+        with self._lock:
+            if self._state == HALF_OPEN and self._probes:
+                self._probes.popleft()
+
+    def _open(self) -> None:
+        self._state = OPEN
+        self._opened_at = self._clock()
+        self._probes.clear()
+        self.stats["opened"] += 1
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state == HALF_OPEN:
+                log.info("Circuito '%s' fechado: sonda OK.", self.name)
+                self._state = CLOSED
+                self._results.clear()
+            self._results.append(True)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            if self._state == HALF_OPEN:
+                log.warning(
+                    "Circuito '%s' reaberto: sonda falhou (%.0fs).", self.name, self.open_secs
+                )
+                self._open()
+                return
+            self._results.append(False)
+            if self._state != CLOSED or len(self._results) < self.min_calls:
+                return
+            failures = self._results.count(False)
+            if failures / len(self._results) >= self.failure_rate:
+                log.error(
+                    "Circuito '%s' aberto: %d/%d falhas recentes; pausando envios por %.0fs.",
+                    self.name,
+                    failures,
+                    len(self._results),
+                    self.open_secs,
+                )
+                self._open()
+
+    def record_status(self, status: int) -> None:
+        if status in RETRYABLE_STATUS:
+            self.record_failure()
+        else:
+            self.record_success()
+
+
+_BREAKERS: Dict[str, CircuitBreaker] = {}
+_BREAKERS_LOCK = threading.Lock()
+
+
+def endpoint_key(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}{parts.path}"
+
+
+def get_breaker(url: str) -> CircuitBreaker:
+    """Breaker compartilhado pelo processo para o endpoint (esquema + host + path)."""
+    key = endpoint_key(url)
+    with _BREAKERS_LOCK:
+        breaker = _BREAKERS.get(key)
+        if breaker is None:
+            breaker = _BREAKERS[key] = CircuitBreaker(key)
+        return breaker
@@ -0,0 +1,56 @@
+"""Leitura única do .env e helpers de variáveis de ambiente (consumers e scraper).
+
+python-dotenv é opcional.
+"""
+
+import os
+
+_ENV_LOADED = False
+
+
+def load_env() -> None:
+    """Carrega o .env uma única vez por processo."""
+    global _ENV_LOADED
+    if _ENV_LOADED:
+        return
+    _ENV_LOADED = True
+    try:
+        from dotenv import load_dotenv
+    except ImportError:
+        return
+    load_dotenv()
+
+
+def env_int(name: str, default: int) -> int:
+    v = os.getenv(name)
+    if v is None:
+        return default
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        return default
+
+
+def env_float(name: str, default: float) -> float:
+    v = os.getenv(name)
+    if v is None:
+        return default
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return default
+
+
+def env_bool(name: str, default: bool) -> bool:
+    v = os.getenv(name)
+    if v is None:
+        return default
+    return v.strip().lower() in ("1", "true", "yes", "on")
+
+
+def env_bool_any(names: list[str], default: bool) -> bool:
+    """Lê a primeira env existente em names, útil para compat ('AUTOTHROTTLE' vs 'AUTOTHROTTLE_ENABLED')."""
+    for n in names:
+        if os.getenv(n) is not None:
+            return env_bool(n, default)
+    return default
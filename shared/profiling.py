@@ -0,0 +1,203 @@
+"""Perfil de CPU (cProfile) e de memória (tracemalloc) de um job.
+
+Ligado por env: SCRAPER_PROFILE no worker do scraper (start_scrap, repassado
+ao run_spider.py como ``--profile``; rodando o spider à mão, ``--profile`` ou
+SERVIMED_PROFILE) e ORDER_PROFILE no consumer de pedidos, com ``cpu`` ou
+``mem``. Cada job grava em PROFILE_DIR (default ``profiles/``) arquivos
+``<nome>-<tag>-<data>-<pid>``, com a tag vinda do id do job:
+
+- cpu: ``.pstats`` (``python -m pstats``, snakeviz, ou flamegraph com
+  flameprof/gprof2dot) e ``.txt`` com as PROFILE_TOP funções de maior tempo
+  acumulado;
+- mem: ``.mem.txt`` com as maiores alocações no fim do job e perto do pico.
+  O pico em bytes é acompanhado a cada PROFILE_MEM_INTERVAL segundos; o
+  snapshot (caro: percorre todas as alocações) sai no máximo a cada
+  PROFILE_MEM_SNAPSHOT_SECS.
+
+Desligado, o custo é um teste de ``None`` por mensagem.
+"""
+
+import cProfile
+import io
+import logging
+import os
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+from shared.config import env_float, env_int
+
+logger = logging.getLogger(__name__)
+
+MODES = ("cpu", "mem")
+_ACTIVE = threading.local()
+
+
+def profile_mode(name: str) -> str | None:
+    """Modo pedido na env `name` (cpu/mem), ou None se desligado ou inválido."""
+    v = (os.getenv(name) or "").strip().lower()
+    if v in ("", "0", "false", "no", "off"):
+        return None
+    if v not in MODES:
+        logger.warning("%s=%r inválido (use cpu ou mem); perfil desligado.", name, v)
+        return None
+    return v
+
+
+def job_tag(*candidates) -> str:
+    """Primeiro id não vazio (message_id, id_pedido...), seguro para nome de arquivo."""
+    for c in candidates:
+        if c is not None and str(c).strip():
+            return re.sub(r"[^A-Za-z0-9._-]+", "_", str(c).strip())[:64]
+    return "job"
+
+
+class Profiler:
+    """cProfile ou tracemalloc entre ``start`` e ``stop`` (ou num ``with``)."""
+
+    def __init__(self, mode: str, name: str, tag=None, out_dir=None):
+        if mode not in MODES:
+            raise ValueError(f"modo de perfil inválido: {mode!r} (use cpu ou mem)")
+        self.mode = mode
+        self.name = name
+        self.tag = job_tag(tag)
+        self.out_dir = Path(out_dir or os.getenv("PROFILE_DIR", "profiles"))
+        self.top = max(1, env_int("PROFILE_TOP", 25))
+        self.interval = max(0.05, env_float("PROFILE_MEM_INTERVAL", 1.0))
+        self.snapshot_every = max(0.0, env_float("PROFILE_MEM_SNAPSHOT_SECS", 30.0))
+        self.paths: list[Path] = []
+        self._nested = False
+        self._t0 = 0.0
+        self._cpu: cProfile.Profile | None = None
+        self._own_tracemalloc = False
+        self._peak: tracemalloc.Snapshot | None = None
+        self._peak_bytes = 0
+        self._peak_at = 0.0
+        self._stop = threading.Event()
+        self._sampler: threading.Thread | None = None
+
+    def start(self) -> "Profiler":
+        # Aninhado (p.ex. flush do lote dentro da mensagem): o de fora já mede.
+        if getattr(_ACTIVE, "on", False):
+            self._nested = True
+            return self
+        _ACTIVE.on = True
+        self._t0 = time.monotonic()
+        if self.mode == "cpu":
+            self._cpu = cProfile.Profile()
+            self._cpu.enable()
+            return self
+        self._own_tracemalloc = not tracemalloc.is_tracing()
+        if self._own_tracemalloc:
+            tracemalloc.start(max(1, env_int("PROFILE_MEM_FRAMES", 1)))
+        tracemalloc.reset_peak()
+        self._sampler = threading.Thread(
+            target=self._sample, name="profile-mem", daemon=True
+        )
+        self._sampler.start()
+        return self
+
+    def stop(self) -> list[Path]:
+        if self._nested:
+            return self.paths
+        _ACTIVE.on = False
+        elapsed = time.monotonic() - self._t0
+        if self._cpu is not None:
+            self._cpu.disable()
+        if self._sampler is not None:
+            self._stop.set()
+            self._sampler.join()
+        try:
+            self.out_dir.mkdir(parents=True, exist_ok=True)
+            stamp = time.strftime("%Y%m%d-%H%M%S")
+            base = self.out_dir / f"{self.name}-{self.tag}-{stamp}-{os.getpid()}"
+            if self.mode == "cpu":
+                self._write_cpu(base, elapsed)
+            else:
+                self._write_mem(base, elapsed)
+        except OSError as e:
+            logger.warning("Falha ao gravar o perfil em %s: %s", self.out_dir, e)
+        finally:
+            if self._own_tracemalloc:
+                tracemalloc.stop()
+        return self.paths
+
+    def __enter__(self) -> "Profiler":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    # ---- cpu -------------------------------------------------------------
+
+    def _write_cpu(self, base: Path, elapsed: float) -> None:
+        dump = Path(f"{base}.pstats")
+        self._cpu.dump_stats(str(dump))
+        buf = io.StringIO()
+        stats = pstats.Stats(self._cpu, stream=buf)
+        stats.sort_stats("cumulative").print_stats(self.top)
+        report = Path(f"{base}.txt")
+        report.write_text(
+            f"# {self.name} tag={self.tag} pid={os.getpid()} duração={elapsed:.1f}s\n"
+            + buf.getvalue(),
+            encoding="utf-8",
+        )
+        self.paths += [dump, report]
+        logger.info("Perfil de CPU (%s, %.1fs) gravado em %s", self.tag, elapsed, dump)
+
+    # ---- mem -------------------------------------------------------------
+
+    def _snapshot(self) -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(
+            [
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__),
+            ]
+        )
+
+    def _sample(self) -> None:
+        # Num crawl a memória sobe quase sempre: o pico em bytes é barato de
+        # acompanhar, mas o snapshot só é refeito se passar 5% do último e tiver
+        # passado snapshot_every desde ele.
+        last = float("-inf")
+        while not self._stop.wait(self.interval):
+            current, _ = tracemalloc.get_traced_memory()
+            now = time.monotonic()
+            if current > self._peak_bytes * 1.05 and now - last >= self.snapshot_every:
+                self._peak = self._snapshot()
+                self._peak_bytes = current
+                self._peak_at = now - self._t0
+                last = now
+
+    def _top(self, snapshot: tracemalloc.Snapshot) -> list[str]:
+        return [str(stat) for stat in snapshot.statistics("lineno")[: self.top]]
+
+    def _write_mem(self, base: Path, elapsed: float) -> None:
+        current, peak = tracemalloc.get_traced_memory()
+        end = self._snapshot()
+        if self._peak is None or current >= self._peak_bytes:
+            self._peak, self._peak_bytes, self._peak_at = end, current, elapsed
+        lines = [
+            f"# {self.name} tag={self.tag} pid={os.getpid()} duração={elapsed:.1f}s",
+            f"# memória rastreada: fim {current / 1e6:.1f} MB, pico {peak / 1e6:.1f} MB"
+            f" (snapshot do pico em {self._peak_at:.1f}s, {self._peak_bytes / 1e6:.1f} MB)",
+            "",
+            f"## Top {self.top} no pico",
+            *self._top(self._peak),
+            "",
+            f"## Top {self.top} no fim",
+            *self._top(end),
+        ]
+        report = Path(f"{base}.mem.txt")
+        report.write_text("\n".join(lines) + "\n", encoding="utf-8")
+        self.paths.append(report)
+        logger.info(
+            "Perfil de memória (%s): pico %.1f MB, fim %.1f MB — %s",
+            self.tag,
+            peak / 1e6,
+            current / 1e6,
+            report,
+        )
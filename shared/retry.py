@@ -0,0 +1,290 @@
+"""Retentativas com backoff exponencial via filas de atraso (TTL + dead-letter).
+
+Em vez de ``basic_nack(requeue=True)`` — que devolve a mensagem na hora e
+gera laço apertado durante uma queda da API ou do login — a mensagem é
+republicada no exchange fanout ``<fila>.delay.<N>ms``, ligado à fila de
+atraso de mesmo nome, sem consumidores. O TTL da fila expira e o dead-letter
+a manda para o exchange da política (o padrão, ou o de roteamento por conta)
+com a routing key da publicação (a fila, ou o shard da conta). O
+header ``x-attempt`` conta as tentativas; passando de RETRY_MAX_ATTEMPTS a
+mensagem vai para ``<fila>.parking``, de onde pode ser inspecionada e
+reenviada. A republicação usa publisher confirms: a entrega original só
+recebe ACK depois que o broker confirmar a cópia.
+
+
+
+    python -m shared.retry list queue.start_scrapy
+    python -m shared.retry replay queue.start_scrapy --limit 10
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+import weakref
+from typing import Any, Optional
+
+import pika
+
+from shared.config import env_int, load_env
+
+log = logging.getLogger(__name__)
+
+ATTEMPT_HEADER = "x-attempt"
+ERROR_HEADER = "x-last-error"
+EXCHANGE_HEADER = "x-original-exchange"
+ROUTING_KEY_HEADER = "x-original-routing-key"
+RETRY, PARKED = "retry", "parked"
+
+_confirming: "weakref.WeakSet" = weakref.WeakSet()
+
+
+def attempt_of(properties: Any) -> int:
+    headers = getattr(properties, "headers", None) or {}
+    try:
+        return int(headers.get(ATTEMPT_HEADER, 0))
+    except (TypeError, ValueError):
+        return 0
+
+
+class RetryPolicy:
+    """Backoff da fila `queue`: atraso da tentativa n = base * factor^(n-1), até max.
+
+    `exchange` é para onde as filas de atraso devolvem as mensagens ("" = o
+    exchange padrão, que entrega pela routing key = nome da fila).
+    """
+
+    def __init__(
+        self,
+        queue: str,
+        max_attempts: Optional[int] = None,
+        base_ms: Optional[int] = None,
+        factor: Optional[int] = None,
+        max_ms: Optional[int] = None,
+        exchange: str = "",
+    ):
+        self.queue = queue
+        self.exchange = exchange
+        if max_attempts is None:
+            max_attempts = env_int("RETRY_MAX_ATTEMPTS", 5)
+        self.max_attempts = max(0, max_attempts)
+        self.base_ms = max(1, base_ms or env_int("RETRY_BASE_MS", 10_000))
+        self.factor = max(1, factor or env_int("RETRY_FACTOR", 3))
+        self.max_ms = max(self.base_ms, max_ms or env_int("RETRY_MAX_MS", 30 * 60_000))
+        self.parking_queue = f"{queue}.parking"
+        self._declared_on = None
+
+    def delay_ms(self, attempt: int) -> int:
+        return min(self.base_ms * self.factor ** max(0, attempt - 1), self.max_ms)
+
+    def retry_queue(self, attempt: int) -> str:
+        # O nome carrega o TTL: mudar o backoff cria filas novas em vez de
+        # esbarrar em PRECONDITION_FAILED ao redeclarar com outro x-message-ttl.
+        return f"{self.queue}.delay.{self.delay_ms(attempt)}ms"
+
+    def declare(self, ch) -> None:
+        """Declara os exchanges/filas de atraso e a de parking (idempotente por canal)."""
+        if self._declared_on is ch:
+            return
+        for delay in sorted({self.delay_ms(n) for n in range(1, self.max_attempts + 1)}):
+            name = f"{self.queue}.delay.{delay}ms"
+            # Sem x-dead-letter-routing-key: o dead-letter mantém a routing key
+            # da publicação (a original, via fanout).
+            ch.exchange_declare(exchange=name, exchange_type="fanout", durable=True)
+            ch.queue_declare(
+                queue=name,
+                durable=True,
+                arguments={"x-message-ttl": delay, "x-dead-letter-exchange": self.exchange},
+            )
+            ch.queue_bind(queue=name, exchange=name)
+        ch.queue_declare(queue=self.parking_queue, durable=True)
+        self._declared_on = ch
+
+
+def _enable_confirms(ch) -> None:
+    """Liga publisher confirms no canal (uma vez por canal).
+
+    Com eles o ``basic_publish`` do BlockingChannel só retorna depois do ack
+    do broker e levanta NackError/UnroutableError se a cópia não foi aceita.
+    """
+    if ch in _confirming or getattr(ch, "_delivery_confirmation", False):
+        return
+    ch.confirm_delivery()
+    _confirming.add(ch)
+
+
+def _copy_properties(properties: Any, headers: dict) -> pika.BasicProperties:
+    return pika.BasicProperties(
+        content_type=getattr(properties, "content_type", None),
+        content_encoding=getattr(properties, "content_encoding", None),
+        correlation_id=getattr(properties, "correlation_id", None),
+        reply_to=getattr(properties, "reply_to", None),
+        message_id=getattr(properties, "message_id", None),
+        delivery_mode=2,
+        headers=headers,
+    )
+
+
+def retry_later(
+    ch,
+    method,
+    properties,
+    body: bytes,
+    policy: RetryPolicy,
+    reason: str = "",
+    count_attempt: bool = True,
+    routing_key: Optional[str] = None,
+) -> str:
+    """Agenda a mensagem para depois (ou estaciona) e faz ACK da entrega atual.
+
+    Com ``count_attempt=False`` (p.ex. circuito aberto: a mensagem nem foi
+    tentada) o atraso usa a tentativa atual e o contador não avança.
+    `routing_key` é a chave com que ela volta por ``policy.exchange`` (padrão:
+    ``policy.queue``). A republicação é confirmada pelo broker antes do ACK;
+    se falhar ou não for confirmada, cai para ``basic_nack(requeue=True)``
+    para não perder a mensagem. Retorna RETRY ou PARKED.
+    """
+    policy.declare(ch)
+    attempt = attempt_of(properties) + 1 if count_attempt else max(1, attempt_of(properties))
+    headers = {
+        k: v
+        for k, v in (getattr(properties, "headers", None) or {}).items()
+        if k != "x-death"
+    }
+    headers[ATTEMPT_HEADER] = attempt if count_attempt else attempt_of(properties)
+    if reason:
+        headers[ERROR_HEADER] = str(reason)[:500]
+    key = routing_key or policy.queue
+
+    if attempt > policy.max_attempts:
+        headers["x-original-queue"] = policy.queue
+        headers[EXCHANGE_HEADER] = policy.exchange
+        headers[ROUTING_KEY_HEADER] = key
+        headers["x-parked-at"] = int(time.time())
+        target, outcome = policy.parking_queue, PARKED
+        exchange, key = "", target
+    else:
+        target, outcome = policy.retry_queue(attempt), RETRY
+        exchange = target
+
+    try:
+        _enable_confirms(ch)
+        ch.basic_publish(
+            exchange=exchange,
+            routing_key=key,
+            body=body,
+            properties=_copy_properties(properties, headers),
+            mandatory=True,
+        )
+    except Exception as e:
+        log.warning("Falha ao agendar retentativa (%s); NACK requeue.", e)
+        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+        return RETRY
+    ch.basic_ack(delivery_tag=method.delivery_tag)
+
+    if outcome == PARKED:
+        log.error(
+            "Mensagem estacionada em '%s' após %d tentativas (%s).",
+            target,
+            attempt - 1,
+            reason or "sem motivo",
+        )
+    else:
+        log.warning(
+            "Tentativa %d/%d reagendada em %.0fs (%s).",
+            attempt,
+            policy.max_attempts,
+            policy.delay_ms(attempt) / 1000,
+            reason or "sem motivo",
+        )
+    return outcome
+
+
+# --------------------------------------------------------------------------
+# CLI
+# --------------------------------------------------------------------------
+
+
+def _channel():
+    params = pika.ConnectionParameters(
+        host=os.getenv("RABBIT_HOST", "localhost"),
+        port=env_int("RABBIT_PORT", 5672),
+        credentials=pika.PlainCredentials(
+            os.getenv("RABBIT_USER", "guest"), os.getenv("RABBIT_PASS", "guest")
+        ),
+    )
+    ch = pika.BlockingConnection(params).channel()
+    # replay só faz ACK no parking depois que o broker confirmar a cópia.
+    _enable_confirms(ch)
+    return ch
+
+
+def _list(ch, policy: RetryPolicy, limit: int) -> int:
+    # basic_get sem ACK: as mensagens voltam para o parking quando o canal fecha.
+    shown = 0
+    while shown < limit:
+        frame, props, body = ch.basic_get(queue=policy.parking_queue, auto_ack=False)
+        if frame is None:
+            break
+        shown += 1
+        headers = props.headers or {}
+        parked = headers.get("x-parked-at")
+        when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(parked)) if parked else "?"
+        print(
+            f"#{shown} tentativas={headers.get(ATTEMPT_HEADER, 0)} estacionada={when} "
+            f"erro={headers.get(ERROR_HEADER, '')!r}"
+        )
+        print(f"    {body[:300].decode('utf-8', errors='replace')}")
+    print(f"{shown} mensagem(ns) em '{policy.parking_queue}'.")
+    return 0
+
+
+def _replay(ch, policy: RetryPolicy, limit: int) -> int:
+    replayed = 0
+    while replayed < limit:
+        frame, props, body = ch.basic_get(queue=policy.parking_queue, auto_ack=False)
+        if frame is None:
+            break
+        headers = {
+            k: v
+            for k, v in (props.headers or {}).items()
+            if k not in (ATTEMPT_HEADER, "x-parked-at", "x-death")
+        }
+        # Volta pelo mesmo caminho das retentativas (shard da conta, se houver).
+        exchange = headers.pop(EXCHANGE_HEADER, "")
+        routing_key = headers.pop(ROUTING_KEY_HEADER, None) or policy.queue
+        ch.basic_publish(
+            exchange=exchange,
+            routing_key=routing_key,
+            body=body,
+            properties=_copy_properties(props, headers),
+            mandatory=True,
+        )
+        ch.basic_ack(delivery_tag=frame.delivery_tag)
+        replayed += 1
+    print(f"{replayed} mensagem(ns) reenviada(s) a partir de '{policy.parking_queue}'.")
+    return 0
+
+
+def main(argv=None) -> int:
+    load_env()
+    p = argparse.ArgumentParser(description="Inspeciona e reenvia mensagens estacionadas.")
+    p.add_argument("command", choices=["list", "replay"])
+    p.add_argument("queue", help="Fila original (p.ex. queue.start_scrapy).")
+    p.add_argument("--limit", type=int, default=50)
+    args = p.parse_args(argv)
+
+    ch = _channel()
+    policy = RetryPolicy(args.queue)
+    try:
+        ch.queue_declare(queue=policy.parking_queue, durable=True)
+        if args.command == "list":
+            return _list(ch, policy, args.limit)
+        return _replay(ch, policy, args.limit)
+    finally:
+        ch.connection.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
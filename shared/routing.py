@@ -0,0 +1,272 @@
+"""Afinidade de conta: mensagens do mesmo usuário caem sempre no mesmo worker.
+
+Há SCRAPER_SHARDS filas fixas ``<fila>.shard.<n>`` e o usuário escolhe a fila
+por hash consistente. Assim, mudar o número de shards move só ~1/N das contas.
+O modo vem de SCRAPER_ROUTING:
+
+- ``ring``: o publisher calcula a fila num anel com nós virtuais e publica
+  direto nela;
+- ``exchange``: o publisher manda para um exchange ``x-consistent-hash``
+  (plugin rabbitmq_consistent_hash_exchange) com routing key = conta, e o
+  broker escolhe a fila;
+- ``off`` (padrão): fila única, como antes.
+
+Todo ConsumerServimed consome a fila base, então o nº de consumers dela é o
+nº de workers vivos. Cada worker fica com até ceil(SCRAPER_SHARDS / workers)
+shards (consumer exclusivo; SCRAPER_SHARDS_PER_WORKER limita mais, e
+SCRAPER_SHARD_ID fixa um shard só). A cada SCRAPER_SHARD_RECLAIM_SECS o worker
+refaz a conta: devolve o que passou da cota (um worker novo subiu) e assume
+shards livres até a cota (um worker caiu). O publisher só manda para shards
+com consumer: no modo ring a conta de um shard órfão vai para a fila base; no
+modo exchange, com qualquer shard órfão, tudo vai para a fila base até os
+shards serem assumidos.
+
+As retentativas (``shared.retry``) voltam por ``dead_letter_exchange`` com a
+routing key de ``routing_key(usuario)``, então caem no mesmo shard.
+"""
+
+import bisect
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+import pika
+
+from shared.config import env_int
+
+log = logging.getLogger(__name__)
+
+OFF, RING, EXCHANGE = "off", "ring", "exchange"
+
+
+def account_key(usuario: str) -> str:
+    return (usuario or "").strip().lower()
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """Anel de hash consistente com `vnodes` pontos por nó."""
+
+    def __init__(self, nodes: Iterable = (), vnodes: int = 64):
+        self.vnodes = max(1, vnodes)
+        self._points: list[int] = []
+        self._owners: dict[int, object] = {}
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node) -> None:
+        for i in range(self.vnodes):
+            point = _hash(f"{node}#{i}")
+            if point in self._owners:
+                continue
+            bisect.insort(self._points, point)
+            self._owners[point] = node
+
+    def remove(self, node) -> None:
+        keep = [p for p in self._points if self._owners[p] != node]
+        for p in set(self._points) - set(keep):
+            del self._owners[p]
+        self._points = keep
+
+    def node_for(self, key: str):
+        if not self._points:
+            raise LookupError("anel vazio")
+        idx = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[self._points[idx]]
+
+
+class AccountRouter:
+    def __init__(
+        self,
+        queue: Optional[str] = None,
+        mode: Optional[str] = None,
+        shards: Optional[int] = None,
+        exchange: Optional[str] = None,
+    ):
+        self.queue = queue or os.getenv("RABBIT_QUEUE_SCRAPER", "queue.start_scrapy")
+        self.mode = (mode or os.getenv("SCRAPER_ROUTING", OFF)).strip().lower()
+        if self.mode not in (OFF, RING, EXCHANGE):
+            log.warning("SCRAPER_ROUTING=%r desconhecido; usando fila única.", self.mode)
+            self.mode = OFF
+        self.shards = max(1, shards or env_int("SCRAPER_SHARDS", 4))
+        self.exchange = exchange or os.getenv("RABBIT_EXCHANGE_SCRAPER", f"{self.queue}.hash")
+        self.ring = HashRing(range(self.shards), vnodes=env_int("ROUTING_VNODES", 64))
+        self.check_secs = env_int("ROUTING_CHECK_SECS", 10)
+        self._live: Optional[set] = None
+        self._live_at = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != OFF
+
+    def shard_queue(self, shard: int) -> str:
+        return f"{self.queue}.shard.{shard}"
+
+    def shard_for(self, usuario: str) -> int:
+        return self.ring.node_for(account_key(usuario))
+
+    @property
+    def dead_letter_exchange(self) -> str:
+        """Exchange para onde as filas de atraso devolvem as mensagens."""
+        return self.exchange if self.mode == EXCHANGE else ""
+
+    def routing_key(self, usuario: str) -> str:
+        """Routing key que leva a conta ao seu shard por ``dead_letter_exchange``."""
+        if self.mode == EXCHANGE:
+            return account_key(usuario)
+        if self.mode == RING:
+            return self.shard_queue(self.shard_for(usuario))
+        return self.queue
+
+    def declare(self, ch) -> None:
+        """Declara filas de shard (e o exchange com os bindings, no modo exchange)."""
+        ch.queue_declare(queue=self.queue, durable=True)
+        if not self.enabled:
+            return
+        if self.mode == EXCHANGE:
+            ch.exchange_declare(
+                exchange=self.exchange, exchange_type="x-consistent-hash", durable=True
+            )
+        for n in range(self.shards):
+            ch.queue_declare(queue=self.shard_queue(n), durable=True)
+            if self.mode == EXCHANGE:
+                # No x-consistent-hash a routing key do binding é o peso da fila.
+                ch.queue_bind(queue=self.shard_queue(n), exchange=self.exchange, routing_key="1")
+
+    def consumers(self, ch, shard: int) -> int:
+        return ch.queue_declare(queue=self.shard_queue(shard), durable=True).method.consumer_count
+
+    def workers(self, ch) -> int:
+        """Workers vivos: todo worker consome a fila base."""
+        return max(1, ch.queue_declare(queue=self.queue, durable=True).method.consumer_count)
+
+    def fair_share(self, ch) -> int:
+        return -(-self.shards // self.workers(ch))
+
+    def live_shards(self, ch) -> set:
+        """Shards com consumer, reconsultados a cada ROUTING_CHECK_SECS."""
+        now = time.monotonic()
+        if self._live is None or now - self._live_at >= self.check_secs:
+            self._live = {n for n in range(self.shards) if self.consumers(ch, n)}
+            self._live_at = now
+            orphans = sorted(set(range(self.shards)) - self._live)
+            if orphans:
+                log.warning(
+                    "Shards sem consumer: %s; as contas deles vão para a fila base.", orphans
+                )
+        return self._live
+
+    def publish(
+        self, ch, body: bytes, usuario: str, properties: Optional[pika.BasicProperties] = None
+    ) -> None:
+        properties = properties or pika.BasicProperties(delivery_mode=2)
+        target = self.queue
+        if self.enabled:
+            live = self.live_shards(ch)
+            if self.mode == EXCHANGE:
+                # O broker escolhe o shard: só roteia com todos eles consumidos.
+                if len(live) == self.shards:
+                    ch.basic_publish(
+                        exchange=self.exchange,
+                        routing_key=self.routing_key(usuario),
+                        body=body,
+                        properties=properties,
+                    )
+                    return
+            else:
+                shard = self.shard_for(usuario)
+                if shard in live:
+                    target = self.shard_queue(shard)
+        ch.basic_publish(exchange="", routing_key=target, body=body, properties=properties)
+
+    def claim_shards(
+        self,
+        connection,
+        callback,
+        shard_ids: Optional[Iterable[int]] = None,
+        limit: Optional[int] = None,
+        prefetch: int = 1,
+        skip: Iterable[int] = (),
+    ) -> dict:
+        """Consome com consumer exclusivo cada shard sem consumer entre `shard_ids`
+        (todos por padrão), até `limit`. Um canal por shard, porque a recusa do
+        exclusivo fecha o canal. Retorna {shard: canal}.
+        """
+        candidates = list(shard_ids) if shard_ids is not None else list(range(self.shards))
+        skip = set(skip)
+        claimed: dict = {}
+        probe = connection.channel()
+        try:
+            self.declare(probe)
+            for shard in candidates:
+                if shard in skip or (limit is not None and len(claimed) >= limit):
+                    continue
+                if self.consumers(probe, shard):
+                    continue
+                ch = connection.channel()
+                ch.basic_qos(prefetch_count=prefetch)
+                try:
+                    ch.basic_consume(
+                        queue=self.shard_queue(shard),
+                        on_message_callback=callback,
+                        auto_ack=False,
+                        exclusive=True,
+                    )
+                except pika.exceptions.ChannelClosedByBroker as e:
+                    log.info("Shard %d ocupado (%s).", shard, e.reply_text)
+                    continue
+                claimed[shard] = ch
+        finally:
+            if probe.is_open:
+                probe.close()
+        self._live = None
+        return claimed
+
+    def release(self, claimed: dict, keep: int) -> list:
+        """Fecha os canais dos shards além dos `keep` primeiros de `claimed`
+        (o broker devolve à fila o que não foi ACKado). Retorna os shards soltos."""
+        extra = sorted(claimed)[max(0, keep):]
+        for shard in extra:
+            ch = claimed.pop(shard)
+            if ch.is_open:
+                ch.close()
+        if extra:
+            self._live = None
+        return extra
+
+
+class AffinityStats:
+    """Quantas mensagens chegaram para contas que este worker já atendeu
+    recentemente (sessão, page size e tokens ainda quentes)."""
+
+    def __init__(self, ttl_secs: Optional[float] = None, max_accounts: int = 10_000):
+        self.ttl = ttl_secs if ttl_secs is not None else env_int("AFFINITY_TTL_SECS", 6 * 3600)
+        self.max_accounts = max_accounts
+        self._seen: "OrderedDict[str, float]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, usuario: str) -> bool:
+        key = account_key(usuario)
+        now = time.monotonic()
+        last = self._seen.pop(key, None)
+        hit = last is not None and now - last <= self.ttl
+        self._seen[key] = now
+        while len(self._seen) > self.max_accounts:
+            self._seen.popitem(last=False)
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return hit
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0